@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Compare two benchmark results (benchmarks/run.py or yaal bench --out).
+
+Prints throughput and p50 / p99 latency changes per scale and descriptor,
+and exits 1 when any of them regressed by more than --threshold percent.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from yaal_bench import compare_results  # noqa: E402
+
+
+def _scales(result):
+    """{users: run_bench result} from a run.py file or a single yaal bench result."""
+    if "scales" in result:
+        return result["scales"]
+    return {str(result["scale"]["users"]): result}
+
+
+def _pct(value):
+    return "-" if value is None else "%+.1f%%" % value
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Regression threshold in percent (default: 10)")
+    ns = parser.parse_args(argv)
+
+    base = _scales(json.loads(Path(ns.base).read_text()))
+    new = _scales(json.loads(Path(ns.new).read_text()))
+    regressed = False
+    print("%-8s %-16s %12s %10s %10s" % ("users", "descriptor", "throughput", "p50", "p99"))
+    for users, result in new.items():
+        if users not in base:
+            continue
+        for row in compare_results(base[users], result, ns.threshold):
+            regressed = regressed or row["regressed"]
+            print("%-8s %-16s %12s %10s %10s%s" % (
+                users, row["descriptor"], _pct(row["throughput_pct"]), _pct(row["p50_pct"]),
+                _pct(row["p99_pct"]), "  REGRESSED" if row["regressed"] else "",
+            ))
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Run the yaal bench suite at several scales and save one JSON file per commit.
+
+Each scale seeds a fresh SQLite database (docker/sqlite/schema.sql) with that
+many users (roles: users / 100, two per user) and benchmarks every fixture
+descriptor; see yaal_bench. The result, {"commit", "scales": {users: result}},
+goes to benchmarks/results/<commit>.json unless --out is given. Compare two
+of them with benchmarks/compare.py.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from yaal_bench import run_bench  # noqa: E402
+
+DEFAULT_SCALES = "1000,10000,100000"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default=DEFAULT_SCALES,
+                        help="Comma-separated user counts, e.g. 1000,1000000 "
+                        "(default: %s)" % DEFAULT_SCALES)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--max-seconds", type=float, default=20.0,
+                        help="Per descriptor and scale (default: 20)")
+    parser.add_argument("--only", action="append", default=None, metavar="PATH")
+    parser.add_argument("--out", default=None)
+    ns = parser.parse_args(argv)
+
+    scales = [int(value) for value in ns.scales.split(",") if value.strip()]
+    results = {}
+    commit = None
+    for users in scales:
+        print("users=%d" % users, file=sys.stderr)
+        result = run_bench(
+            users=users, iterations=ns.iterations, max_seconds=ns.max_seconds,
+            descriptors=ns.only,
+            progress=lambda path: print("  %s" % path, file=sys.stderr),
+        )
+        commit = result["commit"]
+        results[str(users)] = result
+
+    out = Path(ns.out) if ns.out else ROOT / "benchmarks" / "results" / (
+        "%s.json" % (commit[:12] if commit else "working-tree"))
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({"commit": commit, "scales": results}, indent=2) + "\n")
+    print(out)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Compare per-request time of Yaal(codegen=True) with the interpreted mapper.
+
+Seeds a temp SQLite DB with --users users (two roles each), then for each
+fixture query reports the best of --repeat runs: the whole request, and the
+row shaping step alone (map_output versus the generated mapper, fed the same
+RowSet).
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from yaal import Yaal  # noqa: E402
+from yaal_executor import map_output, output_plan  # noqa: E402
+
+API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+QUERIES = (
+    ("user/list", None),
+    ("user/page", {"page": 1, "page_size": 1000}),
+    ("user/get", {"id": 1}),
+)
+
+
+def _seed(db_path: str, users: int) -> None:
+    con = sqlite3.connect(db_path)
+    con.executescript(SCHEMA.read_text())
+    con.executemany(
+        "INSERT INTO users (user_id, user_name, active) VALUES (?, ?, 1)",
+        ((i, "user%d" % i) for i in range(3, users + 1)),
+    )
+    con.executemany(
+        "INSERT INTO user_roles (user_id, role_id) VALUES (?, ?)",
+        ((i, r) for i in range(3, users + 1) for r in (1, 2)),
+    )
+    con.commit()
+    con.close()
+
+
+def _best(fn, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    ns = parser.parse_args(argv)
+
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        _seed(db_path, ns.users)
+        url = "sqlite3:///" + db_path
+        interpreted, generated = Yaal(str(API)), Yaal(str(API), codegen=True)
+        for y in (interpreted, generated):
+            y.setup_data_provider("db", url)
+
+        print("%-12s %12s %12s %12s %12s" % (
+            "query", "request", "+codegen", "shaping", "+codegen"))
+        for path, args in QUERIES:
+            assert interpreted.query(path, args=args) == generated.query(path, args=args)
+            descriptor = generated._load_descriptor(path)
+            mapper, captured = descriptor["_mapper"], []
+            descriptor["_mapper"] = lambda rs: captured.append(rs) or mapper(rs)
+            generated.query(path, args=args)
+            descriptor["_mapper"] = mapper
+            rs, plan = captured[0], output_plan(descriptor)
+
+            print("%-12s %10.2fms %10.2fms %10.2fms %10.2fms" % (
+                path,
+                1000 * _best(lambda: interpreted.query(path, args=args), ns.repeat),
+                1000 * _best(lambda: generated.query(path, args=args), ns.repeat),
+                1000 * _best(lambda: map_output(plan, rs), ns.repeat),
+                1000 * _best(lambda: mapper(rs), ns.repeat),
+            ))
+    finally:
+        os.unlink(db_path)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
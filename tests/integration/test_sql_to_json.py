@@ -75,6 +75,19 @@ class SqlToJsonMixin:
         )
 
 
+class ServerCursorMixin:
+    """Postgres named cursors / MySQL unbuffered reads (server_cursor URL key)."""
+
+    def test_server_cursor_results_match(self):
+        plain = _build_yaal(self.db_url)
+        server = _build_yaal(self.db_url + "?server_cursor=true&itersize=1")
+        for path in ("user/list", "user/nested"):
+            with self.subTest(path=path):
+                self.assertEqual(server.query(path), plain.query(path))
+                self.assertEqual(list(server.query_iter(path)), list(plain.query_iter(path)))
+        self.assertEqual(_fetch_user(server, 1), _fetch_user(plain, 1))
+
+
 class TestSqliteIntegration(SqlToJsonMixin, unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -98,7 +111,7 @@ class TestSqliteIntegration(SqlToJsonMixin, unittest.TestCase):
     os.environ.get("YAAL_INTEGRATION") == "1",
     "set YAAL_INTEGRATION=1 with docker compose up",
 )
-class TestPostgresIntegration(SqlToJsonMixin, unittest.TestCase):
+class TestPostgresIntegration(SqlToJsonMixin, ServerCursorMixin, unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         import psycopg2
@@ -116,7 +129,7 @@ class TestPostgresIntegration(SqlToJsonMixin, unittest.TestCase):
     os.environ.get("YAAL_INTEGRATION") == "1",
     "set YAAL_INTEGRATION=1 with docker compose up",
 )
-class TestMysqlIntegration(SqlToJsonMixin, unittest.TestCase):
+class TestMysqlIntegration(SqlToJsonMixin, ServerCursorMixin, unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         import mysql.connector
@@ -0,0 +1,210 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Async API: Yaal.aquery / aquery_json over native and thread-offloaded providers."""
+
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+import yaal_executor
+from yaal import Yaal, create_context
+from yaal_executor import aget_result
+from yaal_spill import SpilledRows
+from yaal_sqlite import SQLiteDataProvider
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class _AsyncProvider:
+
+    def __init__(self, rows, delay=0):
+        self._rows = rows
+        self._delay = delay
+        self.calls = []
+
+    async def begin(self):
+        self.calls.append("begin")
+
+    async def end(self):
+        self.calls.append("end")
+
+    async def error(self):
+        self.calls.append("error")
+
+    async def execute(self, twig, ctx, helper):
+        self.calls.append("execute")
+        await asyncio.sleep(self._delay)
+        return [dict(row) for row in self._rows], None
+
+
+class _AsyncManager:
+
+    def __init__(self, provider):
+        self._provider = provider
+
+    def get_context(self):
+        raise AssertionError("sync context requested")
+
+    def get_async_context(self):
+        return self._provider
+
+
+def _trunk():
+    return {
+        "path": "p",
+        "input_type": "object",
+        "output_type": "array",
+        "method": "$",
+        "connections": ["db"],
+        "model": {"output": None},
+        "twigs": [{"connection": "db", "content": [], "parameters": []}],
+    }
+
+
+class TestAsyncExecutor(unittest.IsolatedAsyncioTestCase):
+
+    async def test_commit_and_rollback(self):
+        descriptor = _trunk()
+        ok = _AsyncProvider([{"id": 1}])
+        self.assertEqual(await aget_result(descriptor, lambda _n: ok, create_context(descriptor)),
+                         [{"id": 1}])
+        self.assertEqual(ok.calls, ["begin", "execute", "end"])
+
+        failing = _AsyncProvider([{"$mode": "error", "message": "no"}])
+        result = await aget_result(descriptor, lambda _n: failing, create_context(descriptor))
+        self.assertEqual(result, {"errors": [{"$mode": "error", "message": "no"}]})
+        self.assertEqual(failing.calls, ["begin", "execute", "error"])
+
+    async def test_cancel_rolls_back(self):
+        descriptor = _trunk()
+        slow = _AsyncProvider([{"id": 1}], delay=10)
+        task = asyncio.ensure_future(
+            aget_result(descriptor, lambda _n: slow, create_context(descriptor))
+        )
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(slow.calls, ["begin", "execute", "error"])
+
+    async def test_native_async_manager(self):
+        y = Yaal(str(FIXTURE_API))
+        provider = _AsyncProvider([{"user_id": 1, "user_name": "a", "active": 1}])
+        y._data_providers["db"] = _AsyncManager(provider)
+        self.assertEqual(await y.aquery("user/list"), [{"id": 1, "name": "a", "active": 1}])
+
+
+class TestAsyncFixtures(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        con = sqlite3.connect(self._db_path)
+        con.executescript(SCHEMA.read_text())
+        con.close()
+        self._pool = ThreadPoolExecutor(max_workers=2)
+        self._yaal = Yaal(str(FIXTURE_API), offload_executor=self._pool)
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+
+    def tearDown(self):
+        self._pool.shutdown()
+        os.unlink(self._db_path)
+
+    async def test_matches_sync_query(self):
+        for path, args in (("user/list", None), ("user/nested", None),
+                           ("user/page", {"page": 1, "page_size": 10})):
+            with self.subTest(path=path):
+                self.assertEqual(await self._yaal.aquery(path, args=args),
+                                 self._yaal.query(path, args=args))
+                self.assertEqual(await self._yaal.aquery_json(path, args=args),
+                                 self._yaal.query_json(path, args=args))
+
+    async def test_concurrent_requests_share_small_pool(self):
+        results = await asyncio.gather(*[self._yaal.aquery("user/nested") for _ in range(50)])
+        expected = self._yaal.query("user/nested")
+        self.assertTrue(all(result == expected for result in results))
+
+    async def test_writes_commit(self):
+        result = await self._yaal.aquery("user/create", payload={"id": 7, "name": "neo"})
+        self.assertEqual(result["id"], 7)
+        con = sqlite3.connect(self._db_path)
+        try:
+            self.assertEqual(con.execute("SELECT user_name FROM users WHERE user_id = 7").fetchone(),
+                             ("neo",))
+        finally:
+            con.close()
+
+    async def test_soft_errors(self):
+        result = await self._yaal.aquery("user/create", payload={"name": "x"})
+        self.assertIn("errors", result)
+
+
+class TestAsyncSettings(unittest.IsolatedAsyncioTestCase):
+    """memory_budget, max_branch_workers and executemany_batch_size apply to aquery."""
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._db_path = os.path.join(self._tmp, "test.db")
+        with sqlite3.connect(self._db_path) as con:
+            con.executescript(SCHEMA.read_text())
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _yaal(self, api=FIXTURE_API, **options):
+        y = Yaal(str(api), **options)
+        y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        return y
+
+    async def test_memory_budget(self):
+        y = self._yaal(memory_budget={"max_rows": 1})
+        result = await y.aquery("user/list")
+        self.assertIn("memory budget", result["errors"][0]["message"])
+
+        expected = self._yaal().query("user/nested")
+        y = self._yaal(memory_budget={"spill_rows": 1, "spill_dir": self._tmp})
+        with mock.patch.object(SpilledRows, "finish", autospec=True,
+                               side_effect=SpilledRows.finish) as finish:
+            self.assertEqual(await y.aquery("user/nested"), expected)
+        self.assertEqual(finish.call_count, 1)
+
+    async def test_branch_workers(self):
+        expected = self._yaal().query("user/nested")
+        y = self._yaal(max_branch_workers=4)
+        prefetch = yaal_executor._aprefetch_branches
+        with mock.patch.object(yaal_executor, "_aprefetch_branches",
+                               side_effect=prefetch) as spy:
+            self.assertEqual(await y.aquery("user/nested"), expected)
+        self.assertEqual(spy.call_count, 1)
+
+    async def test_executemany_batch_size(self):
+        api = Path(self._tmp) / "api" / "bulk"
+        api.mkdir(parents=True)
+        (api / "$.sql").write_text("--(items[0].id! integer)--\n\nSELECT 1 AS ok\n")
+        (api / "$.items.sql").write_text(
+            "--(id! integer, name! string)--\n\n"
+            "INSERT INTO users (user_id, user_name, active) VALUES ({{id}}, {{name}}, 1)\n"
+        )
+        y = self._yaal(api.parent, executemany_batch_size=2)
+        items = [{"id": 10 + i, "name": "u%d" % i} for i in range(5)]
+        with mock.patch.object(SQLiteDataProvider, "execute_many", autospec=True,
+                               side_effect=SQLiteDataProvider.execute_many) as execute_many:
+            self.assertEqual(await y.aquery("bulk", payload={"items": items}),
+                             [{"ok": 1, "items": []}])
+        self.assertEqual([len(call.args[2]) for call in execute_many.call_args_list], [2, 2, 1])
+        with sqlite3.connect(self._db_path) as con:
+            self.assertEqual(con.execute("SELECT COUNT(*) FROM users").fetchone()[0], 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""yaal bench: seeded SQLite benchmark of the fixture descriptors, and result comparison."""
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+import yaal_cli
+from yaal_bench import WORKLOAD, compare_results, run_bench, seed
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+
+
+def _result(throughput, p50, p99):
+    return {"descriptors": {"user/get": {"throughput_per_s": throughput,
+                                         "latency_ms": {"p50": p50, "p99": p99}}}}
+
+
+class TestBench(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_seed_scale(self):
+        db = os.path.join(self._tmp, "bench.db")
+        scale = seed(db, users=300, roles_per_user=2)
+        self.assertEqual(scale, {"users": 300, "roles": 3, "roles_per_user": 2})
+        with sqlite3.connect(db) as con:
+            users = con.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            assignments = con.execute("SELECT COUNT(*) FROM user_roles").fetchone()[0]
+        # The schema's own two users keep their three assignments.
+        self.assertEqual((users, assignments), (300, 3 + 298 * 2))
+
+    def test_run_bench_reports_every_descriptor(self):
+        result = run_bench(users=50, iterations=3, warmup=1, stage_iterations=2,
+                           memory_iterations=1)
+        self.assertEqual(list(result["descriptors"]), [path for path, _f in WORKLOAD])
+        self.assertEqual(result["scale"]["users"], 50)
+        for path, stats in result["descriptors"].items():
+            self.assertEqual((stats["iterations"], stats["errors"]), (3, 0), path)
+            self.assertLessEqual(stats["latency_ms"]["p50"], stats["latency_ms"]["max"])
+            self.assertIn("execute", stats["stages_ms"])
+            self.assertGreater(stats["tracemalloc_peak_bytes"], 0)
+        self.assertEqual(result["descriptors"]["user/get"]["rows"], 1)
+        json.dumps(result)
+
+    def test_cli_out_and_reused_db(self):
+        out = os.path.join(self._tmp, "result.json")
+        db = os.path.join(self._tmp, "bench.db")
+        for _ in range(2):
+            with contextlib.redirect_stderr(io.StringIO()):
+                code = yaal_cli.main(["--api", str(FIXTURE_API), "bench", "--users", "40",
+                                      "--iterations", "2", "--memory-iterations", "0",
+                                      "--only", "user/get", "--only", "user/create",
+                                      "--db-file", db, "--out", out])
+            self.assertEqual(code, 0)
+        with open(out, encoding="utf-8") as f:
+            result = json.load(f)
+        self.assertEqual(sorted(result["descriptors"]), ["user/create", "user/get"])
+        self.assertEqual(result["seed_seconds"], 0.0)
+        self.assertIsNone(result["descriptors"]["user/get"]["tracemalloc_peak_bytes"])
+        with self.assertRaises(SystemExit):
+            yaal_cli.main(["--api", str(FIXTURE_API), "bench", "--only", "user/nope"])
+
+    def test_missing_api_is_reported(self):
+        missing = os.path.join(self._tmp, "api")
+        with self.assertRaises(SystemExit) as cm:
+            yaal_cli.main(["--api", missing, "bench", "--iterations", "1"])
+        self.assertIn("descriptor root not found: %s" % missing, str(cm.exception.code))
+        with self.assertRaises(ValueError):
+            run_bench(users=10, schema=os.path.join(self._tmp, "schema.sql"))
+
+    def test_compare_results(self):
+        base = _result(100.0, 1.0, 2.0)
+        (row,) = compare_results(base, _result(95.0, 1.05, 2.1))
+        self.assertEqual((row["throughput_pct"], row["p50_pct"], row["p99_pct"]), (-5.0, 5.0, 5.0))
+        self.assertFalse(row["regressed"])
+        self.assertTrue(compare_results(base, _result(80.0, 1.0, 2.0))[0]["regressed"])
+        self.assertTrue(compare_results(base, _result(100.0, 1.0, 3.0))[0]["regressed"])
+        self.assertEqual(compare_results(base, {"descriptors": {}}), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,228 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Branch dependency DAG (builder) and concurrent branch execution (executor)."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from yaal import Yaal, create_context
+from yaal_executor import get_result
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+def _write_api(root, files):
+    api = Path(root) / "r"
+    api.mkdir(parents=True)
+    for name, text in files.items():
+        (api / name).write_text(text)
+
+
+class TestAnnotateDependencies(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _deps(self, files):
+        # The output model fixes sibling order (directory listings are unordered).
+        names = sorted(name[2:-4] for name in files)
+        files = dict(files)
+        files["$.output.yaml"] = "type: object\nproperties:\n" + "".join(
+            "  %s:\n    type: array\n" % name for name in names
+        )
+        _write_api(self._root, files)
+        descriptor = Yaal(self._root).create_descriptor("r")
+        deps = {}
+
+        def walk(branch):
+            if "depends_on" in branch:
+                deps[branch["method"]] = branch["depends_on"]
+            for child in branch.get("branches") or []:
+                walk(child)
+
+        walk(descriptor)
+        return deps
+
+    def test_fixture_siblings_are_independent(self):
+        for path in ("user/page", "user/combine"):
+            descriptor = Yaal(str(FIXTURE_API)).create_descriptor(path)
+            with self.subTest(path=path):
+                self.assertEqual([b["depends_on"] for b in descriptor["branches"]], [[], []])
+
+    def test_params_reader_waits_for_mode_writer(self):
+        deps = self._deps({
+            "$.a.sql": "SELECT 'params' AS \"$mode\", 1 AS x",
+            "$.b.sql": "--($params.x integer)--\nSELECT {{$params.x}} AS x",
+            "$.c.sql": "SELECT 1 AS y",
+        })
+        self.assertEqual(deps, {"$.a": [], "$.b": ["$.a"], "$.c": []})
+
+    def test_writes_serialize_per_connection(self):
+        deps = self._deps({
+            "$.a.sql": "INSERT INTO t VALUES (1)",
+            "$.b.sql": "SELECT * FROM t",
+            "$.c.sql": "--sql(other)--\nSELECT * FROM t",
+        })
+        self.assertEqual(deps, {"$.a": [], "$.b": ["$.a"], "$.c": []})
+
+    def test_last_inserted_id_reader_is_a_barrier(self):
+        deps = self._deps({
+            "$.a.sql": "SELECT 1 AS a",
+            "$.b.sql": "--($params.$last_inserted_id integer)--\nSELECT {{$params.$last_inserted_id}} AS b",
+            "$.c.sql": "--sql(other)--\nSELECT 1 AS c",
+        })
+        self.assertEqual(deps, {"$.a": [], "$.b": ["$.a"], "$.c": ["$.b"]})
+
+
+class _SlowProvider:
+    """Returns twig["rows"] after twig["delay"]; "param" echoes a $params key, "raise" fails."""
+
+    def __init__(self, log):
+        self._log = log
+        self._busy = threading.Lock()
+
+    def begin(self):
+        pass
+
+    def end(self):
+        pass
+
+    def error(self):
+        pass
+
+    def execute(self, twig, ctx, helper):
+        if not self._busy.acquire(blocking=False):
+            raise AssertionError("connection used concurrently")
+        try:
+            self._log.append(("start", twig["id"]))
+            time.sleep(twig.get("delay", 0))
+            if "raise" in twig:
+                raise RuntimeError(twig["raise"])
+            if "param" in twig:
+                return [{"v": ctx.get_prop("$params").get_prop(twig["param"])}], None
+            return [dict(row) for row in twig["rows"]], None
+        finally:
+            self._log.append(("end", twig["id"]))
+            self._busy.release()
+
+
+def _branch(name, twig, depends_on=()):
+    return {
+        "name": name,
+        "method": "$." + name,
+        "input_type": "object",
+        "output_type": "array",
+        "twigs": [dict(twig, content=[], parameters=[], id=name)],
+        "depends_on": list(depends_on),
+    }
+
+
+def _trunk(*branches):
+    return {
+        "name": "$",
+        "method": "$",
+        "path": "p",
+        "input_type": "object",
+        "output_type": "object",
+        "connections": ["db", "other"],
+        "model": {"output": None},
+        "branches": list(branches),
+    }
+
+
+class TestConcurrentBranches(unittest.TestCase):
+
+    def _run(self, trunk, workers):
+        log = []
+        providers = {"db": _SlowProvider(log), "other": _SlowProvider(log)}
+        result = get_result(trunk, providers.get, create_context(trunk),
+                            max_branch_workers=workers)
+        return result, log
+
+    def test_independent_providers_overlap(self):
+        trunk = _trunk(
+            _branch("a", {"connection": "db", "rows": [{"a": 1}], "delay": 0.2}),
+            _branch("b", {"connection": "other", "rows": [{"b": 2}], "delay": 0.2}),
+        )
+        started = time.monotonic()
+        result, _log = self._run(trunk, 2)
+        elapsed = time.monotonic() - started
+        self.assertLess(elapsed, 0.35)
+        self.assertEqual(result, self._run(trunk, None)[0])
+        self.assertEqual(result, {"a": [{"a": 1}], "b": [{"b": 2}]})
+
+    def test_same_connection_is_never_shared(self):
+        trunk = _trunk(
+            _branch("a", {"connection": "db", "rows": [], "delay": 0.05}),
+            _branch("b", {"connection": "db", "rows": [], "delay": 0.05}),
+        )
+        _result, log = self._run(trunk, 4)
+        self.assertEqual([event for event, _id in log], ["start", "end", "start", "end"])
+
+    def test_dependency_order_is_kept(self):
+        trunk = _trunk(
+            _branch("a", {"connection": "db", "rows": [{"$mode": "params", "x": 7}], "delay": 0.1}),
+            _branch("b", {"connection": "other", "param": "x"}, depends_on=["$.a"]),
+        )
+        result, log = self._run(trunk, 4)
+        self.assertEqual(result["b"], [{"v": 7}])
+        self.assertEqual(log, [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b")])
+
+    def test_first_error_in_sequential_order_wins(self):
+        trunk = _trunk(
+            _branch("a", {"connection": "db", "delay": 0.1,
+                          "rows": [{"$mode": "error", "message": "first"}]}),
+            _branch("b", {"connection": "other",
+                          "rows": [{"$mode": "error", "message": "second"}]}),
+        )
+        result, _log = self._run(trunk, 2)
+        self.assertEqual(result, {"errors": [{"$mode": "error", "message": "first"}]})
+
+    def test_exceptions_propagate(self):
+        trunk = _trunk(
+            _branch("a", {"connection": "db", "rows": [{"a": 1}]}),
+            _branch("b", {"connection": "other", "raise": "boom"}),
+        )
+        with self.assertRaisesRegex(RuntimeError, "boom"):
+            self._run(trunk, 2)
+
+
+class TestConcurrentFixtures(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        con = sqlite3.connect(self._db_path)
+        con.executescript(SCHEMA.read_text())
+        con.close()
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def test_matches_sequential_results(self):
+        sequential = Yaal(str(FIXTURE_API))
+        concurrent = Yaal(str(FIXTURE_API), max_branch_workers=4)
+        for y in (sequential, concurrent):
+            y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        for path, args in (("user/page", {"page": 1, "page_size": 10}),
+                           ("user/nested", None), ("user/list", None)):
+            with self.subTest(path=path):
+                self.assertEqual(concurrent.query(path, args=args),
+                                 sequential.query(path, args=args))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,7 +6,7 @@ import copy
 import unittest
 
 from yaal import create_context, _parse_rfc1738_args
-from yaal_executor import DataProviderHelper, _execute_branch
+from yaal_executor import DataProviderHelper, _execute_branch, _output_mapper
 from yaal_shape import Shape, _to_lower_keys_deep
 
 
@@ -114,7 +114,7 @@ class TestBugfixes(unittest.TestCase):
         out, err = _execute_branch(branch, False, {"db": DP()}, ctx, parent)
         self.assertIsNone(err)
         self.assertEqual(calls["n"], 0)
-        self.assertEqual(out[0]["user_id"], 1)
+        self.assertEqual(out.dicts()[0]["user_id"], 1)
 
     def test_child_lists_are_copied_per_parent_row(self):
         class DP:
@@ -155,9 +155,14 @@ class TestBugfixes(unittest.TestCase):
         ctx = create_context({"path": "p"})
         out, err = _execute_branch(trunk, True, {"db": DP()}, ctx, [])
         self.assertIsNone(err)
-        self.assertIsNot(out[0]["child"], out[1]["child"])
-        out[0]["child"].append({"c": 2})
-        self.assertEqual(len(out[1]["child"]), 1)
+        # The executor shares one child group across parents; mapping copies it.
+        result = _output_mapper("array", None, trunk["branches"], out)
+        self.assertIsNot(result[0]["child"], result[1]["child"])
+        self.assertIsNot(result[0]["child"][0], result[1]["child"][0])
+        result[0]["child"].append({"c": 2})
+        result[0]["child"][0]["c"] = 9
+        self.assertEqual(result[1]["child"], [{"c": 1}])
+        self.assertEqual(out.dicts()[0]["child"], [{"c": 1}])
 
     def test_sqlite_uri_dot_relative_and_absolute(self):
         name, opts = _parse_rfc1738_args("sqlite3://./serve/db/app.db")
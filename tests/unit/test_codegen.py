@@ -0,0 +1,144 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Generated row mappers (Yaal(codegen=True), yaal compile --codegen)."""
+
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+
+import yaal_cli
+from yaal import Yaal, get_descriptor_json
+from yaal_codegen import attach_mapper, generate_source, load_source
+from yaal_executor import map_output
+from yaal_output_schema import build_output_plan
+from yaal_precompile import export_descriptor
+from yaal_rows import RowSet
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+QUERIES = (
+    ("user/list", None),
+    ("user/get", {"id": 1}),
+    ("user/nested", None),
+    ("user/page", {"page": 1, "page_size": 10}),
+    ("user/combine", None),
+    ("report/summary", None),
+)
+
+
+def _mapper(output_type, model, branches=None):
+    plan = build_output_plan(output_type, model, branches)
+    mapper, _plan = load_source(generate_source({"path": "t", "output_plan": plan}))
+    return plan, mapper
+
+
+class TestGeneratedMapper(unittest.TestCase):
+
+    def test_matches_map_output(self):
+        model = {"type": "array", "properties": {
+            "id": {"mapped": "id"}, "doc": {"mapped": "doc"},
+            "kids": {"type": "array", "properties": {"n": {"mapped": "name"}}},
+        }}
+        branches = [{"name": "kids", "output_type": "array"}]
+        plan, mapper = _mapper("array", model, branches)
+        rs = RowSet(("id", "doc"), [(1, {"a": [1]}), (2, None)])
+        rs.attach("kids", [RowSet(("name",), [("x",)]), [{"name": "y"}]])
+        self.assertEqual(mapper(rs), map_output(plan, rs))
+        self.assertEqual(mapper(rs)[1]["kids"], [{"n": "y"}])
+        self.assertIsNot(mapper(rs)[0]["doc"], rs.rows[0][1])
+
+    def test_unlisted_branches_follow_the_fields(self):
+        branches = [{"name": "extra", "output_type": "object"}]
+        model = {"properties": {"id": {"mapped": "id"}, "extra": {"properties": {"n": "name"}}}}
+        plan, mapper = _mapper("array", model, branches)
+        rs = RowSet(("id",), [(1,), (2,)])
+        rs.attach("extra", [RowSet(("name",), [("x",)]), None])
+        self.assertEqual(mapper(rs), [{"id": 1, "extra": {"n": "x"}}, {"id": 2}])
+        self.assertEqual(mapper(rs), map_output(plan, rs))
+
+    def test_other_inputs_fall_back_to_the_interpreter(self):
+        plan, mapper = _mapper("array", {"properties": {"a": {"mapped": "a"}}})
+        for rows in ([{"a": 1}], RowSet.from_dicts([{"a": 1}, {"a": 2, "b": 3}]),
+                     RowSet(None, [1, 2]), RowSet(("a",), [])):
+            with self.subTest(rows=rows):
+                self.assertEqual(mapper(rows), map_output(plan, rows))
+        _plan, passthrough = _mapper("object", None)
+        self.assertEqual(passthrough(RowSet(("a", "b"), [(1, 2), (3, 4)])), {"a": 1, "b": 2})
+
+    def test_errors_match_the_interpreter(self):
+        _plan, mapper = _mapper("array", {"properties": {"x": {"mapped": "c"}}})
+        with self.assertRaisesRegex(Exception, "c _mapped column missing from row"):
+            mapper(RowSet(("a",), [(1,)]))
+        _plan, mapper = _mapper("array", {"properties": {"kids": {"type": "array"}}})
+        with self.assertRaises(KeyError):
+            mapper(RowSet(("a",), [(1,)]))
+
+
+class TestCodegenQueries(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        with sqlite3.connect(self._db_path) as con:
+            con.executescript(SCHEMA.read_text())
+        self._url = "sqlite3:///" + self._db_path
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def _yaal(self, **kwargs):
+        y = Yaal(str(FIXTURE_API), **kwargs)
+        y.setup_data_provider("db", self._url)
+        return y
+
+    def test_results_match_the_interpreter(self):
+        plain, generated = self._yaal(), self._yaal(codegen=True)
+        for path, args in QUERIES:
+            with self.subTest(path=path):
+                self.assertEqual(generated.query(path, args=args), plain.query(path, args=args))
+        self.assertEqual(list(generated.query_iter("user/list")), plain.query("user/list"))
+
+    def test_mapper_is_kept_out_of_exports(self):
+        descriptor = Yaal(str(FIXTURE_API)).create_descriptor("user/nested")
+        attach_mapper(descriptor)
+        self.assertNotIn("_mapper", export_descriptor(descriptor))
+        self.assertNotIn("_mapper", json.loads(get_descriptor_json(descriptor)))
+
+    def test_compile_writes_sources_that_precompiled_yaal_loads(self):
+        with tempfile.TemporaryDirectory() as out:
+            with redirect_stdout(io.StringIO()) as buf, redirect_stderr(io.StringIO()):
+                code = yaal_cli.main(["--api", str(FIXTURE_API), "compile", "--out", out,
+                                      "--codegen"])
+            self.assertEqual(code, 0)
+            self.assertIn("user/nested.py", buf.getvalue().splitlines())
+
+            source = Path(out, "user", "list.py")
+            source.write_text(source.read_text().replace(
+                "    return _map_0(rs)", "    return ['from the artifact']"))
+            pre = self._yaal(precompiled=out, codegen=True)
+            self.assertEqual(pre.query("user/list"), ["from the artifact"])
+            self.assertEqual(pre.query("user/nested"), self._yaal().query("user/nested"))
+
+    def test_stale_sources_are_regenerated(self):
+        with tempfile.TemporaryDirectory() as out:
+            from yaal_precompile import compile_api
+
+            compile_api(str(FIXTURE_API), out, list_paths=["user/list"], codegen=True)
+            source = Path(out, "user", "list.py")
+            source.write_text(source.read_text().replace("'user_name'", "'gone'")
+                              .replace("    return _map_0(rs)", "    return 'stale'"))
+            pre = self._yaal(precompiled=out, codegen=True)
+            self.assertEqual(pre.query("user/list"), self._yaal().query("user/list"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,13 +2,23 @@
 # Use of this source code is governed by a MIT style
 # license that can be found in the LICENSE file.
 
+import os
+import sqlite3
+import tempfile
 import unittest
+from pathlib import Path
 
-from yaal_executor import DataProviderHelper
+from yaal import Yaal
+from yaal_cache import LRUCache
+from yaal_executor import DataProviderHelper, get_variant_cache
 from yaal_parser import lexer, parser
 from yaal_provider import parse_pool_int
 from yaal_shape import Shape
 
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
 
 class TestCompileCache(unittest.TestCase):
 
@@ -22,7 +32,7 @@ class TestCompileCache(unittest.TestCase):
         return ast["sql_stmts"][0]
 
     def test_same_nulls_reuse_compiled_sql(self):
-        helper = DataProviderHelper()
+        helper = DataProviderHelper(compile_cache=LRUCache())
         twig = self._twig()
         shape = Shape(
             schema={"type": "object", "properties": {}},
@@ -43,7 +53,7 @@ class TestCompileCache(unittest.TestCase):
         self.assertEqual(len(helper._compile_cache), 1)
 
     def test_different_nulls_different_sql(self):
-        helper = DataProviderHelper()
+        helper = DataProviderHelper(compile_cache=LRUCache())
         twig = self._twig()
         null_shape = Shape(
             schema={"type": "object", "properties": {}},
@@ -75,7 +85,7 @@ class TestCompileCache(unittest.TestCase):
         self.assertEqual(len(helper._compile_cache), 2)
 
     def test_clear_cache_keeps_compile_cache(self):
-        helper = DataProviderHelper()
+        helper = DataProviderHelper(compile_cache=LRUCache())
         twig = self._twig()
         shape = Shape(
             schema={"type": "object", "properties": {}},
@@ -93,6 +103,131 @@ class TestCompileCache(unittest.TestCase):
         helper.clear_cache()
         self.assertEqual(len(helper._compile_cache), 1)
 
+    def test_variant_cache_shared_across_helpers(self):
+        cache = LRUCache()
+        twig = self._twig()
+        shape = self._shape()
+        DataProviderHelper(compile_cache=cache).get_executable_content("?", twig, shape)
+        DataProviderHelper(compile_cache=cache).get_executable_content("?", twig, shape)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_default_helper_uses_process_wide_cache(self):
+        self.assertIs(DataProviderHelper()._compile_cache, get_variant_cache())
+
+    def test_distinct_twigs_do_not_share_entries(self):
+        cache = LRUCache()
+        helper = DataProviderHelper(compile_cache=cache)
+        helper.get_executable_content("?", self._twig(), self._shape())
+        helper.get_executable_content("?", self._twig(), self._shape())
+        self.assertEqual(cache.stats()["hits"], 0)
+
+    def test_placeholder_is_part_of_key(self):
+        cache = LRUCache()
+        helper = DataProviderHelper(compile_cache=cache)
+        twig = self._twig()
+        q = helper.get_executable_content("?", twig, self._shape(active=1))
+        s = helper.get_executable_content("%s", twig, self._shape(active=1))
+        self.assertIn("?", q["content"])
+        self.assertIn("%s", s["content"])
+        self.assertEqual(len(cache), 2)
+
+    def _shape(self, **args):
+        return Shape(
+            schema={"type": "object", "properties": {}},
+            extras={
+                "$args": Shape(
+                    schema={
+                        "type": "object",
+                        "properties": {"active": {"type": "integer"}},
+                    },
+                    data=args,
+                )
+            },
+        )
+
+
+class TestVariantLifetime(unittest.TestCase):
+    """Variants of replaced descriptors leave the process-wide cache."""
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        with sqlite3.connect(self._db_path) as con:
+            con.executescript(SCHEMA.read_text())
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def _yaal(self, **options):
+        y = Yaal(str(FIXTURE_API), **options)
+        y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        return y
+
+    def _variants(self, descriptor):
+        twigs = descriptor["twigs"]
+        cache = get_variant_cache()
+        return sum(1 for key in list(cache._data) if any(cache._data[key][0] is t for t in twigs))
+
+    def test_clear_cache_drops_variants(self):
+        y = self._yaal()
+        y.query("user/get", args={"id": 1})
+        descriptor = y._load_descriptor("user/get")
+        self.assertEqual(self._variants(descriptor), 1)
+        y.clear_cache()
+        self.assertEqual(self._variants(descriptor), 0)
+
+    def test_debug_reload_drops_old_variants(self):
+        y = self._yaal(debug=True)
+        y.query("user/get", args={"id": 1}, fields="name")
+        first = y._descriptors["user/get"]
+        self.assertEqual(self._variants(first), 1)
+        y.query("user/get", args={"id": 1}, fields="name")
+        self.assertEqual(self._variants(first), 0)
+        self.assertEqual(self._variants(y._descriptors["user/get"]), 1)
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_discard_if(self):
+        cache = LRUCache(maxsize=4)
+        for k in "abc":
+            cache.put(k, k.upper())
+        self.assertEqual(cache.discard_if(lambda key, value: value != "B"), 2)
+        self.assertEqual(cache.stats()["size"], 1)
+        self.assertIn("b", cache)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_counters(self):
+        cache = LRUCache(maxsize=4)
+        self.assertIsNone(cache.get("x"))
+        cache.put("x", 1)
+        self.assertEqual(cache.get("x"), 1)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+    def test_resize_evicts(self):
+        cache = LRUCache(maxsize=3)
+        for k in "abc":
+            cache.put(k, k)
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertIn("c", cache)
+
+    def test_rejects_non_positive_size(self):
+        with self.assertRaises(ValueError):
+            LRUCache(maxsize=0)
+
 
 class TestPoolUrlParsing(unittest.TestCase):
 
@@ -0,0 +1,135 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Child groups are shared inside the executor; mapped output never aliases."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal, create_context
+from yaal_executor import _execute_branch, _output_mapper
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class _Provider:
+
+    def __init__(self, *outputs):
+        self._outputs = list(outputs)
+
+    def begin(self):
+        pass
+
+    def end(self):
+        pass
+
+    def error(self):
+        pass
+
+    def execute(self, twig, ctx, helper):
+        return self._outputs.pop(0), None
+
+
+def _twig():
+    return {"connection": "db", "content": [], "parameters": []}
+
+
+class TestCopyFreeNesting(unittest.TestCase):
+
+    def _trunk(self, child_branches=None):
+        child = {
+            "name": "child",
+            "input_type": "object",
+            "method": "$.child",
+            "twigs": [_twig()],
+            "output_type": "array",
+        }
+        if child_branches:
+            child["branches"] = child_branches
+        return {
+            "input_type": "object",
+            "method": "$",
+            "connections": ["db"],
+            "twigs": [_twig()],
+            "output_type": "array",
+            "branches": [child],
+        }
+
+    def test_executor_shares_child_group(self):
+        trunk = self._trunk()
+        provider = _Provider([{"id": 1}, {"id": 2}], [{"c": 1}])
+        out, err = _execute_branch(trunk, True, {"db": provider}, create_context({"path": "p"}), [])
+        self.assertIsNone(err)
+        self.assertIs(out.children["child"][0], out.children["child"][1])
+
+    def test_pass_through_rows_are_not_mutated(self):
+        grandchild = {
+            "name": "leaf",
+            "input_type": "object",
+            "method": "$.child.leaf",
+            "twigs": [_twig()],
+            "output_type": "array",
+        }
+        trunk = self._trunk([grandchild])
+        provider = _Provider([{"id": 1}, {"id": 2}], [{"c": 1}], [{"l": 1}])
+        out, err = _execute_branch(trunk, True, {"db": provider}, create_context({"path": "p"}), [])
+        self.assertIsNone(err)
+        first = _output_mapper("array", None, trunk["branches"], out)
+        second = _output_mapper("array", None, trunk["branches"], out)
+        self.assertEqual(first, second)
+        self.assertEqual(first[0]["child"], [{"c": 1, "leaf": [{"l": 1}]}])
+        # The raw child rows still hold the unmapped grandchild group.
+        raw_child = out.children["child"][0]
+        self.assertEqual(raw_child.dicts(), [{"c": 1, "leaf": [{"l": 1}]}])
+        self.assertIs(raw_child.children["leaf"][0], out.children["child"][1].children["leaf"][0])
+
+    def test_container_values_are_copied(self):
+        trunk = self._trunk()
+        trunk["branches"][0]["output_type"] = "object"
+        provider = _Provider([{"id": 1}, {"id": 2}], [{"tags": ["a"], "meta": {"k": 1}}])
+        out, _ = _execute_branch(trunk, True, {"db": provider}, create_context({"path": "p"}), [])
+        model = {
+            "type": "array",
+            "properties": {
+                "id": {"mapped": "id"},
+                "child": {
+                    "type": "object",
+                    "properties": {"tags": {"mapped": "tags"}, "meta": {"mapped": "meta"}},
+                },
+            },
+        }
+        result = _output_mapper("array", model, trunk["branches"], out)
+        result[0]["child"]["tags"].append("b")
+        result[0]["child"]["meta"]["k"] = 2
+        self.assertEqual(result[1]["child"], {"tags": ["a"], "meta": {"k": 1}})
+
+
+class TestCopyFreeFixtures(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        sqlite3.connect(self._db_path).executescript(SCHEMA.read_text())
+        self._yaal = Yaal(str(FIXTURE_API), debug=True)
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def test_parent_rows_do_not_alias(self):
+        result = self._yaal.query("user/page", args={"page": 1, "page_size": 10})
+        admin, guest = result["data"]
+        self.assertEqual(admin["roles"], [{"id": 1, "name": "Administrator"}, {"id": 2, "name": "User"}])
+        self.assertNotIn("roles", admin["roles"][0])
+        admin["roles"][1]["name"] = "changed"
+        self.assertEqual(guest["roles"], [{"id": 2, "name": "User"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""cache.revalidate: data_version — SQLite results served until a write lands."""
+
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal
+from yaal_errors import YaalError
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+INSERT_SCRIPT = """\
+import sqlite3, sys
+con = sqlite3.connect(sys.argv[1])
+con.execute("INSERT INTO users VALUES (?, 'other process', 1)", (int(sys.argv[2]),))
+con.commit()
+con.close()
+"""
+
+
+class _CountingManager:
+
+    def __init__(self, inner, begins):
+        self._inner = inner
+        self._begins = begins
+
+    def get_context(self):
+        self._begins.append(1)
+        return self._inner.get_context()
+
+    def data_version(self):
+        return self._inner.data_version()
+
+
+class TestDataVersionCache(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        api = Path(self._root) / "api"
+        shutil.copytree(str(FIXTURE_API), str(api))
+        output = api / "user" / "list" / "$.output.yaml"
+        output.write_text("cache:\n  revalidate: data_version\n" + output.read_text())
+        self._db_path = str(Path(self._root) / "app.db")
+        con = sqlite3.connect(self._db_path)
+        con.executescript(SCHEMA.read_text())
+        con.close()
+        self._yaal = Yaal(str(api))
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        self._manager = self._yaal._data_providers["db"]
+        self._begins = []
+        self._yaal._data_providers["db"] = _CountingManager(self._manager, self._begins)
+
+    def tearDown(self):
+        self._manager.close()
+        shutil.rmtree(self._root)
+
+    def _insert_from_other_process(self, user_id):
+        subprocess.run([sys.executable, "-c", INSERT_SCRIPT, self._db_path, str(user_id)],
+                       check=True)
+
+    def test_manager_data_version(self):
+        version = self._manager.data_version()
+        self._yaal.query("user/list")
+        self.assertEqual(self._manager.data_version(), version)
+
+        self._yaal.query("user/create", payload={"id": 7, "name": "neo"})
+        after_own_write = self._manager.data_version()
+        self.assertNotEqual(after_own_write, version)
+
+        self._insert_from_other_process(8)
+        self.assertNotEqual(self._manager.data_version(), after_own_write)
+
+    def test_served_from_memory_until_a_write(self):
+        first = self._yaal.query("user/list")
+        for _ in range(3):
+            self.assertEqual(self._yaal.query("user/list"), first)
+        self.assertEqual(len(self._begins), 1)
+
+        self._insert_from_other_process(40)
+        second = self._yaal.query("user/list")
+        self.assertEqual(len(second), len(first) + 1)
+        self.assertEqual(self._yaal.query_json("user/list"), self._yaal.query_json("user/list"))
+        self.assertEqual(len(self._begins), 2)
+
+        self._yaal.query("user/create", payload={"id": 41, "name": "neo"})
+        self.assertEqual(len(self._yaal.query("user/list")), len(second) + 1)
+
+    def test_needs_a_versioned_provider(self):
+        class _Plain:
+            def get_context(self):
+                raise AssertionError("not reached")
+
+        self._yaal._data_providers["db"] = _Plain()
+        with self.assertRaisesRegex(YaalError, "data_version"):
+            self._yaal.query("user/list")
+
+    def test_revalidate_values(self):
+        y = Yaal(self._root + "/api")
+        output = Path(self._root) / "api" / "user" / "list" / "$.output.yaml"
+        output.write_text(output.read_text().replace("data_version", "mtime"))
+        with self.assertRaises(TypeError):
+            y.create_descriptor("user/list")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Array payloads whose twigs only write run through executemany."""
+
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal, create_context
+from yaal_executor import DataProviderHelper, get_result
+from yaal_provider import iter_variant_batches
+
+ROOT = Path(__file__).resolve().parents[2]
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+TRUNK_SQL = """\
+--(items[0].id! integer)--
+
+SELECT 1 AS ok
+"""
+
+ITEMS_SQL = """\
+--(id! integer, name! string, role integer)--
+
+INSERT INTO users (user_id, user_name, active) VALUES ({{id}}, {{name}}, 1)
+
+--sql--
+
+INSERT INTO user_roles (user_id, role_id) VALUES ({{id}}, {{role}})
+"""
+
+
+def _items(count, start=10):
+    return [{"id": start + i, "name": "u%d" % i, "role": 1 + i % 2} for i in range(count)]
+
+
+class _CountingProvider:
+    """Wraps a real provider and counts execute / execute_many calls."""
+
+    def __init__(self, inner, batches):
+        self._inner = inner
+        self.batches = batches
+
+    def begin(self):
+        self._inner.begin()
+
+    def end(self):
+        self._inner.end()
+
+    def error(self):
+        self._inner.error()
+
+    def execute(self, twig, input_shape, helper):
+        self.batches.append(1)
+        return self._inner.execute(twig, input_shape, helper)
+
+    def execute_many(self, twig, input_shapes, helper):
+        self.batches.append(len(input_shapes))
+        return self._inner.execute_many(twig, input_shapes, helper)
+
+
+class TestExecuteMany(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._db_path = str(Path(self._root) / "app.db")
+        sqlite3.connect(self._db_path).executescript(SCHEMA.read_text())
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _api(self, items_sql=ITEMS_SQL):
+        api = Path(self._root) / "api" / "bulk"
+        if api.exists():
+            shutil.rmtree(api)
+        api.mkdir(parents=True)
+        (api / "$.sql").write_text(TRUNK_SQL)
+        (api / "$.items.sql").write_text(items_sql)
+        y = Yaal(str(Path(self._root) / "api"), debug=True)
+        y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        return y
+
+    def _run(self, y, items, batch_size):
+        batches = []
+        descriptor = y.create_descriptor("bulk")
+        context = create_context(descriptor, payload={"items": items})
+        result = get_result(
+            descriptor,
+            lambda name: _CountingProvider(y.get_data_provider(name), batches),
+            context,
+            executemany_batch_size=batch_size,
+        )
+        return result, batches, context
+
+    def _rows(self):
+        con = sqlite3.connect(self._db_path)
+        try:
+            return con.execute(
+                "SELECT u.user_id, u.user_name, ur.role_id FROM users u "
+                "JOIN user_roles ur ON ur.user_id = u.user_id ORDER BY 1, 3"
+            ).fetchall()
+        finally:
+            con.close()
+
+    def test_batched_writes_match_per_item(self):
+        y = self._api()
+        result, batches, context = self._run(y, _items(5), batch_size=2)
+        self.assertEqual(result, [{"ok": 1, "items": []}])
+        # trunk SELECT, then each twig over chunks of 2, 2, 1
+        self.assertEqual(batches, [1, 2, 2, 1, 2, 2, 1])
+        batched_id = context.get_prop("$params").get_prop("$last_inserted_id")
+        batched = self._rows()
+
+        sqlite3.connect(self._db_path).executescript(
+            "DELETE FROM user_roles WHERE user_id >= 10; DELETE FROM users WHERE user_id >= 10;"
+        )
+        _result, batches, context = self._run(y, _items(5), batch_size=0)
+        self.assertEqual(batches, [1] + [1] * 10)
+        self.assertEqual(self._rows(), batched)
+        # Rowids are reused after the DELETE, so both runs report the last user_roles row.
+        self.assertEqual(context.get_prop("$params").get_prop("$last_inserted_id"), batched_id)
+
+    def test_builder_flags(self):
+        cases = {
+            ITEMS_SQL: [True, True],
+            ITEMS_SQL.replace("{{role}})", "{{role}}) RETURNING role_id"): [True, False],
+            ITEMS_SQL.replace("{{role}})", "{{$params.$last_inserted_id}})").replace(
+                "role integer", "role integer, $params.$last_inserted_id integer"): [False, False],
+            ITEMS_SQL.replace("--sql--", "--sql--\n\nSELECT 'params' AS \"$mode\", 1 AS n\n\n--sql--"):
+                [True, False, True],
+        }
+        for sql, expected in cases.items():
+            with self.subTest(sql=sql):
+                descriptor = self._api(sql).create_descriptor("bulk")
+                self.assertEqual([t["batchable"] for t in descriptor["branches"][0]["twigs"]], expected)
+
+    def test_non_batchable_branch_runs_per_item(self):
+        y = self._api(ITEMS_SQL.replace("{{role}})", "{{role}}) RETURNING role_id"))
+        _result, batches, _context = self._run(y, _items(3), batch_size=500)
+        self.assertEqual(batches, [1] * 7)
+
+    def test_variants_split_batches(self):
+        sql = """\
+--(id! integer, name! string, active integer)--
+
+UPDATE users SET user_name = {{name}} WHERE user_id = {{id}} AND optional(active = {{active}})
+"""
+        y = self._api(sql)
+        descriptor = y.create_descriptor("bulk")
+        twig = descriptor["branches"][0]["twigs"][0]
+        context = create_context(descriptor, payload={"items": [
+            {"id": 1, "name": "a"}, {"id": 2, "name": "b"}, {"id": 1, "name": "c", "active": 1},
+        ]})
+        items = context.get_prop("items")
+        shapes = [items.get_prop("@%d" % i) for i in range(3)]
+        batches = list(iter_variant_batches(twig, shapes, DataProviderHelper(), "?", lambda _t, v: v))
+        self.assertEqual([args for _sql, args in batches], [[["a", 1], ["b", 2]], [["c", 1, 1]]])
+        self.assertNotEqual(batches[0][0], batches[1][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
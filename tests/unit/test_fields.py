@@ -0,0 +1,160 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Sparse fieldsets: fields= prunes branches before execution and keys while mapping."""
+
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import yaal_cli
+from yaal import FieldSelectionError, Yaal
+from yaal_executor import map_output
+from yaal_fields import fields_key, parse_fields, prune_descriptor
+from yaal_output_schema import build_output_plan
+from yaal_rows import RowSet
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class TestParseFields(unittest.TestCase):
+
+    def test_paths_become_a_tree(self):
+        self.assertEqual(parse_fields("id, name,roles.id"),
+                         {"id": True, "name": True, "roles": {"id": True}})
+        self.assertEqual(parse_fields(["$.data[*].roles", "$.data[*].roles.id"]),
+                         {"data": {"roles": True}})
+        self.assertIsNone(parse_fields(""))
+        self.assertIsNone(parse_fields(None))
+        with self.assertRaises(FieldSelectionError):
+            parse_fields("roles..id")
+
+    def test_key_is_canonical(self):
+        self.assertEqual(fields_key(parse_fields("roles.name,id,roles.id")),
+                         fields_key(parse_fields(["id", "roles.id", "roles.name"])))
+
+    def test_pass_through_rows_keep_selected_keys(self):
+        plan = build_output_plan("array", None, None)
+        descriptor = {"path": "t", "name": "$", "method": "$", "connections": ["db"],
+                      "output_plan": plan}
+        pruned = prune_descriptor(descriptor, parse_fields("a"))
+        rows = RowSet(("a", "b"), [(1, 2)])
+        self.assertEqual(map_output(pruned["output_plan"], rows), [{"a": 1}])
+
+
+class TestFieldSelection(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        with sqlite3.connect(self._db_path) as con:
+            con.executescript(SCHEMA.read_text())
+        self._yaal = Yaal(str(FIXTURE_API))
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        self._statements = []
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def _trace(self):
+        provider = self._yaal.get_data_provider
+
+        def traced(name):
+            context = provider(name)
+            execute = context.execute
+
+            def execute_traced(twig, input_shape, helper):
+                self._statements.append(twig)
+                return execute(twig, input_shape, helper)
+
+            context.execute = execute_traced
+            return context
+
+        self._yaal.get_data_provider = traced
+
+    def test_unselected_branches_do_not_run(self):
+        self._trace()
+        self.assertEqual(self._yaal.query("user/nested", fields="id,name"),
+                         {"id": 1, "name": "admin"})
+        self.assertEqual(len(self._statements), 1)
+        self.assertEqual([t["method"] for t in self._yaal.explain_sql("user/nested",
+                                                                         fields="id")], ["$"])
+
+    def test_nested_selection(self):
+        self.assertEqual(self._yaal.query("user/nested", fields="name,roles.name"),
+                         {"name": "admin", "roles": [{"name": "Administrator"}, {"name": "User"}]})
+        page = self._yaal.query("user/page", args={"page": 1, "page_size": 10},
+                                fields="data.name,data.roles.id")
+        self.assertEqual(page, {"data": [{"name": "admin", "roles": [{"id": 1}, {"id": 2}]},
+                                         {"name": "guest", "roles": [{"id": 2}]}]})
+        self.assertEqual(list(self._yaal.query_iter("user/list", fields=["id"])),
+                         [{"id": 1}, {"id": 2}])
+
+    def test_unselected_parent_rows_child_still_groups_parent(self):
+        # data joins user_roles; the unselected roles branch is what groups it by user_id.
+        args = {"page": 1, "page_size": 10}
+        expected = {"data": [{"id": 1}, {"id": 2}]}
+        self.assertEqual(self._yaal.query("user/page", args=args, fields="data.id"), expected)
+        self.assertEqual(list(self._yaal.query_iter("user/page", args=args, fields="data.id")),
+                         [expected])
+
+    def test_unselected_sql_child_still_groups_joined_parent(self):
+        # The trunk joins user_roles; only attaching perms grouped it by user_id.
+        with tempfile.TemporaryDirectory() as root:
+            api = Path(root) / "grants"
+            api.mkdir()
+            (api / "$.sql").write_text(
+                "select u.user_id, u.user_name, ur.role_id from users u\n"
+                "inner join user_roles ur on ur.user_id = u.user_id order by u.user_id\n"
+            )
+            (api / "$.perms.sql").write_text("select role_id as user_id, role_name from roles\n")
+            (api / "$.output.yaml").write_text(
+                "type: array\npartition_by: user_id\nproperties:\n  id:\n    mapped: user_id\n"
+                "  perms:\n    type: array\n    properties:\n      name:\n"
+                "        mapped: role_name\n"
+            )
+            y = Yaal(root)
+            y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+            self.assertEqual(len(y.query("grants")), 2)
+            self.assertEqual(y.query("grants", fields="id"), [{"id": 1}, {"id": 2}])
+            self.assertEqual(list(y.query_iter("grants", fields="id")), [{"id": 1}, {"id": 2}])
+
+    def test_unselected_connections_are_not_used(self):
+        # No "flags" provider is configured; selecting only app never asks for it.
+        self.assertEqual(self._yaal.query("user/combine", args={"id": 1}, fields="app.name"),
+                         {"app": {"name": "admin"}})
+
+    def test_unknown_fields_are_rejected(self):
+        for fields in ("nope", "roles.nope", "name.first"):
+            with self.subTest(fields=fields), self.assertRaises(FieldSelectionError):
+                self._yaal.query("user/nested", fields=fields)
+
+    def test_selection_is_part_of_cache_keys(self):
+        y = Yaal(str(FIXTURE_API), coalesce=True, codegen=True)
+        y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        # report/summary declares a result cache.
+        self.assertEqual(y.query("report/summary", fields="user_count"), {"user_count": 2})
+        self.assertEqual(len(y.query("report/summary")), 3)
+        self.assertEqual(y.query("report/summary", fields="user_count"), {"user_count": 2})
+        self.assertIs(y._load_descriptor("user/nested", fields="id"),
+                      y._load_descriptor("user/nested", fields=["id"]))
+
+    def test_cli_fields(self):
+        buf = io.StringIO()
+        with redirect_stdout(buf):
+            code = yaal_cli.main(["--api", str(FIXTURE_API), "query", "user/get",
+                                  "--arg", "id=1", "--fields", "name"])
+        self.assertEqual(code, 0)
+        self.assertEqual(json.loads(buf.getvalue()), {"name": "admin"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""memory_budget: spill partition_by groups to SQLite, soft error past the ceiling."""
+
+import decimal
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from yaal import Yaal
+from yaal_spill import MemoryBudget, SpilledRows
+
+OUTPUT = """\
+type: array
+partition_by: user_id
+{strategy}
+properties:
+  id:
+    mapped: user_id
+  roles:
+    type: array
+    properties:
+      id:
+        mapped: role_id
+"""
+
+USERS_SQL = "select user_id from users order by user_id\n"
+ROLES_SQL = "select user_id, role_id from user_roles order by user_id, role_id\n"
+
+
+def _write_api(root, strategy=""):
+    api = Path(root) / "api" / "people"
+    api.mkdir(parents=True)
+    (api / "$.output.yaml").write_text(OUTPUT.format(strategy=strategy))
+    (api / "$.sql").write_text(USERS_SQL)
+    (api / "$.roles.sql").write_text(ROLES_SQL)
+    return str(Path(root) / "api")
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._spill_dir = os.path.join(self._tmp, "spill")
+        os.mkdir(self._spill_dir)
+        self._db = os.path.join(self._tmp, "people.db")
+        with sqlite3.connect(self._db) as con:
+            con.execute("create table users (user_id integer primary key)")
+            con.execute("create table user_roles (user_id integer, role_id integer)")
+            con.executemany("insert into users values (?)", [(i,) for i in range(1, 31)])
+            # Every third user has no roles.
+            con.executemany("insert into user_roles values (?, ?)",
+                            [(u, r) for u in range(1, 31) if u % 3 for r in range(u % 4 + 1)])
+        self._expected = [
+            {"id": u, "roles": [{"id": r} for r in range(u % 4 + 1)] if u % 3 else []}
+            for u in range(1, 31)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _yaal(self, strategy="", **budget):
+        y = Yaal(_write_api(os.path.join(self._tmp, strategy or "hash"), strategy),
+                 memory_budget=dict(budget, spill_dir=self._spill_dir) if budget else None)
+        y.setup_data_provider("db", "sqlite3:///" + self._db)
+        return y
+
+    def _spills(self):
+        return mock.patch.object(SpilledRows, "finish", autospec=True,
+                                 side_effect=SpilledRows.finish)
+
+    def test_spilled_groups_match_in_memory_result(self):
+        y = self._yaal(spill_rows=5, batch_size=4)
+        self.assertEqual(y.create_descriptor("people")["branches"][0]["spill_key"], "user_id")
+        with self._spills() as finish:
+            self.assertEqual(y.query("people"), self._expected)
+        self.assertEqual(finish.call_count, 1)
+        self.assertEqual(os.listdir(self._spill_dir), [])
+
+    def test_codegen_and_query_iter_read_spilled_groups(self):
+        y = self._yaal("partition_strategy: merge", spill_bytes=1, batch_size=4)
+        y._codegen = True
+        with self._spills() as finish:
+            self.assertEqual(list(y.query_iter("people")), self._expected)
+            self.assertEqual(y.query("people"), self._expected)
+        self.assertEqual(finish.call_count, 2)
+        self.assertEqual(os.listdir(self._spill_dir), [])
+
+    def test_under_the_threshold_nothing_spills(self):
+        y = self._yaal(spill_rows=1000)
+        with self._spills() as finish:
+            self.assertEqual(y.query("people"), self._expected)
+        finish.assert_not_called()
+
+    def test_ceiling_is_a_soft_error(self):
+        # 30 users fit; the roles read crosses max_rows even though it spills.
+        y = self._yaal(spill_rows=5, max_rows=40, batch_size=4)
+        result = y.query("people")
+        self.assertIn("memory budget", result["errors"][0]["message"])
+        self.assertEqual(list(y.query_iter("people")), [result])
+        self.assertEqual(os.listdir(self._spill_dir), [])
+
+    def test_bad_budgets(self):
+        with self.assertRaises(ValueError):
+            MemoryBudget(spill_rows=0)
+        with self.assertRaises(TypeError):
+            Yaal(self._tmp, memory_budget=100)
+
+
+class TestSpilledRows(unittest.TestCase):
+
+    def test_groups_compare_like_python(self):
+        big = 2 ** 70
+        store = SpilledRows(("k", "v"), "k")
+        try:
+            store.add([(1, "a"), (None, "b"), (big, "c"), (decimal.Decimal("2.5"), "d"),
+                       ("1", "e"), (True, "f"), (1, memoryview(b"g"))])
+            store.finish()
+            self.assertEqual(len(store), 7)
+            self.assertEqual(store.group(1.0).load().rows, [(1, "a"), (True, "f"), (1, b"g")])
+            self.assertEqual(store.load(None).rows, [(None, "b")])
+            self.assertEqual(store.load(big).rows, [(big, "c")])
+            self.assertEqual(store.load(decimal.Decimal("2.5")).rows,
+                             [(decimal.Decimal("2.5"), "d")])
+            self.assertEqual(store.load("1").rows, [("1", "e")])
+            self.assertEqual(store.load(7).rows, [])
+        finally:
+            store.close()
+
+    def test_missing_partition_column(self):
+        with self.assertRaises(KeyError):
+            SpilledRows(("v",), "k")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Yaal(metrics=True): per-descriptor counters, latency quantiles and Prometheus text."""
+
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal
+from yaal_metrics import MetricsRegistry
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+def _trace(path, ms, status="ok", rows=0, connection="db"):
+    twigs = [{"index": 0, "connection": connection, "runs": 1, "execute_ms": ms / 2,
+              "compile_ms": 0.0, "fetch_ms": 0.0, "rows": rows, "bytes": rows * 10}]
+    return {"path": path, "total_ms": ms, "status": status,
+            "branches": [{"method": "$", "twigs": twigs}]}
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        with sqlite3.connect(self._db_path) as con:
+            con.executescript(SCHEMA.read_text())
+        self._yaal = Yaal(str(FIXTURE_API), metrics=True)
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def test_counts_per_descriptor_and_provider(self):
+        y = self._yaal
+        y.query("user/nested", args={"id": 1})
+        text = y.query_json("user/get", args={"id": 1})
+        y.query("user/create", payload={"name": "x"})
+        with self.assertRaises(Exception):
+            y.query("user/get", args={"id": "x"})
+        out = io.StringIO()
+        y.query_json_to("user/list", out)
+        self.assertEqual(b"".join(y.query_json_stream("user/list")).decode(), out.getvalue())
+        self.assertEqual(len(list(y.query_iter("user/list"))), 2)
+
+        stats = y.metrics_stats()
+        nested = stats["user/nested"]
+        self.assertEqual((nested["calls"], nested["rows"], nested["output_bytes"]), (1, 3, 0))
+        self.assertEqual(nested["providers"]["db"]["calls"], 2)
+        self.assertEqual(stats["user/get"]["output_bytes"], len(text.encode("utf-8")))
+        self.assertEqual((stats["user/create"]["calls"], stats["user/create"]["soft_errors"]),
+                         (1, 1))
+        self.assertEqual(stats["user/list"]["calls"], 3)
+        self.assertEqual(stats["user/list"]["output_bytes"], 2 * len(out.getvalue()))
+        self.assertEqual(stats["user/list"]["rows"], 6)
+        self.assertEqual((stats["user/get"]["calls"], stats["user/get"]["errors"]), (2, 1))
+        for item in stats.values():
+            self.assertLessEqual(item["p50_ms"], item["p95_ms"])
+            self.assertLessEqual(item["p95_ms"], item["p99_ms"])
+
+        text = y.metrics_text()
+        self.assertIn('yaal_queries_total{descriptor="user/list"} 3', text)
+        self.assertIn('yaal_rows_fetched_total{descriptor="user/nested",provider="db"} 3', text)
+        self.assertIn('yaal_query_duration_seconds_bucket{descriptor="user/get",le="+Inf"}', text)
+        self.assertIn('yaal_query_latency_seconds{descriptor="user/get",quantile="0.99"}', text)
+
+    def test_off_by_default(self):
+        y = Yaal(str(FIXTURE_API))
+        y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        self.assertIsNone(y._start_trace("user/get", False))
+        self.assertEqual((y.metrics_stats(), y.metrics_text()), ({}, ""))
+        with self.assertRaises(TypeError):
+            Yaal(str(FIXTURE_API), metrics="yes")
+
+    def test_streamed_rows_are_counted(self):
+        # An unpartitioned array trunk streams from the cursor under query_iter / query_json_to.
+        with tempfile.TemporaryDirectory() as root:
+            api = Path(root) / "people"
+            api.mkdir()
+            (api / "$.sql").write_text("select user_id, user_name from users order by user_id\n")
+            (api / "$.output.yaml").write_text("type: array\n")
+            y = Yaal(root, metrics=True, statement_stats=True)
+            y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+            traces = []
+            y.add_trace_callback(traces.append)
+            y.query("people")
+            self.assertEqual(len(list(y.query_iter("people"))), 2)
+            y.query_json_to("people", io.StringIO())
+
+        self.assertEqual([(t["rows"], t["branches"][0]["twigs"][0]["rows"]) for t in traces],
+                         [(2, 2)] * 3)
+        self.assertEqual(len({t["bytes"] for t in traces}), 1)
+        self.assertEqual(y.metrics_stats()["people"]["rows"], 6)
+        (statement,) = y.statement_stats()
+        self.assertEqual((statement["calls"], statement["rows"]), (3, 6))
+
+    def test_trace_block_reports_output_bytes(self):
+        value = json.loads(self._yaal.query_json("user/get", args={"id": 1}, trace=True))
+        self.assertGreater(value["_trace"]["output_bytes"], 0)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_quantiles_interpolate_within_buckets(self):
+        registry = MetricsRegistry(buckets=(0.01, 0.1, 1.0))
+        for _ in range(90):
+            registry.observe(_trace("a", 5.0))
+        for _ in range(10):
+            registry.observe(_trace("a", 50.0, rows=1))
+        registry.observe(_trace("b", 5000.0, status="exception"))
+        stats = registry.stats()
+        self.assertAlmostEqual(stats["a"]["p50_ms"], 50 / 90 * 10, places=2)
+        self.assertEqual(stats["a"]["p99_ms"], 91.0)
+        self.assertEqual((stats["b"]["errors"], stats["b"]["p50_ms"]), (1, 1000.0))
+
+        lines = registry.text().splitlines()
+        self.assertIn("# TYPE yaal_query_duration_seconds histogram", lines)
+        self.assertIn('yaal_query_duration_seconds_bucket{descriptor="a",le="0.01"} 90', lines)
+        self.assertIn('yaal_query_duration_seconds_bucket{descriptor="a",le="+Inf"} 100', lines)
+        self.assertIn('yaal_query_duration_seconds_count{descriptor="a"} 100', lines)
+        self.assertIn('yaal_provider_calls_total{descriptor="a",provider="db"} 100', lines)
+
+        registry.clear()
+        self.assertEqual(registry.stats(), {})
+
+    def test_label_values_are_escaped(self):
+        registry = MetricsRegistry()
+        registry.observe(_trace('we"ird\\path', 1.0))
+        self.assertIn('descriptor="we\\"ird\\\\path"', registry.text())
+
+    def test_bad_buckets(self):
+        with self.assertRaises(ValueError):
+            MetricsRegistry(buckets=(0.1, 0.01))
+        with self.assertRaises(ValueError):
+            MetricsRegistry(buckets=())
+
+
+if __name__ == "__main__":
+    unittest.main()
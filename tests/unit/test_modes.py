@@ -56,7 +56,7 @@ class TestModes(unittest.TestCase):
             _branch(twig_count=2), True, {"db": provider}, ctx, []
         )
         self.assertIsNone(errors)
-        self.assertEqual(out, [{"page": 1, "total_count": 42}])
+        self.assertEqual(out.dicts(), [{"page": 1, "total_count": 42}])
         self.assertEqual(ctx.get_prop("$params").get_prop("total_count"), 42)
         self.assertTrue(provider.begun)
         self.assertTrue(provider.ended)
@@ -89,8 +89,8 @@ class TestModes(unittest.TestCase):
         ctx = create_context({"path": "op"})
         out, errors = _execute_branch(_branch(), True, {"db": provider}, ctx, [])
         self.assertIsNone(errors)
-        self.assertEqual(out, [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
-        for row in out:
+        self.assertEqual(out.dicts(), [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+        for row in out.dicts():
             self.assertNotIn("$mode", row)
         self.assertTrue(provider.ended)
 
@@ -101,7 +101,7 @@ class TestModes(unittest.TestCase):
         ctx = create_context({"path": "op"})
         out, errors = _execute_branch(_branch(), True, {"db": provider}, ctx, [])
         self.assertIsNone(errors)
-        self.assertEqual(out, [{"id": 7, "ok": True}])
+        self.assertEqual(out.dicts(), [{"id": 7, "ok": True}])
         self.assertTrue(provider.ended)
 
     def test_mode_json_passes_through_non_string(self):
@@ -110,14 +110,14 @@ class TestModes(unittest.TestCase):
         ctx = create_context({"path": "op"})
         out, errors = _execute_branch(_branch(), True, {"db": provider}, ctx, [])
         self.assertIsNone(errors)
-        self.assertEqual(out, [payload])
+        self.assertEqual(out.dicts(), [payload])
 
     def test_ordinary_rows_without_mode(self):
         provider = ScriptedProvider([([{"id": 1}, {"id": 2}], None)])
         ctx = create_context({"path": "op"})
         out, errors = _execute_branch(_branch(), True, {"db": provider}, ctx, [])
         self.assertIsNone(errors)
-        self.assertEqual(out, [{"id": 1}, {"id": 2}])
+        self.assertEqual(out.dicts(), [{"id": 1}, {"id": 2}])
 
 
 if __name__ == "__main__":
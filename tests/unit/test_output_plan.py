@@ -0,0 +1,97 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Output plans: built once by the builder, used by the mapper, kept by yaal compile."""
+
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import yaal_output_schema
+from yaal import Yaal
+from yaal_executor import _output_mapper, map_output, output_plan
+from yaal_output_schema import build_output_plan
+from yaal_precompile import compile_api
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class TestBuildOutputPlan(unittest.TestCase):
+
+    def test_fixture_plan(self):
+        descriptor = Yaal(str(FIXTURE_API)).create_descriptor("user/nested")
+        self.assertEqual(descriptor["output_plan"], {
+            "type": "object",
+            "fields": [["id", "user_id"], ["name", "user_name"], ["roles", None]],
+            "branches": [["roles", {
+                "type": "array",
+                "fields": [["id", "role_id"], ["name", "role_name"]],
+                "branches": [],
+            }]],
+        })
+
+    def test_model_type_wins_and_strings_map(self):
+        plan = build_output_plan("array", {"type": "object", "properties": {"a": "col"}}, None)
+        self.assertEqual(plan, {"type": "object", "fields": [["a", "col"]], "branches": []})
+
+    def test_no_model_passes_rows_through(self):
+        plan = build_output_plan("array", None, None)
+        self.assertEqual(plan, {"type": "array", "fields": [], "branches": []})
+        rows = [{"a": 1, "b": [1]}]
+        self.assertEqual(map_output(plan, rows), rows)
+        self.assertEqual(_output_mapper("array", None, None, rows), rows)
+
+
+class TestPlannedMapping(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        with sqlite3.connect(self._db_path) as con:
+            con.executescript(SCHEMA.read_text())
+        self._url = "sqlite3:///" + self._db_path
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def test_queries_do_not_revisit_the_model(self):
+        y = Yaal(str(FIXTURE_API))
+        y.setup_data_provider("db", self._url)
+        paths = (("user/nested", None), ("user/page", {"page": 1, "page_size": 10}),
+                 ("user/list", None))
+        expected = [y.query(path, args=args) for path, args in paths]
+        with mock.patch.object(yaal_output_schema, "normalize_output_model",
+                               side_effect=AssertionError("model re-normalized")):
+            self.assertEqual([y.query(path, args=args) for path, args in paths], expected)
+            self.assertEqual(list(y.query_iter("user/list")), expected[2])
+
+    def test_descriptors_without_a_plan_get_one(self):
+        descriptor = Yaal(str(FIXTURE_API)).create_descriptor("user/nested")
+        plan = descriptor.pop("output_plan")
+        self.assertEqual(output_plan(descriptor), plan)
+        self.assertIs(output_plan(descriptor), descriptor["output_plan"])
+
+    def test_compiled_artifacts_carry_the_plan(self):
+        with tempfile.TemporaryDirectory() as out:
+            compile_api(str(FIXTURE_API), out, list_paths=["user/nested"])
+            with open(Path(out) / "user" / "nested.json", encoding="utf-8") as f:
+                artifact = json.load(f)
+            source = Yaal(str(FIXTURE_API), debug=True)
+            self.assertEqual(artifact["output_plan"],
+                             source.create_descriptor("user/nested")["output_plan"])
+
+            source.setup_data_provider("db", self._url)
+            pre = Yaal(str(FIXTURE_API), precompiled=out)
+            pre.setup_data_provider("db", self._url)
+            self.assertEqual(pre.query("user/nested"), source.query("user/nested"))
+
+
+if __name__ == "__main__":
+    unittest.main()
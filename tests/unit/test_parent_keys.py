@@ -0,0 +1,194 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""{{$parent_keys}}: child SQL filtered to the parent's partition keys."""
+
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal, create_context
+from yaal_executor import MAX_BOUND_PARAMS, MAX_PARENT_KEYS, DataProviderHelper, get_result
+
+ROOT = Path(__file__).resolve().parents[2]
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+OUTPUT = """\
+type: array
+partition_by: user_id
+properties:
+  id:
+    mapped: user_id
+  roles:
+    type: array
+    properties:
+      id:
+        mapped: role_id
+"""
+
+TRUNK_SQL = """\
+--($args.limit! integer)--
+
+SELECT user_id FROM users ORDER BY user_id LIMIT {{$args.limit}}
+"""
+
+ROLES_SQL = """\
+--($parent_keys integer)--
+
+SELECT ur.user_id, ur.role_id
+FROM user_roles ur
+WHERE ur.user_id IN ({{$parent_keys}})
+ORDER BY ur.user_id, ur.role_id
+"""
+
+
+class _RecordingProvider:
+
+    def __init__(self, inner, log):
+        self._inner = inner
+        self._log = log
+
+    def begin(self):
+        self._inner.begin()
+
+    def end(self):
+        self._inner.end()
+
+    def error(self):
+        self._inner.error()
+
+    def execute(self, twig, input_shape, helper):
+        compiled = helper.get_executable_content("?", twig, input_shape)
+        self._log.append(compiled["content"])
+        return self._inner.execute(twig, input_shape, helper)
+
+
+class TestParentKeysHelper(unittest.TestCase):
+
+    def test_padded_to_power_of_two(self):
+        twig = {
+            "content": [
+                {"type": "word", "value": "IN"},
+                {"type": "space", "value": " "},
+                {"type": "brace", "value": "(", "group": 1},
+                {"type": "parameter", "name": "$parent_keys"},
+                {"type": "brace", "value": ")", "group": 1},
+            ],
+            "parameters": [{"name": "$parent_keys", "type": "integer"}],
+        }
+        helper = DataProviderHelper()
+        helper.set_parent_keys([3, 1, 2])
+        sql = helper.get_executable_content("?", twig, create_context({"path": "p"}))
+        self.assertEqual(sql["content"], "IN (?, ?, ?, ?)")
+        self.assertEqual(helper.build_parameters(sql, create_context({"path": "p"}), None),
+                         [3, 1, 2, 2])
+
+        helper.set_parent_keys([5, 6, 7, 8])
+        again = helper.get_executable_content("?", twig, create_context({"path": "p"}))
+        self.assertEqual(again["content"], sql["content"])
+
+
+class TestParentKeysPushdown(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        api = Path(self._root) / "api" / "users"
+        api.mkdir(parents=True)
+        (api / "$.sql").write_text(TRUNK_SQL)
+        (api / "$.roles.sql").write_text(ROLES_SQL)
+        (api / "$.output.yaml").write_text(OUTPUT)
+        self._db_path = str(Path(self._root) / "app.db")
+        con = sqlite3.connect(self._db_path)
+        con.executescript(SCHEMA.read_text())
+        con.execute("INSERT INTO users VALUES (3, 'third', 1)")
+        con.execute("INSERT INTO user_roles VALUES (3, 1)")
+        con.commit()
+        con.close()
+        self._yaal = Yaal(str(Path(self._root) / "api"), debug=True)
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _query(self, limit):
+        log = []
+        descriptor = self._yaal.create_descriptor("users")
+        context = create_context(descriptor, args={"limit": limit})
+        result = get_result(
+            descriptor,
+            lambda name: _RecordingProvider(self._yaal.get_data_provider(name), log),
+            context,
+        )
+        return result, log
+
+    def test_children_fetched_for_returned_parents_only(self):
+        result, log = self._query(2)
+        self.assertEqual(result, [
+            {"id": 1, "roles": [{"id": 1}, {"id": 2}]},
+            {"id": 2, "roles": [{"id": 2}]},
+        ])
+        self.assertIn("IN (?, ?)", log[1])
+
+    def test_no_parents_skips_child_query(self):
+        result, log = self._query(0)
+        self.assertEqual(result, [])
+        self.assertEqual(len(log), 1)
+
+    def test_descriptor_and_payload_model(self):
+        descriptor = self._yaal.create_descriptor("users")
+        roles = descriptor["branches"][0]
+        self.assertEqual(roles["parent_key"], "user_id")
+        self.assertEqual(roles["depends_on"], ["$"])
+        self.assertNotIn("$parent_keys", str(descriptor["model"]["payload"]))
+
+    def test_streaming_and_concurrent_paths_agree(self):
+        expected = self._yaal.query("users", args={"limit": 3})
+        self.assertEqual(list(self._yaal.query_iter("users", args={"limit": 3})), expected)
+        concurrent = Yaal(str(Path(self._root) / "api"), debug=True, max_branch_workers=4)
+        concurrent.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        self.assertEqual(concurrent.query("users", args={"limit": 3}), expected)
+
+    def test_parent_without_partition_by_rejected(self):
+        (Path(self._root) / "api" / "users" / "$.output.yaml").write_text(
+            OUTPUT.replace("partition_by: user_id\n", "", 1)
+        )
+        with self.assertRaises(TypeError):
+            self._yaal.create_descriptor("users")
+
+    def test_long_key_lists_run_in_chunks(self):
+        con = sqlite3.connect(self._db_path)
+        count = MAX_PARENT_KEYS + 5
+        con.executemany("INSERT INTO users VALUES (?, 'u', 1)", [(i,) for i in range(10, 10 + count)])
+        con.executemany("INSERT INTO user_roles VALUES (?, 2)", [(i,) for i in range(10, 10 + count)])
+        con.commit()
+        con.close()
+        result, log = self._query(count + 3)
+        self.assertEqual(len(result), count + 3)
+        self.assertTrue(all(item["roles"] for item in result))
+        self.assertEqual(len(log), 3)
+
+    def test_chunks_stay_within_bound_variable_limit(self):
+        # Two key lists plus one other value: 256 keys, 2 * 256 + 1 values per statement.
+        (Path(self._root) / "api" / "users" / "$.roles.sql").write_text(
+            "--($parent_keys integer, $args.limit! integer)--\n\n"
+            "SELECT ur.user_id, ur.role_id FROM user_roles ur\n"
+            "WHERE ur.user_id IN ({{$parent_keys}}) AND ur.role_id <= {{$args.limit}}\n"
+            "   OR ur.role_id IN ({{$parent_keys}})\n"
+            "ORDER BY ur.user_id, ur.role_id\n"
+        )
+        con = sqlite3.connect(self._db_path)
+        count = MAX_BOUND_PARAMS
+        con.executemany("INSERT INTO users VALUES (?, 'u', 1)",
+                        [(i,) for i in range(10, 10 + count)])
+        con.commit()
+        con.close()
+        result, log = self._query(count + 3)
+        self.assertEqual(len(result), count + 3)
+        self.assertEqual([sql.count("?") for sql in log[1:]], [513] * 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
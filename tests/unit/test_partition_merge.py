@@ -0,0 +1,160 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""partition_strategy: merge — ordered parent/child stitching."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import FileContentReader, Yaal
+from yaal_errors import PartitionOrderError
+from yaal_executor import _GroupCursor, _consecutive_groups, _merge_partitions
+from yaal_rows import RowSet
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class _StrategyReader(FileContentReader):
+    """Fixture reader that rewrites the root output model (array + strategy)."""
+
+    def __init__(self, root_path, strategy):
+        super().__init__(root_path)
+        self._strategy = strategy
+
+    def get_config(self, path, output_mapper):
+        config = super().get_config(path, output_mapper)
+        model = dict(config["output.model"])
+        model["type"] = "array"
+        if self._strategy:
+            model["partition_strategy"] = self._strategy
+        return {"output.model": model}
+
+
+def _merge(parents, children):
+    merged = _merge_partitions(RowSet.from_dicts(parents), RowSet.from_dicts(children), "k", "c")
+    return merged.dicts()
+
+
+class TestMergePartitions(unittest.TestCase):
+
+    def test_stitches_groups_in_order(self):
+        out = _merge(
+            [{"k": 1}, {"k": 2}, {"k": 3}],
+            [{"k": 1, "v": "a"}, {"k": 1, "v": "b"}, {"k": 3, "v": "c"}],
+        )
+        self.assertEqual([r["c"] for r in out], [
+            [{"k": 1, "v": "a"}, {"k": 1, "v": "b"}],
+            [],
+            [{"k": 3, "v": "c"}],
+        ])
+
+    def test_parent_fan_out_collapses_to_first_row(self):
+        out = _merge([{"k": 1, "r": 1}, {"k": 1, "r": 2}, {"k": 2, "r": 3}], [])
+        self.assertEqual([r["r"] for r in out], [1, 3])
+
+    def test_orphan_children_dropped(self):
+        out = _merge([{"k": 2}], [{"k": 1}, {"k": 2}, {"k": 5}])
+        self.assertEqual(out[0]["c"], [{"k": 2}])
+
+    def test_parent_out_of_order_raises(self):
+        with self.assertRaises(PartitionOrderError):
+            _merge([{"k": 2}, {"k": 1}], [])
+
+    def test_child_out_of_order_raises(self):
+        with self.assertRaises(PartitionOrderError):
+            _merge([{"k": 1}, {"k": 2}], [{"k": 2}, {"k": 1}])
+
+    def test_trailing_child_out_of_order_raises(self):
+        with self.assertRaises(PartitionOrderError):
+            _merge([{"k": 1}], [{"k": 1}, {"k": 9}, {"k": 3}])
+
+    def test_incomparable_keys_raise(self):
+        with self.assertRaises(PartitionOrderError):
+            _merge([{"k": 1}, {"k": "a"}], [])
+
+    def test_null_keys_sort_first_or_last(self):
+        # LEFT JOIN rows: SQLite / MySQL put NULL keys first, Postgres last.
+        null = {"k": None, "v": "n"}
+        children = [{"k": 1, "v": "a"}, {"k": 2, "v": "b"}]
+        for nulls_first in (True, False):
+            with self.subTest(nulls_first=nulls_first):
+                parents = [{"k": 1}, {"k": 2}]
+                parents = [{"k": None}] * 2 + parents if nulls_first else parents + [{"k": None}]
+                out = _merge(parents, [null] + children if nulls_first else children + [null])
+                self.assertEqual({r["k"]: [c["v"] for c in r["c"]] for r in out},
+                                 {None: ["n"], 1: ["a"], 2: ["b"]})
+                # As with the hash strategy, a NULL parent without NULL children gets none.
+                out = _merge(parents, children)
+                self.assertEqual({r["k"]: len(r["c"]) for r in out}, {None: 0, 1: 1, 2: 1})
+        with self.assertRaises(PartitionOrderError):
+            _merge([{"k": None}, {"k": 1}, {"k": None}], [])
+        with self.assertRaises(PartitionOrderError):
+            _merge([{"k": 1}], [{"k": 1}, {"k": None}, {"k": 2}])
+
+    def test_keys_must_order_as_in_python(self):
+        # A case-insensitive collation orders 'a' before 'B'; Python does not.
+        with self.assertRaises(PartitionOrderError):
+            _merge([{"k": "a"}, {"k": "B"}], [])
+
+    def test_missing_key_raises(self):
+        with self.assertRaises(KeyError):
+            _merge([{"k": 1}], [{"x": 1}])
+
+    def test_lazy_over_iterators(self):
+        pulled = []
+
+        def children():
+            for k in (1, 1, 2):
+                pulled.append(k)
+                yield k, {"k": k}
+
+        parents = _consecutive_groups(iter([(1, "a"), (2, "b")]), "k")
+        cursor = _GroupCursor(children(), "k")
+        key, _group = next(parents)
+        self.assertEqual(len(cursor.take(key)), 2)
+        self.assertEqual(pulled, [1, 1, 2])
+
+
+class TestMergeStrategyFixtures(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        con = sqlite3.connect(self._db_path)
+        con.executescript(SCHEMA.read_text())
+        con.execute("INSERT INTO users VALUES (3, 'nobody', 1)")
+        con.commit()
+        con.close()
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def _yaal(self, strategy):
+        y = Yaal(str(FIXTURE_API), _StrategyReader(str(FIXTURE_API), strategy), debug=True)
+        y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        return y
+
+    def test_merge_matches_hash(self):
+        merged = self._yaal("merge").query("user/nested")
+        hashed = self._yaal(None).query("user/nested")
+        self.assertEqual(merged, hashed)
+        self.assertEqual([u["id"] for u in merged], [1, 2, 3])
+        self.assertEqual(merged[2]["roles"], [])
+
+    def test_descriptor_records_strategy(self):
+        descriptor = self._yaal("merge").create_descriptor("user/nested")
+        self.assertEqual(descriptor["partition_strategy"], "merge")
+
+    def test_unknown_strategy_rejected(self):
+        with self.assertRaises(TypeError):
+            self._yaal("sorted").create_descriptor("user/nested")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Yaal.query_iter — streamed top-level items inside one managed transaction."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import FileContentReader, Yaal, create_context
+from yaal_executor import iter_result
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+STREAM_OUTPUT = """\
+type: array
+partition_by: user_id
+partition_strategy: merge
+properties:
+  id:
+    mapped: user_id
+  name:
+    mapped: user_name
+  roles:
+    type: array
+    partition_by: role_id
+    parent_rows: true
+    properties:
+      id:
+        mapped: role_id
+      name:
+        mapped: role_name
+"""
+
+STREAM_SQL = """\
+INSERT INTO roles (role_id, role_name, active) VALUES (9, 'Audit', 1)
+
+--sql--
+
+SELECT
+    u.user_id,
+    u.user_name,
+    r.role_id,
+    r.role_name
+FROM users u
+INNER JOIN user_roles ur ON ur.user_id = u.user_id
+INNER JOIN roles r ON r.role_id = ur.role_id
+ORDER BY u.user_id, r.role_id
+"""
+
+
+class _MergeReader(FileContentReader):
+
+    def get_config(self, path, output_mapper):
+        config = super().get_config(path, output_mapper)
+        model = dict(config["output.model"])
+        model["type"] = "array"
+        model["partition_strategy"] = "merge"
+        return {"output.model": model}
+
+
+class _IterProvider:
+    """Fake provider whose execute_iter records how far its rows were pulled."""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self.pulled = 0
+        self.calls = []
+
+    def begin(self):
+        self.calls.append("begin")
+
+    def end(self):
+        self.calls.append("end")
+
+    def error(self):
+        self.calls.append("error")
+
+    def execute(self, twig, ctx, helper):
+        return list(self._rows), None
+
+    def execute_iter(self, twig, ctx, helper):
+        def rows():
+            for row in self._rows:
+                self.pulled += 1
+                yield dict(row)
+        return rows(), None
+
+
+def _trunk():
+    return {
+        "path": "p",
+        "input_type": "object",
+        "output_type": "array",
+        "method": "$",
+        "connections": ["db"],
+        "model": {"output": None},
+        "twigs": [{"connection": "db", "content": [], "parameters": []}],
+    }
+
+
+class TestIterResult(unittest.TestCase):
+
+    def test_rows_pulled_lazily_and_committed(self):
+        provider = _IterProvider([{"id": i} for i in range(5)])
+        descriptor = _trunk()
+        items = iter_result(descriptor, lambda _name: provider,
+                            create_context(descriptor), batch_size=2)
+        self.assertEqual(next(items), {"id": 0})
+        self.assertEqual(provider.pulled, 2)
+        self.assertEqual([item["id"] for item in items], [1, 2, 3, 4])
+        self.assertEqual(provider.calls, ["begin", "end"])
+
+    def test_partition_without_children_keeps_every_row(self):
+        provider = _IterProvider([{"k": 1}, {"k": 1}])
+        descriptor = _trunk()
+        descriptor["partition_by"] = "k"
+        descriptor["partition_strategy"] = "merge"
+        items = list(iter_result(descriptor, lambda _name: provider, create_context(descriptor)))
+        self.assertEqual(items, [{"k": 1}, {"k": 1}])
+
+    def test_early_close_rolls_back(self):
+        provider = _IterProvider([{"id": 1}, {"id": 2}])
+        descriptor = _trunk()
+        items = iter_result(descriptor, lambda _name: provider, create_context(descriptor))
+        next(items)
+        items.close()
+        self.assertEqual(provider.calls, ["begin", "error"])
+
+    def test_mode_error_is_soft(self):
+        provider = _IterProvider([{"$mode": "error", "message": "nope"}])
+        descriptor = _trunk()
+        items = list(iter_result(descriptor, lambda _name: provider, create_context(descriptor)))
+        self.assertEqual(items, [{"errors": [{"$mode": "error", "message": "nope"}]}])
+        self.assertEqual(provider.calls, ["begin", "error"])
+
+
+class TestQueryIterFixtures(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        sqlite3.connect(self._db_path).executescript(SCHEMA.read_text())
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def _yaal(self, root=FIXTURE_API, reader=None):
+        y = Yaal(str(root), reader, debug=True)
+        y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        return y
+
+    def test_matches_query_on_buffered_fallback(self):
+        y = self._yaal()
+        for path, args in (("user/list", None), ("user/nested", None),
+                           ("user/page", {"page": 1, "page_size": 10})):
+            with self.subTest(path=path):
+                streamed = list(y.query_iter(path, args=args))
+                result = y.query(path, args=args)
+                if isinstance(result, dict):
+                    self.assertEqual(streamed, [result])
+                else:
+                    self.assertEqual(streamed, result)
+
+    def test_matches_query_with_merge_strategy(self):
+        y = self._yaal(reader=_MergeReader(str(FIXTURE_API)))
+        self.assertEqual(list(y.query_iter("user/nested")), y.query("user/nested"))
+        self.assertEqual(list(y.query_iter("user/list")), y.query("user/list"))
+
+    def test_missing_payload_yields_soft_errors(self):
+        items = list(self._yaal().query_iter("user/create", payload={"name": "x"}))
+        self.assertEqual(len(items), 1)
+        self.assertIn("errors", items[0])
+
+
+class TestQueryIterTransaction(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        api = Path(self._root) / "user" / "stream"
+        api.mkdir(parents=True)
+        (api / "$.sql").write_text(STREAM_SQL)
+        (api / "$.output.yaml").write_text(STREAM_OUTPUT)
+        self._db_path = os.path.join(self._root, "app.db")
+        sqlite3.connect(self._db_path).executescript(SCHEMA.read_text())
+        self._yaal = Yaal(self._root, debug=True)
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _audit_roles(self):
+        con = sqlite3.connect(self._db_path)
+        try:
+            return con.execute("SELECT COUNT(*) FROM roles WHERE role_id = 9").fetchone()[0]
+        finally:
+            con.close()
+
+    def test_parent_rows_stream_and_exhaustion_commits(self):
+        items = list(self._yaal.query_iter("user/stream"))
+        self.assertEqual(items, [
+            {"id": 1, "name": "admin", "roles": [
+                {"id": 1, "name": "Administrator"}, {"id": 2, "name": "User"}]},
+            {"id": 2, "name": "guest", "roles": [{"id": 2, "name": "User"}]},
+        ])
+        self.assertEqual(self._audit_roles(), 1)
+
+    def test_early_close_rolls_back(self):
+        items = self._yaal.query_iter("user/stream")
+        self.assertEqual(next(items)["id"], 1)
+        items.close()
+        self.assertEqual(self._audit_roles(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Incremental JSON output: query_json_to / query_json_stream."""
+
+import datetime
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal, create_context
+from yaal_executor import get_result_json, iter_result_json
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class _Provider:
+
+    def __init__(self, rows):
+        self._rows = rows
+        self.calls = []
+
+    def begin(self):
+        self.calls.append("begin")
+
+    def end(self):
+        self.calls.append("end")
+
+    def error(self):
+        self.calls.append("error")
+
+    def execute(self, twig, ctx, helper):
+        return [dict(row) for row in self._rows], None
+
+
+def _trunk(output_type="array"):
+    return {
+        "path": "p",
+        "input_type": "object",
+        "output_type": output_type,
+        "method": "$",
+        "connections": ["db"],
+        "model": {"output": None},
+        "twigs": [{"connection": "db", "content": [], "parameters": []}],
+    }
+
+
+class TestIterResultJson(unittest.TestCase):
+
+    def _both(self, descriptor, rows):
+        fragments = list(iter_result_json(
+            descriptor, lambda _name: _Provider(rows), create_context(descriptor)
+        ))
+        expected = get_result_json(
+            descriptor, lambda _name: _Provider(rows), create_context(descriptor)
+        )
+        return fragments, expected
+
+    def test_array_written_per_item(self):
+        stamp = datetime.datetime(2020, 1, 2, 3, 4, 5)
+        fragments, expected = self._both(_trunk(), [{"id": 1, "at": stamp}, {"id": 2, "at": None}])
+        self.assertEqual("".join(fragments), expected)
+        self.assertEqual(fragments[0], "[")
+        self.assertEqual(len(fragments), 4)
+
+    def test_empty_array(self):
+        fragments, expected = self._both(_trunk(), [])
+        self.assertEqual("".join(fragments), expected)
+        self.assertEqual(expected, "[]")
+
+    def test_object_and_mode_error(self):
+        for rows in ([{"id": 1}], [{"$mode": "error", "message": "no"}]):
+            with self.subTest(rows=rows):
+                fragments, expected = self._both(_trunk("object"), rows)
+                self.assertEqual("".join(fragments), expected)
+
+
+class TestQueryJsonStream(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        sqlite3.connect(self._db_path).executescript(SCHEMA.read_text())
+        self._yaal = Yaal(str(FIXTURE_API), debug=True)
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def test_query_json_to_matches_query_json(self):
+        for path, args in (("user/list", None), ("user/nested", None),
+                           ("user/page", {"page": 1, "page_size": 10})):
+            with self.subTest(path=path):
+                fp = io.StringIO()
+                self._yaal.query_json_to(path, fp, args=args)
+                self.assertEqual(fp.getvalue(), self._yaal.query_json(path, args=args))
+
+    def test_stream_chunks(self):
+        expected = self._yaal.query_json("user/list").encode("utf-8")
+        whole = list(self._yaal.query_json_stream("user/list"))
+        self.assertEqual(whole, [expected])
+        small = list(self._yaal.query_json_stream("user/list", chunk_size=1))
+        self.assertGreater(len(small), 1)
+        self.assertEqual(b"".join(small), expected)
+
+    def test_soft_errors(self):
+        chunks = self._yaal.query_json_stream("user/create", payload={"name": "x"})
+        expected = self._yaal.query_json("user/create", payload={"name": "x"})
+        self.assertEqual(b"".join(chunks).decode("utf-8"), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
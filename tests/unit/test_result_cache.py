@@ -0,0 +1,200 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Result cache: cache: blocks in $.output.yaml, TTL, tags and invalidation."""
+
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal
+from yaal_cache import MemoryResultCache
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+CACHE_BLOCK = """\
+cache:
+  ttl: 30
+  tags: [users]
+  key: [active]
+"""
+
+
+class _Clock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class _CountingManager:
+
+    def __init__(self, inner, begins):
+        self._inner = inner
+        self._begins = begins
+        self.on_begin = None
+
+    def get_context(self):
+        self._begins.append(1)
+        if self.on_begin is not None:
+            self.on_begin()
+        return self._inner.get_context()
+
+
+class TestMemoryResultCache(unittest.TestCase):
+
+    def test_ttl_and_tags(self):
+        clock = _Clock()
+        cache = MemoryResultCache(clock=clock)
+        cache.set("a", [1], 10, ["users"])
+        self.assertEqual(cache.get("a"), [1])
+        clock.now += 10
+        self.assertIsNone(cache.get("a"))
+
+        cache.set("a", [1], 10, ["users"])
+        cache.set("b", [2], 10, ["roles"])
+        cache.invalidate(["users"])
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), [2])
+        # Entries stored after an invalidation are valid again.
+        cache.set("a", [3], 10, ["users"])
+        self.assertEqual(cache.get("a"), [3])
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["invalidations"]), (3, 2, 1))
+
+        # An entry stored with a snapshot taken before an invalidation is stale.
+        versions = cache.versions_for(["users"])
+        cache.invalidate(["users"])
+        cache.set("a", [4], 10, ["users"], versions=versions)
+        self.assertIsNone(cache.get("a"))
+
+
+class TestCacheBlock(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._api = Path(self._root) / "api"
+        shutil.copytree(str(FIXTURE_API), str(self._api))
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _descriptor(self, path, block):
+        output = self._api / path / "$.output.yaml"
+        output.write_text(block + output.read_text())
+        return Yaal(str(self._api)).create_descriptor(path)
+
+    def test_parsed_onto_trunk(self):
+        descriptor = self._descriptor("user/list", CACHE_BLOCK)
+        self.assertEqual(descriptor["cache"], {"ttl": 30, "tags": ["users"], "key": ["active"],
+                                               "revalidate": None})
+        descriptor = self._descriptor("user/create", "cache:\n  invalidates: users\n")
+        self.assertEqual(descriptor["invalidates"], ["users"])
+        self.assertNotIn("cache", descriptor)
+
+    def test_rejected_blocks(self):
+        cases = [
+            ("user/list", "cache:\n  ttl: 0\n"),
+            ("user/list", "cache:\n  ttl: 5\n  key: [nope]\n"),
+            ("user/list", "cache:\n  tags: [users]\n"),
+            ("user/list", "cache:\n  ttl: 5\n  tag: [users]\n"),
+            ("user/create", "cache:\n  ttl: 5\n"),
+        ]
+        for path, block in cases:
+            with self.subTest(block=block):
+                shutil.rmtree(str(self._api))
+                shutil.copytree(str(FIXTURE_API), str(self._api))
+                with self.assertRaises(TypeError):
+                    self._descriptor(path, block)
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        api = Path(self._root) / "api"
+        shutil.copytree(str(FIXTURE_API), str(api))
+        for path, block in (("user/list", CACHE_BLOCK),
+                            ("user/create", "cache:\n  invalidates: [users]\n")):
+            output = api / path / "$.output.yaml"
+            output.write_text(block + output.read_text())
+        self._db_path = str(Path(self._root) / "app.db")
+        con = sqlite3.connect(self._db_path)
+        con.executescript(SCHEMA.read_text())
+        con.close()
+        self._clock = _Clock()
+        self._begins = []
+        self._yaal = Yaal(str(api), result_cache=MemoryResultCache(clock=self._clock))
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        self._yaal._data_providers["db"] = _CountingManager(self._yaal._data_providers["db"],
+                                                            self._begins)
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _insert_directly(self, user_id):
+        con = sqlite3.connect(self._db_path)
+        con.execute("INSERT INTO users VALUES (?, 'direct', 1)", (user_id,))
+        con.commit()
+        con.close()
+
+    def test_hits_skip_providers(self):
+        first = self._yaal.query("user/list", args={"active": 1})
+        self._insert_directly(50)
+        self.assertEqual(self._yaal.query("user/list", args={"active": "1"}), first)
+        self.assertEqual(self._yaal.query_json("user/list", args={"active": 1}),
+                         self._yaal.query_json("user/list", args={"active": 1}))
+        self.assertEqual(len(self._begins), 1)
+        # Only key args matter: sort is not part of the key.
+        self.assertEqual(self._yaal.query("user/list", args={"active": 1, "sort": "name"}), first)
+        # Callers get copies.
+        self._yaal.query("user/list", args={"active": 1}).append("x")
+        self.assertEqual(self._yaal.query("user/list", args={"active": 1}), first)
+
+        self._clock.now += 30
+        self.assertNotEqual(self._yaal.query("user/list", args={"active": 1}), first)
+        self.assertEqual(len(self._begins), 2)
+
+    def test_write_invalidates_tags(self):
+        before = self._yaal.query("user/list", args={"active": 1})
+        self._yaal.query("user/create", payload={"id": 7, "name": "neo"})
+        after = self._yaal.query("user/list", args={"active": 1})
+        self.assertEqual(len(after), len(before) + 1)
+
+        # A rejected write leaves the cache alone.
+        self._yaal.query("user/create", payload={"name": "x"})
+        self._yaal.query("user/list", args={"active": 1})
+        self.assertEqual(self._yaal.result_cache_stats()["invalidations"], 1)
+
+    def test_invalidate_during_a_read_leaves_it_stale(self):
+        # A write landing while the read runs: the read's entry must not count as fresh.
+        manager = self._yaal._data_providers["db"]
+        manager.on_begin = lambda: self._yaal.invalidate_tags(["users"])
+        self._yaal.query("user/list", args={"active": 1})
+        manager.on_begin = None
+        self._yaal.query("user/list", args={"active": 1})
+        self.assertEqual(len(self._begins), 2)
+        self._yaal.query("user/list", args={"active": 1})
+        self.assertEqual(len(self._begins), 2)
+
+    def test_session_invalidates_on_commit(self):
+        before = self._yaal.query("user/list", args={"active": 1})
+        with self._yaal.session() as s:
+            s.query("user/create", payload={"id": 7, "name": "neo"})
+            self.assertEqual(self._yaal.query("user/list", args={"active": 1}), before)
+        self.assertEqual(len(self._yaal.query("user/list", args={"active": 1})), len(before) + 1)
+
+        with self._yaal.session(read_only=True) as s:
+            s.query("user/create", payload={"id": 8, "name": "trinity"})
+        self.assertEqual(self._yaal.result_cache_stats()["invalidations"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Tuple rows with a shared column index, from provider to output mapper."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal, create_context
+from yaal_executor import DataProviderHelper, _output_mapper, get_result
+from yaal_provider import fetch_row_set, iter_row_stream
+from yaal_rows import MISSING, RowSet, RowStream, as_row_set
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class _DictProvider:
+    """Wraps a provider and hands its rows back as row dicts (the original protocol)."""
+
+    def __init__(self, inner):
+        self._inner = inner
+
+    def begin(self):
+        self._inner.begin()
+
+    def end(self):
+        self._inner.end()
+
+    def error(self):
+        self._inner.error()
+
+    def execute(self, twig, input_shape, helper):
+        rows, last_inserted_id = self._inner.execute(twig, input_shape, helper)
+        return rows.dicts(), last_inserted_id
+
+
+class TestRowSet(unittest.TestCase):
+
+    def test_from_dicts_shares_one_index(self):
+        rs = RowSet.from_dicts([{"a": 1, "b": 2}, {"a": 3, "b": 4}])
+        self.assertEqual(rs.columns, ("a", "b"))
+        self.assertEqual(rs.rows, [(1, 2), (3, 4)])
+        self.assertFalse(rs.sparse)
+        self.assertEqual(rs.dicts(), [{"a": 1, "b": 2}, {"a": 3, "b": 4}])
+
+    def test_sparse_rows_keep_their_keys(self):
+        rs = RowSet.from_dicts([{"a": 1}, {"b": 2}])
+        self.assertTrue(rs.sparse)
+        self.assertEqual(rs.rows, [(1, MISSING), (MISSING, 2)])
+        self.assertEqual(rs.dicts(), [{"a": 1}, {"b": 2}])
+        with self.assertRaises(KeyError):
+            rs.column("a", "parent")
+
+    def test_child_names_become_children(self):
+        rs = RowSet.from_dicts([{"id": 1, "kids": [{"k": 1}]}], child_names=("kids",))
+        self.assertEqual(rs.columns, ("id",))
+        self.assertEqual(rs.children["kids"][0].rows, [(1,)])
+
+    def test_concat_and_take(self):
+        first = RowSet(("a",), [(1,), (2,)])
+        both = RowSet.concat([first, RowSet.empty(), RowSet(("a",), [(3,)])])
+        self.assertIs(both.index, first.index)
+        self.assertEqual(both.rows, [(1,), (2,), (3,)])
+        both.attach("c", ["x", "y", "z"])
+        picked = both.take([2, 0])
+        self.assertEqual(picked.rows, [(3,), (1,)])
+        self.assertEqual(picked.children["c"], ["z", "x"])
+        self.assertNotIn("c", first.children)
+
+    def test_opaque_values(self):
+        rs = as_row_set([1, "two"])
+        self.assertIsNone(rs.columns)
+        self.assertEqual(_output_mapper("array", None, None, rs), [1, "two"])
+
+
+class TestCursorHelpers(unittest.TestCase):
+
+    def setUp(self):
+        self._con = sqlite3.connect(":memory:")
+        self._con.executescript(SCHEMA.read_text())
+
+    def tearDown(self):
+        self._con.close()
+
+    def test_fetch_row_set(self):
+        rs = fetch_row_set(self._con.execute("SELECT user_id, user_name FROM users ORDER BY 1"),
+                           batch_size=1)
+        self.assertEqual(rs.columns, ("user_id", "user_name"))
+        self.assertEqual(rs.rows, [(1, "admin"), (2, "guest")])
+        self.assertEqual(len(fetch_row_set(self._con.execute("UPDATE users SET active = 1"))), 0)
+
+    def test_iter_row_stream_closes_cursor(self):
+        cur = self._con.execute("SELECT user_id FROM users ORDER BY 1")
+        stream = iter_row_stream(cur, batch_size=1)
+        self.assertIsInstance(stream, RowStream)
+        self.assertEqual(next(iter(stream.rows)), (1,))
+        stream.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            cur.fetchone()
+
+
+class TestRowPipeline(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        con = sqlite3.connect(self._db_path)
+        con.executescript(SCHEMA.read_text())
+        con.execute("INSERT INTO users VALUES (3, 'third', 1)")
+        con.commit()
+        con.close()
+        self._yaal = Yaal(str(FIXTURE_API), debug=True)
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def test_sqlite_returns_tuples(self):
+        descriptor = self._yaal.create_descriptor("user/list")
+        provider = self._yaal.get_data_provider("db")
+        provider.begin()
+        try:
+            rows, _last_id = provider.execute(descriptor["twigs"][0], create_context(descriptor),
+                                              DataProviderHelper())
+        finally:
+            provider.end()
+        self.assertIsInstance(rows, RowSet)
+        self.assertTrue(all(type(row) is tuple for row in rows.rows))
+
+    def test_dict_providers_give_the_same_results(self):
+        for path, args in (("user/list", None), ("user/nested", None),
+                           ("user/page", {"page": 1, "page_size": 10}), ("user/combine", None)):
+            with self.subTest(path=path):
+                descriptor = self._yaal.create_descriptor(path)
+                legacy = get_result(
+                    descriptor,
+                    lambda name: _DictProvider(self._yaal.get_data_provider(name)),
+                    create_context(descriptor, args=args),
+                )
+                self.assertEqual(legacy, self._yaal.query(path, args=args))
+
+    def test_streaming_matches_buffered(self):
+        for path in ("user/list", "user/nested"):
+            with self.subTest(path=path):
+                self.assertEqual(list(self._yaal.query_iter(path)), _as_list(self._yaal.query(path)))
+
+    def test_mapped_keys_follow_the_model(self):
+        rs = RowSet(("b", "a"), [(2, 1)])
+        model = {"type": "array", "properties": {"x": {"mapped": "a"}, "y": {"mapped": "b"}}}
+        self.assertEqual(list(_output_mapper("array", model, None, rs)[0]), ["x", "y"])
+        with self.assertRaisesRegex(Exception, "c _mapped column missing"):
+            _output_mapper("array", {"properties": {"x": {"mapped": "c"}}}, None, rs)
+        self.assertEqual(
+            _output_mapper("array", {"properties": {"x": {"mapped": "c"}}}, None, RowSet(("b",), [])),
+            [],
+        )
+
+
+def _as_list(result):
+    return result if type(result) is list else [result]
+
+
+if __name__ == "__main__":
+    unittest.main()
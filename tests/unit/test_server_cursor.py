@@ -0,0 +1,195 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Server-side cursors: server_cursor in $.output.yaml / the URL, named and unbuffered cursors."""
+
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal, create_context
+from yaal_executor import DataProviderHelper
+from yaal_mysql import MySQLDataProvider
+from yaal_postgres import PostgresDataProvider
+from yaal_provider import (
+    CursorRows,
+    fetch_row_set,
+    iter_row_stream,
+    server_cursor_options,
+    use_server_cursor,
+)
+from yaal_rows import RowStream
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+
+
+class _Cursor:
+    """DB-API cursor over fixed rows; server_side ones describe columns after a fetch."""
+
+    def __init__(self, rows, server_side=False, **kwargs):
+        self._rows = list(rows)
+        self._described = not server_side
+        self.kwargs = kwargs
+        self.fetches = 0
+        self.closed = False
+        self.with_rows = True
+        self.lastrowid = None
+        self.statusmessage = "SELECT"
+        self.executed = None
+
+    @property
+    def description(self):
+        return (("id",), ("name",)) if self._described else None
+
+    def execute(self, sql, args):
+        self.executed = sql
+
+    def fetchmany(self, size):
+        self._described = True
+        self.fetches += 1
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class _Connection:
+
+    def __init__(self, rows):
+        self._rows = rows
+        self.cursors = []
+
+    def cursor(self, name=None, **kwargs):
+        cur = _Cursor(self._rows, server_side=name is not None, name=name, **kwargs)
+        self.cursors.append(cur)
+        return cur
+
+
+class _Pool:
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def getconn(self):
+        return self._conn
+
+    get_connection = getconn
+
+
+ROWS = [(i, "user%d" % i) for i in range(5)]
+
+
+def _descriptor(block=""):
+    with tempfile.TemporaryDirectory() as tmp:
+        api = Path(tmp) / "api"
+        shutil.copytree(str(FIXTURE_API), str(api))
+        output = api / "user" / "create" / "$.output.yaml"
+        output.write_text(block + output.read_text())
+        output = api / "user" / "list" / "$.output.yaml"
+        output.write_text(block + output.read_text())
+        y = Yaal(str(api))
+        return y.create_descriptor("user/list"), y.create_descriptor("user/create")
+
+
+class TestAnnotation(unittest.TestCase):
+
+    def test_reads_follow_the_descriptor(self):
+        for block, expected in (("", None), ("server_cursor: true\n", True),
+                                ("server_cursor: false\n", False)):
+            with self.subTest(block=block):
+                read, write = _descriptor(block)
+                self.assertIs(read["twigs"][0]["server_cursor"], expected)
+                # INSERT, INSERT, then the SELECT that reads the new user back.
+                self.assertEqual([twig["server_cursor"] for twig in write["twigs"]],
+                                 [False, False, expected])
+
+    def test_bad_value(self):
+        with self.assertRaisesRegex(TypeError, "server_cursor must be true or false"):
+            _descriptor("server_cursor: yes please\n")
+
+    def test_url_and_twig_settings(self):
+        self.assertEqual(server_cursor_options({}), (False, 1000))
+        self.assertEqual(server_cursor_options({"server_cursor": "true", "itersize": "50"}),
+                         (True, 50))
+        self.assertTrue(use_server_cursor({"server_cursor": None}, True))
+        self.assertFalse(use_server_cursor({"server_cursor": False}, True))
+        self.assertFalse(use_server_cursor({}, True))
+
+
+class TestCursorHelpers(unittest.TestCase):
+
+    def test_server_side_columns_arrive_with_the_first_batch(self):
+        rs = fetch_row_set(_Cursor(ROWS, server_side=True), batch_size=2, server_side=True)
+        self.assertEqual(rs.columns, ("id", "name"))
+        self.assertEqual(rs.rows, ROWS)
+
+        cur = _Cursor(ROWS, server_side=True)
+        stream = iter_row_stream(cur, batch_size=2, server_side=True)
+        self.assertIsInstance(stream, RowStream)
+        self.assertEqual(cur.fetches, 1)
+        self.assertEqual(list(stream.rows), ROWS)
+        self.assertTrue(cur.closed)
+
+    def test_cursor_rows_buffer_and_drain(self):
+        cur = _Cursor(ROWS)
+        rows = CursorRows(cur, 2)
+        self.assertEqual(next(rows), ROWS[0])
+        rows.buffer()
+        self.assertTrue(cur.closed)
+        self.assertEqual(list(rows), ROWS[1:])
+
+        cur = _Cursor(ROWS)
+        rows = CursorRows(cur, 2, drain_on_close=True)
+        next(rows)
+        rows.close()
+        self.assertEqual(cur.fetchmany(10), [])
+
+
+class TestProviders(unittest.TestCase):
+
+    def setUp(self):
+        self._descriptor, _write = _descriptor("server_cursor: true\n")
+        self._twig = self._descriptor["twigs"][0]
+        self._shape = create_context(self._descriptor)
+
+    def test_postgres_named_cursor(self):
+        conn = _Connection(ROWS)
+        provider = PostgresDataProvider(_Pool(conn), itersize=2)
+        provider.begin()
+        rows, last_id = provider.execute(self._twig, self._shape, DataProviderHelper())
+        self.assertEqual((rows.rows, last_id), (ROWS, None))
+        cur = conn.cursors[-1]
+        self.assertTrue(cur.kwargs["name"].startswith("yaal_"))
+        self.assertEqual(cur.itersize, 2)
+
+        stream, _last_id = provider.execute_iter(self._twig, self._shape, DataProviderHelper())
+        self.assertEqual(list(stream.rows), ROWS)
+
+        plain = dict(self._twig, server_cursor=None)
+        provider.execute(plain, self._shape, DataProviderHelper())
+        self.assertIsNone(conn.cursors[-1].kwargs["name"])
+
+    def test_mysql_unbuffered_stream_is_buffered_before_other_sql(self):
+        conn = _Connection(ROWS)
+        provider = MySQLDataProvider(_Pool(conn), itersize=2)
+        provider.begin()
+        stream, _last_id = provider.execute_iter(self._twig, self._shape, DataProviderHelper())
+        streamed = conn.cursors[-1]
+        self.assertNotIn("buffered", streamed.kwargs)
+        self.assertEqual(next(iter(stream.rows)), ROWS[0])
+
+        provider.execute(self._twig, self._shape, DataProviderHelper())
+        self.assertTrue(streamed.closed)
+        self.assertEqual(list(stream.rows), ROWS[1:])
+
+        provider.execute_iter(dict(self._twig, server_cursor=False), self._shape,
+                              DataProviderHelper())
+        self.assertTrue(conn.cursors[-1].kwargs["buffered"])
+
+
+if __name__ == "__main__":
+    unittest.main()
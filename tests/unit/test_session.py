@@ -0,0 +1,132 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Yaal.session(): several queries sharing providers and one transaction."""
+
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal
+from yaal_errors import YaalError
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class _CountingManager:
+    """Wraps a provider manager and records begin / end / error / release calls."""
+
+    def __init__(self, inner, calls):
+        self._inner = inner
+        self._calls = calls
+
+    def get_context(self):
+        return _CountingProvider(self._inner.get_context(), self._calls)
+
+
+class _CountingProvider:
+
+    def __init__(self, inner, calls):
+        self._inner = inner
+        self._calls = calls
+
+    def begin(self):
+        self._calls.append("begin")
+        self._inner.begin()
+
+    def end(self):
+        self._calls.append("end")
+        self._inner.end()
+
+    def error(self):
+        self._calls.append("error")
+        self._inner.error()
+
+    def release(self):
+        self._calls.append("release")
+        self._inner.release()
+
+    def execute(self, twig, input_shape, helper):
+        return self._inner.execute(twig, input_shape, helper)
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        api = Path(self._root) / "api"
+        shutil.copytree(str(FIXTURE_API), str(api))
+        (api / "fail").mkdir()
+        (api / "fail" / "$.sql").write_text("SELECT 'error' AS \"$mode\", 'no' AS message")
+        self._db_path = str(Path(self._root) / "app.db")
+        con = sqlite3.connect(self._db_path)
+        con.executescript(SCHEMA.read_text())
+        con.close()
+        self._yaal = Yaal(str(api), debug=True)
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        self._calls = []
+        self._yaal._data_providers["db"] = _CountingManager(self._yaal._data_providers["db"],
+                                                            self._calls)
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def _user(self, user_id):
+        con = sqlite3.connect(self._db_path)
+        try:
+            return con.execute("SELECT user_name FROM users WHERE user_id = ?",
+                               (user_id,)).fetchone()
+        finally:
+            con.close()
+
+    def test_queries_share_one_transaction(self):
+        with self._yaal.session() as s:
+            s.query("user/create", payload={"id": 7, "name": "neo"})
+            # Same connection: the uncommitted row is visible to the next query.
+            self.assertEqual(s.query("user/get", args={"id": 7})["name"], "neo")
+            self.assertIn('"neo"', s.query_json("user/list"))
+            self.assertIsNone(self._user(7))
+        self.assertEqual(self._calls, ["begin", "end"])
+        self.assertEqual(self._user(7), ("neo",))
+
+    def test_exception_rolls_back(self):
+        with self.assertRaises(RuntimeError):
+            with self._yaal.session() as s:
+                s.query("user/create", payload={"id": 7, "name": "neo"})
+                raise RuntimeError("abort")
+        self.assertEqual(self._calls, ["begin", "error"])
+        self.assertIsNone(self._user(7))
+
+    def test_soft_error_makes_session_rollback_only(self):
+        with self._yaal.session() as s:
+            s.query("user/create", payload={"id": 7, "name": "neo"})
+            # Payload validation fails before any SQL runs and leaves the session usable.
+            self.assertIn("errors", s.query("user/create", payload={"name": "x"}))
+            self.assertFalse(s.failed)
+            self.assertEqual(s.query("fail"), {"errors": [{"$mode": "error", "message": "no"}]})
+            self.assertTrue(s.failed)
+        self.assertEqual(self._calls, ["begin", "error"])
+        self.assertIsNone(self._user(7))
+
+    def test_read_only_skips_commit(self):
+        with self._yaal.session(read_only=True) as s:
+            s.query("user/list")
+            s.query("user/create", payload={"id": 7, "name": "neo"})
+        self.assertEqual(self._calls, ["begin", "release"])
+        self.assertIsNone(self._user(7))
+
+    def test_closed_session_rejects_queries(self):
+        with self._yaal.session() as s:
+            pass
+        self.assertEqual(self._calls, [])
+        with self.assertRaises(YaalError):
+            s.query("user/list")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Single-flight coalescing of identical concurrent read-only queries."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from yaal import Yaal
+from yaal_cache import SingleFlight
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+
+def _run_threads(count, target):
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait()
+            return {"v": 1}
+
+        threads, results = _run_threads(5, lambda: flight.do("k", fn))
+        _wait_for(lambda: flight.stats()["coalesced"] == 4)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [({"v": 1}, True)] * 5)
+        self.assertEqual(flight.stats(), {"in_flight": 0, "executions": 1, "coalesced": 4})
+
+        # Finished calls are not remembered.
+        self.assertEqual(flight.do("k", lambda: 2), (2, False))
+
+    def test_errors_reach_every_waiter(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fn():
+            release.wait()
+            raise RuntimeError("boom")
+
+        threads, results = _run_threads(3, lambda: flight.do("k", fn))
+        _wait_for(lambda: flight.stats()["coalesced"] == 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+
+class TestReadOnlyFlag(unittest.TestCase):
+
+    def setUp(self):
+        self._root = tempfile.mkdtemp()
+        self._api = Path(self._root) / "api"
+        shutil.copytree(str(FIXTURE_API), str(self._api))
+
+    def tearDown(self):
+        shutil.rmtree(self._root)
+
+    def test_derived_from_sql(self):
+        y = Yaal(str(self._api))
+        self.assertTrue(y.create_descriptor("user/list")["read_only"])
+        self.assertTrue(y.create_descriptor("user/nested")["read_only"])
+        self.assertFalse(y.create_descriptor("user/create")["read_only"])
+
+    def test_declared_in_output_model(self):
+        output = self._api / "user" / "list" / "$.output.yaml"
+        output.write_text("read_only: false\n" + output.read_text())
+        self.assertFalse(Yaal(str(self._api)).create_descriptor("user/list")["read_only"])
+
+        (self._api / "user" / "create" / "$.output.yaml").write_text(
+            "type: object\nread_only: true\n"
+        )
+        with self.assertRaisesRegex(TypeError, "read_only"):
+            Yaal(str(self._api)).create_descriptor("user/create")
+
+
+class _GatedManager:
+    """Provider manager whose execute() blocks until the gate opens."""
+
+    def __init__(self, inner, gate, begins):
+        self._inner = inner
+        self._gate = gate
+        self._begins = begins
+
+    def get_context(self):
+        self._begins.append(1)
+        return _GatedProvider(self._inner.get_context(), self._gate)
+
+
+class _GatedProvider:
+
+    def __init__(self, inner, gate):
+        self._inner = inner
+        self._gate = gate
+
+    def begin(self):
+        self._inner.begin()
+
+    def end(self):
+        self._inner.end()
+
+    def error(self):
+        self._inner.error()
+
+    def execute(self, twig, input_shape, helper):
+        self._gate.wait()
+        return self._inner.execute(twig, input_shape, helper)
+
+
+class TestQueryCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        con = sqlite3.connect(self._db_path)
+        con.executescript(SCHEMA.read_text())
+        con.close()
+        self._gate = threading.Event()
+        self._begins = []
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def _yaal(self, coalesce):
+        y = Yaal(str(FIXTURE_API), coalesce=coalesce)
+        y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        y._data_providers["db"] = _GatedManager(y._data_providers["db"], self._gate, self._begins)
+        return y
+
+    def test_identical_reads_share_one_execution(self):
+        y = self._yaal(True)
+        for method in (y.query, y.query_json):
+            with self.subTest(method=method.__name__):
+                self._gate.clear()
+                del self._begins[:]
+                before = y.coalesce_stats()["coalesced"]
+                threads, results = _run_threads(
+                    8, lambda: method("user/get", args={"id": 1})
+                )
+                _wait_for(lambda: y.coalesce_stats()["coalesced"] - before == 7)
+                self._gate.set()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(len(self._begins), 1)
+                self.assertTrue(all(r == results[0] for r in results))
+        stats = y.coalesce_stats()
+        self.assertEqual((stats["executions"], stats["coalesced"]), (2, 14))
+
+    def test_shared_results_are_independent_copies(self):
+        y = self._yaal(True)
+        threads, results = _run_threads(2, lambda: y.query("user/list"))
+        _wait_for(lambda: y.coalesce_stats()["coalesced"] == 1)
+        self._gate.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results[0], results[1])
+        self.assertIsNot(results[0], results[1])
+
+    def test_writes_and_disabled_instances_run_alone(self):
+        self._gate.set()
+        y = self._yaal(True)
+        y.query("user/create", payload={"id": 7, "name": "neo"})
+        self.assertEqual(y.coalesce_stats()["executions"], 0)
+        y.query("user/list", args=None)
+        self.assertEqual(y.coalesce_stats()["executions"], 1)
+
+        plain = self._yaal(False)
+        plain.query("user/list")
+        self.assertEqual(plain.coalesce_stats(), {"in_flight": 0, "executions": 0, "coalesced": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
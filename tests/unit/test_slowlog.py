@@ -0,0 +1,114 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Slow-query log: compiled SQL, binds and variant of requests over the threshold."""
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal
+from yaal_slowlog import REDACTED, SlowQueryLog
+from yaal_trace import QueryTrace
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class _Records:
+
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+
+class TestSlowQueryLog(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._db_path = os.path.join(self._tmp, "test.db")
+        with sqlite3.connect(self._db_path) as con:
+            con.executescript(SCHEMA.read_text())
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _yaal(self, **log):
+        y = Yaal(str(FIXTURE_API), slow_query_log=log)
+        y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        return y
+
+    def test_jsonl_record(self):
+        path = os.path.join(self._tmp, "slow.jsonl")
+        y = self._yaal(threshold_ms=0, path=path)
+        y.query("user/list", args={"sort": "name", "dir": "desc"})
+        y.query("user/list", args={"active": 1})
+        y._slow_query_log.close()
+        with open(path, encoding="utf-8") as f:
+            first, second = [json.loads(line) for line in f]
+
+        self.assertEqual((first["path"], first["status"], first["rows"]), ("user/list", "ok", 2))
+        self.assertEqual(first["statements_total"], 1)
+        statement = first["statements"][0]
+        self.assertEqual((statement["branch"], statement["twig"], statement["connection"]),
+                         ("$", 0, "db"))
+        self.assertIn("ORDER BY", statement["sql"].upper())
+        self.assertNotIn("u.active = ?", statement["sql"])
+        self.assertEqual(statement["variant"], {"nulls": ["$args.active"],
+                                                "sort": {"$args.sort": "u.user_name DESC"},
+                                                "placeholder": "?", "parent_keys": None})
+        self.assertEqual(statement["rows"], 2)
+
+        statement = second["statements"][0]
+        self.assertIn("u.active = ?", statement["sql"])
+        self.assertEqual(statement["variant"]["nulls"], [])
+        self.assertEqual(list(zip(statement["parameters"], statement["binds"])),
+                         [("$args.active", 1)])
+        self.assertNotEqual(statement["fingerprint"], first["statements"][0]["fingerprint"])
+
+    def test_threshold_and_redaction(self):
+        sink = _Records()
+        y = self._yaal(threshold_ms=60_000, sink=sink)
+        y.query("user/get", args={"id": 1})
+        self.assertEqual(sink.records, [])
+
+        y = self._yaal(threshold_ms=0, sink=sink, redact=["id"])
+        y.query("user/get", args={"id": 1})
+        self.assertEqual(sink.records[0]["statements"][0]["binds"], [REDACTED])
+
+        y = self._yaal(threshold_ms=0, sink=sink, redact=lambda name, value: value * 10)
+        y.query("user/get", args={"id": 2})
+        self.assertEqual(sink.records[1]["statements"][0]["binds"], [20])
+
+    def test_keeps_the_slowest_statements(self):
+        sink = _Records()
+        y = self._yaal(threshold_ms=0, sink=sink, max_statements=1)
+        y.query("user/nested", args={"id": 1})
+        record = sink.records[0]
+        self.assertEqual((record["statements_total"], len(record["statements"])), (2, 1))
+
+    def test_bad_config(self):
+        with self.assertRaises(ValueError):
+            SlowQueryLog(threshold_ms=-1)
+        with self.assertRaises(ValueError):
+            SlowQueryLog(max_statements=0)
+        with self.assertRaises(TypeError):
+            Yaal(str(FIXTURE_API), slow_query_log=10)
+
+    def test_statements_are_off_by_default(self):
+        trace = QueryTrace("t")
+        twig_trace = trace.twig("$", 0, {"connection": "db"})
+        twig_trace.finish([])
+        self.assertEqual(trace.statements(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
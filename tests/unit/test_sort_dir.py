@@ -13,6 +13,7 @@ import unittest
 from pathlib import Path
 
 from yaal import Yaal
+from yaal_cache import LRUCache
 from yaal_errors import SortDirError
 from yaal_executor import DataProviderHelper
 from yaal_parser import compile_sql, lexer, parser, resolve_sort_dir_values
@@ -509,7 +510,7 @@ class TestSortDirResolve(unittest.TestCase):
 
 class TestSortDirCache(unittest.TestCase):
     def test_different_sort_keys_separate_cache(self):
-        helper = DataProviderHelper()
+        helper = DataProviderHelper(compile_cache=LRUCache())
         twig = _twig()
         a = helper.get_executable_content("?", twig, _shape(sort="name"))
         b = helper.get_executable_content("?", twig, _shape(sort="id"))
@@ -517,21 +518,21 @@ class TestSortDirCache(unittest.TestCase):
         self.assertEqual(len(helper._compile_cache), 2)
 
     def test_same_sort_dir_cache_hit(self):
-        helper = DataProviderHelper()
+        helper = DataProviderHelper(compile_cache=LRUCache())
         twig = _twig()
         helper.get_executable_content("?", twig, _shape(sort="name", dir_="desc"))
         helper.get_executable_content("?", twig, _shape(sort="name", dir_="desc"))
         self.assertEqual(len(helper._compile_cache), 1)
 
     def test_optional_null_set_independent(self):
-        helper = DataProviderHelper()
+        helper = DataProviderHelper(compile_cache=LRUCache())
         twig = _twig()
         helper.get_executable_content("?", twig, _shape(sort="id"))
         helper.get_executable_content("?", twig, _shape(sort="id", active=1))
         self.assertEqual(len(helper._compile_cache), 2)
 
     def test_different_multi_column_combos_separate_cache(self):
-        helper = DataProviderHelper()
+        helper = DataProviderHelper(compile_cache=LRUCache())
         twig = _twig()
         a = helper.get_executable_content("?", twig, _shape(sort="name,id", dir_="desc,asc"))
         b = helper.get_executable_content("?", twig, _shape(sort="name,id", dir_="asc,desc"))
@@ -541,7 +542,7 @@ class TestSortDirCache(unittest.TestCase):
     def test_only_dir_change_busts_cache(self):
         # Direction is folded into the sort_map string; changing only dir must
         # still produce a distinct cache key (regression guard for dropping dir_map).
-        helper = DataProviderHelper()
+        helper = DataProviderHelper(compile_cache=LRUCache())
         twig = _twig()
         helper.get_executable_content("?", twig, _shape(sort="id", dir_="asc"))
         helper.get_executable_content("?", twig, _shape(sort="id", dir_="desc"))
@@ -0,0 +1,156 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Span exporters: nested OpenTelemetry-style spans and the Chrome trace_event exporter."""
+
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import yaal_cli
+from yaal import Yaal
+from yaal_trace import ChromeTraceExporter, QueryTrace, sql_fingerprint
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class _Collect:
+
+    def __init__(self):
+        self.batches = []
+
+    def export(self, spans):
+        self.batches.append(spans)
+
+
+class TestSpans(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        with sqlite3.connect(self._db_path) as con:
+            con.executescript(SCHEMA.read_text())
+        self._yaal = Yaal(str(FIXTURE_API))
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        self._exporter = _Collect()
+        self._yaal.add_span_exporter(self._exporter)
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def test_nested_spans(self):
+        self.assertEqual(self._yaal.query("user/nested", args={"id": 1})["name"], "admin")
+        spans = self._exporter.batches[0]
+        root = spans[0]
+        self.assertEqual((root.name, root.parent_span_id, root.status), ("yaal.query", None, "OK"))
+        self.assertEqual(root.attributes, {"yaal.path": "user/nested", "yaal.status": "ok"})
+        self.assertEqual(len(root.trace_id), 32)
+        self.assertEqual({span.trace_id for span in spans}, {root.trace_id})
+        by_id = {span.span_id: span for span in spans}
+        self.assertEqual(len(by_id), len(spans))
+        names = [span.name for span in spans]
+        self.assertLessEqual({"load", "validate", "branch $", "branch $.roles", "twig $[0]",
+                              "twig $.roles[0]", "compile", "fetch", "stitch", "map"}, set(names))
+        for span in spans[1:]:
+            parent = by_id[span.parent_span_id]
+            self.assertLessEqual(parent.start_time_unix_nano, span.start_time_unix_nano)
+            self.assertGreaterEqual(parent.end_time_unix_nano, span.end_time_unix_nano)
+
+        twig = spans[names.index("twig $.roles[0]")]
+        self.assertEqual(by_id[twig.parent_span_id].name, "branch $.roles")
+        self.assertEqual(twig.kind, "CLIENT")
+        attributes = twig.attributes
+        self.assertEqual((attributes["db.system"], attributes["yaal.connection"],
+                          attributes["yaal.provider"], attributes["db.response.returned_rows"]),
+                         ("sqlite", "db", "SQLiteDataProvider", 2))
+        self.assertEqual(attributes["yaal.sql.fingerprint"],
+                         sql_fingerprint(attributes["db.statement"]))
+        self.assertEqual({by_id[s.parent_span_id].name for s in spans if s.name == "fetch"},
+                         {"twig $[0]", "twig $.roles[0]"})
+
+        # Warm variant cache: no compile span, same fingerprint.
+        self._yaal.query("user/nested", args={"id": 1})
+        spans = self._exporter.batches[1]
+        self.assertNotIn("compile", [span.name for span in spans])
+        twig = [span for span in spans if span.name == "twig $.roles[0]"][0]
+        self.assertEqual(twig.attributes["yaal.sql.fingerprint"], attributes["yaal.sql.fingerprint"])
+
+    def test_error_status_and_broken_exporters(self):
+        class Broken:
+            def export(self, spans):
+                raise RuntimeError("exporter")
+
+        self._yaal.add_span_exporter(Broken())
+        result = self._yaal.query("user/create", payload={"name": "x"})
+        self.assertIn("errors", result)
+        self.assertEqual(self._exporter.batches[0][0].status, "ERROR")
+
+        self._yaal.remove_span_exporter(self._exporter)
+        self.assertEqual(self._yaal.query("user/get", args={"id": 1})["id"], 1)
+        self.assertEqual(len(self._exporter.batches), 1)
+
+    def test_chrome_trace_file(self):
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "trace.json")
+        chrome = ChromeTraceExporter(path)
+        self._yaal.add_span_exporter(chrome)
+        self._yaal.query("user/nested", args={"id": 1})
+        self.assertEqual(len(list(self._yaal.query_iter("user/list"))), 2)
+        chrome.shutdown()
+        with open(path, encoding="utf-8") as f:
+            events = json.load(f)["traceEvents"]
+        os.unlink(path)
+        os.rmdir(tmp)
+        spans = [span for batch in self._exporter.batches for span in batch]
+        self.assertEqual(len(events), len(spans))
+        self.assertEqual({event["ph"] for event in events}, {"X"})
+        event = events[0]
+        self.assertEqual((event["name"], event["pid"]), ("yaal.query", os.getpid()))
+        self.assertEqual(event["args"]["trace_id"], spans[0].trace_id)
+        self.assertEqual(event["dur"], spans[0].duration_ns / 1000.0)
+
+        small = ChromeTraceExporter(max_events=3)
+        small.export(spans)
+        self.assertEqual(len(small.to_dict()["traceEvents"]), 3)
+        with self.assertRaises(ValueError):
+            small.write()
+
+    def test_cli_chrome_trace(self):
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, "cli.json")
+        with redirect_stdout(io.StringIO()):
+            code = yaal_cli.main(["--api", str(FIXTURE_API), "query", "user/get",
+                                  "--arg", "id=1", "--chrome-trace", path])
+        self.assertEqual(code, 0)
+        with open(path, encoding="utf-8") as f:
+            names = [event["name"] for event in json.load(f)["traceEvents"]]
+        os.unlink(path)
+        os.rmdir(tmp)
+        self.assertEqual(names[0], "yaal.query")
+        self.assertIn("twig $[0]", names)
+
+
+class TestSpanParts(unittest.TestCase):
+
+    def test_no_exporters_no_spans(self):
+        trace = QueryTrace("t")
+        trace.add("map", 0.001, 0.0)
+        trace.finish()
+        self.assertEqual(trace.spans(), [])
+
+    def test_fingerprint_ignores_whitespace(self):
+        self.assertEqual(sql_fingerprint("select *\n  from t where a = ?"),
+                         sql_fingerprint("select * from t where a = ?"))
+        self.assertNotEqual(sql_fingerprint("select 1"), sql_fingerprint("select 2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Statement statistics per compiled-SQL fingerprint, and the yaal stats CLI."""
+
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import yaal_cli
+from yaal import Yaal
+from yaal_metrics import StatementStats
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+def _statement(fingerprint, ms, rows=1, cache_hit=True):
+    return {"fingerprint": fingerprint, "sql": "select %s" % fingerprint, "variant": None,
+            "duration_ms": ms, "rows": rows, "cache_hit": cache_hit}
+
+
+class TestStatementStats(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._db_path = os.path.join(self._tmp, "test.db")
+        with sqlite3.connect(self._db_path) as con:
+            con.executescript(SCHEMA.read_text())
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_variants_are_separate_statements(self):
+        y = Yaal(str(FIXTURE_API), statement_stats=True)
+        y.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        for _ in range(3):
+            y.query("user/list")
+        y.query("user/list", args={"active": 1})
+        y.query("user/list", args={"active": 0})
+
+        report = y.statement_stats(sort="calls")
+        self.assertEqual([row["calls"] for row in report], [3, 2])
+        unfiltered, filtered = report
+        self.assertEqual((unfiltered["cache_misses"], unfiltered["cache_hits"]), (1, 2))
+        self.assertEqual(unfiltered["variant"]["nulls"], ["$args.active"])
+        self.assertEqual(unfiltered["rows"], 6)
+        self.assertEqual(filtered["variant"]["nulls"], [])
+        self.assertEqual(filtered["descriptors"], ["user/list"])
+        self.assertIn("u.active = ?", filtered["sql"])
+        self.assertGreaterEqual(unfiltered["max_ms"], unfiltered["mean_ms"])
+        self.assertEqual(len(y.statement_stats(top=1)), 1)
+
+        y.reset_statement_stats()
+        self.assertEqual(y.statement_stats(), [])
+        self.assertEqual(Yaal(str(FIXTURE_API)).statement_stats(), [])
+
+    def test_cli_report(self):
+        requests = os.path.join(self._tmp, "requests.jsonl")
+        with open(requests, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"path": "user/get", "args": {"id": 2}}) + "\n\n")
+            f.write(json.dumps({"path": "user/list", "args": {"sort": "name"}}) + "\n")
+        buf = io.StringIO()
+        with redirect_stdout(buf):
+            code = yaal_cli.main(["--api", str(FIXTURE_API), "stats", "user/get", "--arg", "id=1",
+                                  "--requests", requests, "--repeat", "2", "--json"])
+        self.assertEqual(code, 0)
+        report = json.loads(buf.getvalue())
+        self.assertEqual(sorted((row["descriptors"][0], row["calls"]) for row in report),
+                         [("user/get", 4), ("user/list", 2)])
+
+        buf = io.StringIO()
+        with redirect_stdout(buf):
+            code = yaal_cli.main(["--api", str(FIXTURE_API), "stats", "user/get", "--arg", "id=1",
+                                  "--top", "1"])
+        lines = buf.getvalue().splitlines()
+        self.assertEqual(code, 0)
+        self.assertTrue(lines[0].startswith("calls"))
+        self.assertEqual(len(lines), 2)
+        self.assertIn("user/get", lines[1])
+
+
+class TestStatementStatsRegistry(unittest.TestCase):
+
+    def test_aggregates_and_sorts(self):
+        stats = StatementStats()
+        stats.observe("a", _statement("x", 1.0, cache_hit=False))
+        stats.observe("b", _statement("x", 3.0))
+        stats.observe("a", _statement("y", 5.0, rows=10))
+        stats.observe("a", _statement(None, 9.0))
+        x, y = stats.report(sort="calls")
+        self.assertEqual((x["fingerprint"], x["calls"], x["total_ms"], x["mean_ms"], x["max_ms"]),
+                         ("x", 2, 4.0, 2.0, 3.0))
+        self.assertEqual((x["cache_hits"], x["cache_misses"], x["descriptors"]), (1, 1, ["a", "b"]))
+        self.assertEqual([row["fingerprint"] for row in stats.report(sort="max_ms")], ["y", "x"])
+        with self.assertRaises(ValueError):
+            stats.report(sort="sql")
+
+    def test_evicts_least_called(self):
+        stats = StatementStats(max_entries=2)
+        stats.observe("a", _statement("x", 1.0))
+        stats.observe("a", _statement("x", 1.0))
+        stats.observe("a", _statement("y", 1.0))
+        stats.observe("a", _statement("z", 1.0))
+        self.assertEqual(sorted(row["fingerprint"] for row in stats.report()), ["x", "z"])
+        self.assertEqual(stats.evicted, 1)
+        with self.assertRaises(TypeError):
+            Yaal(str(FIXTURE_API), statement_stats="on")
+
+
+if __name__ == "__main__":
+    unittest.main()
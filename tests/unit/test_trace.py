@@ -0,0 +1,123 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Query traces: stage timers and row counters, as a _trace block or via callbacks."""
+
+import asyncio
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from yaal import Yaal
+from yaal_provider import fetch_row_set
+from yaal_trace import STAGES, QueryTrace
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURE_API = ROOT / "tests" / "fixtures" / "api"
+SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        fd, self._db_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        with sqlite3.connect(self._db_path) as con:
+            con.executescript(SCHEMA.read_text())
+        self._yaal = Yaal(str(FIXTURE_API))
+        self._yaal.setup_data_provider("db", "sqlite3:///" + self._db_path)
+        self._traces = []
+
+    def tearDown(self):
+        os.unlink(self._db_path)
+
+    def test_trace_block(self):
+        value = self._yaal.query("user/nested", args={"id": 1}, trace=True)
+        self.assertEqual(value["data"]["name"], "admin")
+        trace = value["_trace"]
+        self.assertEqual((trace["path"], trace["status"]), ("user/nested", "ok"))
+        self.assertLessEqual({"load", "validate", "execute", "fetch", "stitch", "map"},
+                             set(trace["stages"]))
+        self.assertEqual(list(trace["stages"]),
+                         [name for name in STAGES if name in trace["stages"]])
+        self.assertEqual([(b["method"], b["rows"]) for b in trace["branches"]],
+                         [("$", 1), ("$.roles", 2)])
+        twig = trace["branches"][1]["twigs"][0]
+        self.assertEqual((twig["index"], twig["connection"], twig["rows"]), (0, "db", 2))
+        self.assertGreater(twig["bytes"], 0)
+        self.assertEqual(trace["rows"], 3)
+
+        text = self._yaal.query_json("user/nested", args={"id": 1}, trace=True)
+        value = json.loads(text)
+        self.assertEqual(value["data"]["id"], 1)
+        self.assertIn("serialize", value["_trace"]["stages"])
+        # The variant cache is warm now: nothing left to compile.
+        self.assertNotIn("compile", value["_trace"]["stages"])
+
+    def test_untraced_results_are_unchanged(self):
+        self.assertIsNone(self._yaal._start_trace("user/get", False))
+        self.assertEqual(self._yaal.query("user/get", args={"id": 1})["id"], 1)
+
+    def test_callbacks(self):
+        self._yaal.add_trace_callback(self._traces.append)
+        self._yaal.query("user/get", args={"id": 1})
+        self._yaal.query("user/create", payload={"name": "x"})
+        self.assertEqual(len(list(self._yaal.query_iter("user/list"))), 2)
+        items = self._yaal.query_iter("user/list")
+        next(items)
+        items.close()
+        self._yaal.query_json_to("user/list", io.StringIO())
+        with self._yaal.session() as s:
+            s.query("user/get", args={"id": 2})
+        asyncio.run(self._yaal.aquery("user/get", args={"id": 1}))
+        self.assertEqual([(t["path"], t["status"]) for t in self._traces], [
+            ("user/get", "ok"), ("user/create", "error"), ("user/list", "ok"),
+            ("user/list", "closed"), ("user/list", "ok"), ("user/get", "ok"), ("user/get", "ok"),
+        ])
+        self.assertIn("execute", self._traces[-1]["stages"])
+
+        self._yaal.remove_trace_callback(self._traces.append)
+        self._yaal.query("user/get", args={"id": 1})
+        self.assertEqual(len(self._traces), 7)
+
+    def test_exceptions_are_traced_and_callbacks_cannot_break_queries(self):
+        def broken(_trace):
+            raise RuntimeError("callback")
+
+        self._yaal.add_trace_callback(broken)
+        self._yaal.add_trace_callback(self._traces.append)
+        self.assertEqual(self._yaal.query("user/get", args={"id": 1})["id"], 1)
+        with self.assertRaises(Exception):
+            self._yaal.query("no/such/path")
+        self.assertEqual([t["status"] for t in self._traces], ["ok", "exception"])
+
+
+class TestTraceParts(unittest.TestCase):
+
+    def test_fetch_time_goes_to_the_twig(self):
+        con = sqlite3.connect(":memory:")
+        trace = QueryTrace("t")
+        twig_trace = trace.twig("$", 0, {"connection": "db"})
+        rows = fetch_row_set(con.execute("select 1 as a union all select 2"), trace=twig_trace)
+        twig_trace.finish(rows)
+        block = trace.to_dict()
+        self.assertEqual(set(block["stages"]), {"execute", "fetch"})
+        self.assertEqual(block["branches"][0]["twigs"][0]["rows"], 2)
+
+    def test_finish_once(self):
+        seen = []
+        trace = QueryTrace("t", [seen.append])
+        trace.finish()
+        total = trace.total
+        trace.finish()
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(trace.total, total)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,22 +12,47 @@ from urllib.parse import parse_qsl, unquote_plus
 import yaml
 
 from yaal_builder import create_trunk
+from yaal_cache import MemoryResultCache, SingleFlight
 from yaal_errors import (
     DescriptorNotFoundError,
+    FieldSelectionError,
+    MemoryBudgetError,
     PathEscapeError,
     UnsupportedDatabaseUrlError,
     YaalError,
 )
-from yaal_executor import DataProviderHelper, get_result, get_result_json
+from yaal_executor import (
+    DEFAULT_EXECUTEMANY_BATCH_SIZE,
+    DataProviderHelper,
+    _copy_json,
+    _timed,
+    aget_result,
+    dump_result_json,
+    forget_variants,
+    get_result,
+    get_result_json,
+    is_error_result,
+    iter_result,
+    iter_result_json,
+    variant_cache_stats,
+)
+from yaal_metrics import MetricsRegistry, StatementStats
+from yaal_provider import ThreadOffloadProvider
 from yaal_shape import Shape
+from yaal_slowlog import SlowQueryLog
+from yaal_spill import MemoryBudget
 from yaal_sqlite import SQLiteContextManager
+from yaal_trace import DB_SYSTEMS, QueryTrace
 
 path_join = os.path.join
 
+DEFAULT_JSON_CHUNK_SIZE = 64 * 1024
+
 
 def _strip_descriptor_for_json(descriptor, pretty=False):
     if "_validators" in descriptor:
         del descriptor["_validators"]
+    descriptor.pop("_mapper", None)
     if "branches" in descriptor:
         for branch in descriptor["branches"]:
             _strip_descriptor_for_json(branch, pretty)
@@ -234,15 +259,181 @@ class FileContentReader:
         return content
 
 
+def _utf8_len(text):
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+
+def _trace_info(trace, **info):
+    if trace is not None:
+        trace.info.update(info)
+
+
+def _trace_status(trace, result):
+    if trace is not None:
+        trace.info["status"] = "error" if is_error_result(result) else "ok"
+
+
+def _fail_trace(trace):
+    """Finish trace for a query that raised."""
+    if trace is not None:
+        trace.info["status"] = "exception"
+        trace.finish()
+
+
+def _traced_items(items, trace):
+    """Yield from a query_iter generator; finish trace when it ends or is closed."""
+    try:
+        yield from items
+    finally:
+        items.close()
+        trace.finish()
+
+
+class _SessionProvider:
+    """Provider view handed to the executor inside a session.
+
+    The session owns the transaction: begin/end become no-ops and error()
+    only marks the session for rollback.
+    """
+
+    def __init__(self, session, provider):
+        self._session = session
+        self._provider = provider
+
+    def begin(self):
+        pass
+
+    def end(self):
+        pass
+
+    def error(self):
+        self._session._failed = True
+
+    def __getattr__(self, name):
+        return getattr(self._provider, name)
+
+
+class YaalSession:
+    """Unit of work: queries share provider contexts and one transaction per connection.
+
+    Use as ``with y.session() as s:``. Providers are checked out and begun on
+    first use and finished once on exit: commit, or rollback when the block
+    raised or any query returned soft errors from SQL ($mode=error). With
+    read_only=True nothing is committed; connections are released after a
+    rollback.
+    """
+
+    def __init__(self, yaal, read_only=False):
+        self._yaal = yaal
+        self._read_only = read_only
+        self._providers = {}
+        self._failed = False
+        self._closed = False
+        self._invalidates = set()
+
+    @property
+    def failed(self):
+        """True once a query in this session has rolled back its work."""
+        return self._failed
+
+    def get_data_provider(self, name):
+        if self._closed:
+            raise YaalError("session is closed")
+        if name not in self._providers:
+            provider = self._yaal.get_data_provider(name)
+            provider.begin()
+            self._providers[name] = _SessionProvider(self, provider)
+        return self._providers[name]
+
+    def query(self, descriptor_path, *, payload=None, args=None, output_mapper=None,
+              fields=None, trace=False):
+        yaal = self._yaal
+        query_trace = yaal._start_trace(descriptor_path, trace)
+        try:
+            descriptor = _timed(query_trace, "load", yaal._load_descriptor,
+                                descriptor_path, output_mapper, fields)
+            context = create_context(descriptor, payload=payload, args=args)
+            result = get_result(descriptor, self.get_data_provider, context,
+                                max_branch_workers=yaal._max_branch_workers,
+                                executemany_batch_size=yaal._executemany_batch_size,
+                                memory_budget=yaal._memory_budget, trace=query_trace)
+        except BaseException:
+            _fail_trace(query_trace)
+            raise
+        _trace_status(query_trace, result)
+        # Result caches are bypassed here; invalidation waits for the commit.
+        if descriptor.get("invalidates") and not is_error_result(result):
+            self._invalidates.update(descriptor["invalidates"])
+        return yaal._end_trace(query_trace, result, trace)
+
+    def query_json(self, descriptor_path, *, payload=None, args=None, output_mapper=None,
+                   fields=None, trace=False):
+        return dump_result_json(self.query(descriptor_path, payload=payload, args=args,
+                                           output_mapper=output_mapper, fields=fields,
+                                           trace=trace))
+
+    def close(self, failed=False):
+        """Finish every provider once: commit, rollback (failed) or release (read-only)."""
+        if self._closed:
+            return
+        self._closed = True
+        failed = failed or self._failed
+        commit = not failed and not self._read_only
+        providers = [p._provider for p in self._providers.values()]
+        self._providers = {}
+        error = None
+        for provider in providers:
+            try:
+                if failed:
+                    provider.error()
+                elif self._read_only:
+                    getattr(provider, "release", provider.error)()
+                else:
+                    provider.end()
+            except Exception as e:
+                # Keep finishing the others; a failed commit rolls the rest back.
+                if error is None:
+                    error = e
+                failed = True
+        if commit and self._invalidates:
+            # Also after a partly failed commit: dropping too much is harmless.
+            self._yaal.invalidate_tags(sorted(self._invalidates))
+        if error is not None:
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(failed=exc_type is not None)
+        return False
+
+
 class Yaal:
 
-    def __init__(self, root_path, content_reader=None, *, debug=False, precompiled=None):
+    def __init__(self, root_path, content_reader=None, *, debug=False, precompiled=None,
+                 max_branch_workers=None, offload_executor=None,
+                 executemany_batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, coalesce=False,
+                 result_cache=None, codegen=False, memory_budget=None, metrics=False,
+                 slow_query_log=None, statement_stats=False):
         self._root_path = root_path
+        self._single_flight = SingleFlight() if coalesce else None
+        self._result_cache = MemoryResultCache() if result_cache is None else result_cache
+        self._max_branch_workers = max_branch_workers
+        self._executemany_batch_size = executemany_batch_size
+        self._offload_executor = offload_executor
         self._descriptors = {}
         self._data_providers = {}
         self._data_provider_schemes = {}
         self._debug = debug
         self._precompiled = precompiled
+        self._codegen = codegen
+        self._memory_budget = MemoryBudget.from_value(memory_budget)
+        self._trace_callbacks = []
+        self._span_exporters = []
+        self._metrics = MetricsRegistry.from_value(metrics)
+        self._slow_query_log = SlowQueryLog.from_value(slow_query_log)
+        self._statement_stats = StatementStats.from_value(statement_stats)
 
         if not content_reader:
             self._content_reader = FileContentReader(self._root_path)
@@ -279,6 +470,24 @@ class Yaal:
             )
         return self._data_providers[name].get_context()
 
+    def session(self, *, read_only=False):
+        """Start a unit of work; see YaalSession."""
+        return YaalSession(self, read_only=read_only)
+
+    def get_async_data_provider(self, name):
+        """Async provider for name: the manager's get_async_context() if it has one,
+        else its sync provider offloaded to threads (see offload_executor)."""
+        if name not in self._data_providers:
+            raise YaalError(
+                "Data provider %r is not configured. Call setup_data_provider(%r, url) first."
+                % (name, name)
+            )
+        manager = self._data_providers[name]
+        get_async_context = getattr(manager, "get_async_context", None)
+        if get_async_context is not None:
+            return get_async_context()
+        return ThreadOffloadProvider(manager.get_context(), self._offload_executor)
+
     def create_descriptor(self, path, output_mapper=None):
         descriptor = create_trunk(path, output_mapper, self._content_reader)
         if descriptor is None:
@@ -290,15 +499,30 @@ class Yaal:
         return descriptor
 
     def clear_cache(self):
-        """Clear cached descriptors (reload SQL/YAML on next query)."""
-        self._descriptors = {}
+        """Clear cached descriptors (reload SQL/YAML on next query) and their SQL variants."""
+        descriptors, self._descriptors = self._descriptors, {}
+        forget_variants(descriptors.values())
+
+    def _store_descriptor(self, cache_key, descriptor):
+        replaced = self._descriptors.get(cache_key)
+        self._descriptors[cache_key] = descriptor
+        if replaced is not None and replaced is not descriptor:
+            # debug=True reloads on every call; the old twigs' variants never hit again.
+            forget_variants([replaced])
+
+    @staticmethod
+    def compile_cache_stats():
+        """Counters for the process-wide compiled-SQL variant cache."""
+        return variant_cache_stats()
 
     def _descriptor_key(self, descriptor_path, output_mapper=None):
         if output_mapper:
             return descriptor_path + "#" + output_mapper
         return descriptor_path
 
-    def _load_descriptor(self, descriptor_path, output_mapper=None):
+    def _load_descriptor(self, descriptor_path, output_mapper=None, fields=None):
+        if fields is not None:
+            return self._load_selection(descriptor_path, output_mapper, fields)
         cache_key = self._descriptor_key(descriptor_path, output_mapper)
         if not self._debug and cache_key in self._descriptors:
             return self._descriptors[cache_key]
@@ -308,9 +532,32 @@ class Yaal:
             descriptor = self._load_precompiled(descriptor_path, output_mapper)
         else:
             descriptor = self.create_descriptor(descriptor_path, output_mapper)
-        self._descriptors[cache_key] = descriptor
+        if self._codegen:
+            self._attach_mapper(descriptor, descriptor_path, output_mapper)
+        self._store_descriptor(cache_key, descriptor)
         return descriptor
 
+    def _load_selection(self, descriptor_path, output_mapper, fields):
+        """The descriptor pruned to a fields= selection (see yaal_fields), cached per selection."""
+        from yaal_fields import fields_key, parse_fields, prune_descriptor
+
+        selection = parse_fields(fields)
+        descriptor = self._load_descriptor(descriptor_path, output_mapper)
+        if selection is None:
+            return descriptor
+        cache_key = "%s?fields=%s" % (
+            self._descriptor_key(descriptor_path, output_mapper), fields_key(selection)
+        )
+        if not self._debug and cache_key in self._descriptors:
+            return self._descriptors[cache_key]
+        pruned = prune_descriptor(descriptor, selection)
+        if self._codegen:
+            from yaal_codegen import attach_mapper
+
+            attach_mapper(pruned)
+        self._store_descriptor(cache_key, pruned)
+        return pruned
+
     def _load_precompiled(self, descriptor_path, output_mapper=None):
         from yaal_precompile import load_precompiled_file, resolve_precompiled_path
 
@@ -323,6 +570,25 @@ class Yaal:
             )
         return load_precompiled_file(file_path)
 
+    def _attach_mapper(self, descriptor, descriptor_path, output_mapper=None):
+        """codegen=True: shape rows with a generated mapper (yaal_codegen).
+
+        Source written by yaal compile --codegen is reused when it matches
+        the descriptor's output plan; otherwise it is generated here.
+        """
+        from yaal_codegen import attach_mapper
+
+        source, file_path = None, "<yaal codegen %s>" % descriptor["path"]
+        if self._precompiled and not self._debug:
+            from yaal_precompile import resolve_codegen_path
+
+            path = resolve_codegen_path(self._precompiled, descriptor_path, output_mapper)
+            if os.path.isfile(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    source = f.read()
+                file_path = str(path)
+        attach_mapper(descriptor, source, file_path)
+
     def _default_placeholder(self):
         for scheme in self._data_provider_schemes.values():
             if scheme in ("postgresql", "mysql", "clickhouse"):
@@ -331,22 +597,373 @@ class Yaal:
                 return "?"
         return "?"
 
-    def query(self, descriptor_path, *, payload=None, args=None, output_mapper=None):
-        """Load a descriptor, build context, and return the SQL→JSON result."""
-        descriptor = self._load_descriptor(descriptor_path, output_mapper)
-        context = create_context(descriptor, payload=payload, args=args)
-        return self.get_result(descriptor, context)
+    def query(self, descriptor_path, *, payload=None, args=None, output_mapper=None,
+              fields=None, trace=False):
+        """Load a descriptor, build context, and return the SQL→JSON result.
+
+        fields selects output keys ("id,name,roles.id" or a list of paths);
+        child branches outside the selection do not run (see yaal_fields).
+        trace=True returns {"data": result, "_trace": {...}} with the
+        query's stage timings (see yaal_trace).
+        """
+        return self._query(descriptor_path, payload, args, output_mapper, False, fields, trace)
 
-    def query_json(self, descriptor_path, *, payload=None, args=None, output_mapper=None):
+    def query_json(self, descriptor_path, *, payload=None, args=None, output_mapper=None,
+                   fields=None, trace=False):
         """Same as query, but return a JSON string."""
-        descriptor = self._load_descriptor(descriptor_path, output_mapper)
+        return self._query(descriptor_path, payload, args, output_mapper, True, fields, trace)
+
+    def add_trace_callback(self, callback):
+        """Call callback(trace) with the yaal_trace timings of every query from now on.
+
+        Covers query / query_json, query_iter and the streaming JSON methods
+        (once the stream ends), aquery and sessions. The trace is the dict
+        query(..., trace=True) returns as "_trace".
+        """
+        self._trace_callbacks.append(callback)
+
+    def remove_trace_callback(self, callback):
+        self._trace_callbacks.remove(callback)
+
+    def add_span_exporter(self, exporter):
+        """Hand every query's spans to exporter.export(spans) from now on.
+
+        spans is a list of yaal_trace.Span (root first), covering the same
+        queries as add_trace_callback. yaal_trace.ChromeTraceExporter is
+        built in; anything with an export(spans) method works, e.g. an
+        adapter onto an OpenTelemetry SDK.
+        """
+        self._span_exporters.append(exporter)
+
+    def remove_span_exporter(self, exporter):
+        self._span_exporters.remove(exporter)
+
+    def _start_trace(self, descriptor_path, requested):
+        """A QueryTrace when trace=True was passed or anything consumes traces, else None."""
+        callbacks = list(self._trace_callbacks)
+        if self._metrics is not None:
+            callbacks.append(self._metrics.observe)
+        slow_log = self._slow_query_log
+        stats = self._statement_stats
+        if not (requested or callbacks or self._span_exporters or slow_log is not None
+                or stats is not None):
+            return None
+        systems = None
+        if self._span_exporters:
+            systems = {name: DB_SYSTEMS.get(scheme, scheme)
+                       for name, scheme in self._data_provider_schemes.items()}
+        return QueryTrace(
+            descriptor_path, callbacks, list(self._span_exporters), systems,
+            observers=[slow_log.observe] if slow_log is not None else (),
+            max_statements=slow_log.max_statements if slow_log is not None else 0,
+            listeners=[stats.observe] if stats is not None else (),
+        )
+
+    @staticmethod
+    def _end_trace(trace, value, requested, as_json=False):
+        """Finish trace; trace=True callers get {"data": value, "_trace": {...}}."""
+        if trace is None:
+            return value
+        if as_json:
+            trace.info["output_bytes"] = _utf8_len(value)
+        trace.finish()
+        if not requested:
+            return value
+        block = trace.to_dict()
+        if as_json:
+            return '{"data": %s, "_trace": %s}' % (value, json.dumps(block))
+        return {"data": value, "_trace": block}
+
+    def _query(self, descriptor_path, payload, args, output_mapper, as_json, fields=None,
+               trace=False):
+        query_trace = self._start_trace(descriptor_path, trace)
+        try:
+            value = self._run_query(descriptor_path, payload, args, output_mapper, as_json,
+                                    fields, query_trace)
+        except BaseException:
+            _fail_trace(query_trace)
+            raise
+        return self._end_trace(query_trace, value, trace, as_json)
+
+    def _run_query(self, descriptor_path, payload, args, output_mapper, as_json, fields, trace):
+        descriptor = _timed(trace, "load", self._load_descriptor,
+                            descriptor_path, output_mapper, fields)
+        context = create_context(descriptor, payload=payload, args=args)
+        cache_key = self._result_cache_key(descriptor, descriptor_path, output_mapper, context)
+        versions = tag_versions = None
+        if cache_key is not None:
+            # Taken before running, so a write racing this query invalidates its entry.
+            versions = self._data_versions(descriptor)
+            tag_versions = self._tag_versions(descriptor)
+            entry = self._result_cache.get(cache_key)
+            if entry is not None and entry[2] == versions:
+                _trace_info(trace, status="ok", cache="hit")
+                return self._cached_value(entry, as_json, trace)
+            _trace_info(trace, cache="miss")
+
+        key = self._coalesce_key(descriptor, descriptor_path, output_mapper, payload, args)
+        if key is None:
+            result, shared = self.get_result(descriptor, context, trace), False
+        else:
+            result, shared = self._single_flight.do(
+                key, lambda: self.get_result(descriptor, context, trace)
+            )
+            _trace_info(trace, coalesced=shared)
+        _trace_status(trace, result)
+        return self._finish_query(descriptor, result, cache_key, versions, as_json, shared, trace,
+                                  tag_versions)
+
+    def _finish_query(self, descriptor, result, cache_key, versions, as_json, shared,
+                      trace=None, tag_versions=None):
+        """Apply cache effects of a finished run and return the caller's value.
+
+        A result held by the cache or by other single-flight callers is
+        copied for query callers, so nobody can mutate another's value.
+        """
+        if is_error_result(result):
+            return _timed(trace, "serialize", dump_result_json, result) if as_json else result
+        if descriptor.get("invalidates"):
+            self._result_cache.invalidate(descriptor["invalidates"])
+        text = _timed(trace, "serialize", dump_result_json, result) if as_json else None
+        if cache_key is not None:
+            cache = descriptor["cache"]
+            entry = [result, text, versions]
+            if tag_versions is None:
+                self._result_cache.set(cache_key, entry, cache["ttl"], cache["tags"])
+            else:
+                self._result_cache.set(cache_key, entry, cache["ttl"], cache["tags"],
+                                       versions=tag_versions)
+            shared = True
+        if as_json:
+            return text
+        return _copy_json(result) if shared else result
+
+    @staticmethod
+    def _cached_value(entry, as_json, trace=None):
+        if not as_json:
+            return _copy_json(entry[0])
+        if entry[1] is None:
+            entry[1] = _timed(trace, "serialize", dump_result_json, entry[0])
+        return entry[1]
+
+    def _result_cache_key(self, descriptor, descriptor_path, output_mapper, context):
+        """Result-cache key for a descriptor with a cache: block, else None."""
+        cache = descriptor.get("cache")
+        if not cache:
+            return None
+        args = context.get_prop("$args").get_data()
+        if cache["key"] is None:
+            parts = [args, context.get_data()]
+        else:
+            parts = [{name: args.get(name) for name in cache["key"]}]
+        return json.dumps([descriptor_path, output_mapper, descriptor.get("fields")] + parts,
+                          sort_keys=True, separators=(",", ":"), default=repr)
+
+    def _data_versions(self, descriptor):
+        """Data versions of the descriptor's connections for cache.revalidate, else None."""
+        if not descriptor["cache"].get("revalidate"):
+            return None
+        versions = []
+        for name in descriptor["connections"]:
+            manager = self._data_providers.get(name)
+            data_version = getattr(manager, "data_version", None)
+            if data_version is None:
+                raise YaalError(
+                    "%s: cache.revalidate needs data_version() on provider %r (sqlite3 only)"
+                    % (descriptor["path"], name)
+                )
+            versions.append(data_version())
+        return tuple(versions)
+
+    def _tag_versions(self, descriptor):
+        """Snapshot of the cache tags from a backend with versions_for(), else None."""
+        versions_for = getattr(self._result_cache, "versions_for", None)
+        if versions_for is None:
+            return None
+        return versions_for(descriptor["cache"]["tags"])
+
+    def _coalesce_key(self, descriptor, descriptor_path, output_mapper, payload, args):
+        """Single-flight key for a read-only call, or None when it must run on its own."""
+        if self._single_flight is None or not descriptor.get("read_only"):
+            return None
+        return json.dumps([descriptor_path, output_mapper, descriptor.get("fields"), args, payload],
+                          sort_keys=True, separators=(",", ":"), default=repr)
+
+    def metrics_stats(self):
+        """Per-descriptor counters and p50/p95/p99 latency ({} unless Yaal(metrics=True))."""
+        return self._metrics.stats() if self._metrics is not None else {}
+
+    def metrics_text(self):
+        """The metrics in Prometheus text exposition format ("" unless Yaal(metrics=True))."""
+        return self._metrics.text() if self._metrics is not None else ""
+
+    def statement_stats(self, top=None, sort="total_ms"):
+        """Counters per compiled-SQL fingerprint, largest first (see yaal_metrics.StatementStats).
+
+        [] unless Yaal(statement_stats=True). sort is total_ms, calls,
+        mean_ms, max_ms or rows; top limits the number of entries.
+        """
+        if self._statement_stats is None:
+            return []
+        return self._statement_stats.report(top, sort)
+
+    def reset_statement_stats(self):
+        if self._statement_stats is not None:
+            self._statement_stats.reset()
+
+    def coalesce_stats(self):
+        """Counters for single-flight coalescing (Yaal(coalesce=True))."""
+        if self._single_flight is None:
+            return {"in_flight": 0, "executions": 0, "coalesced": 0}
+        return self._single_flight.stats()
+
+    def result_cache_stats(self):
+        """Counters of the result-cache backend ({} if it keeps none)."""
+        stats = getattr(self._result_cache, "stats", None)
+        return stats() if stats is not None else {}
+
+    def invalidate_tags(self, tags):
+        """Drop cached results tagged with any of tags (as a write's invalidates: does)."""
+        self._result_cache.invalidate(list(tags))
+
+    def query_iter(self, descriptor_path, *, payload=None, args=None, output_mapper=None,
+                   fields=None):
+        """Like query, but yield shaped top-level items as rows are read.
+
+        The transaction is held until the iterator is exhausted (commit) or
+        closed early (rollback); use it in a for loop or contextlib.closing.
+        """
+        query_trace = self._start_trace(descriptor_path, False)
+        try:
+            descriptor = _timed(query_trace, "load", self._load_descriptor,
+                                descriptor_path, output_mapper, fields)
+            context = create_context(descriptor, payload=payload, args=args)
+        except BaseException:
+            _fail_trace(query_trace)
+            raise
+        items = iter_result(descriptor, self.get_data_provider, context,
+                            memory_budget=self._memory_budget, trace=query_trace)
+        if query_trace is None:
+            return items
+        return _traced_items(items, query_trace)
+
+    def _json_fragments(self, descriptor_path, payload, args, output_mapper, fields):
+        """(fragments, trace) for query_json_to / query_json_stream."""
+        query_trace = self._start_trace(descriptor_path, False)
+        try:
+            descriptor = _timed(query_trace, "load", self._load_descriptor,
+                                descriptor_path, output_mapper, fields)
+            context = create_context(descriptor, payload=payload, args=args)
+        except BaseException:
+            _fail_trace(query_trace)
+            raise
+        fragments = iter_result_json(descriptor, self.get_data_provider, context,
+                                     memory_budget=self._memory_budget, trace=query_trace)
+        return fragments, query_trace
+
+    def query_json_to(self, descriptor_path, fp, *, payload=None, args=None, output_mapper=None,
+                      fields=None):
+        """Write the query_json text to a text file-like object as rows are shaped."""
+        fragments, query_trace = self._json_fragments(descriptor_path, payload, args,
+                                                      output_mapper, fields)
+        written = 0
+        try:
+            for fragment in fragments:
+                fp.write(fragment)
+                if query_trace is not None:
+                    written += _utf8_len(fragment)
+        finally:
+            fragments.close()
+            if query_trace is not None:
+                query_trace.info["output_bytes"] = written
+                query_trace.finish()
+
+    def query_json_stream(self, descriptor_path, *, payload=None, args=None,
+                          output_mapper=None, chunk_size=DEFAULT_JSON_CHUNK_SIZE, fields=None):
+        """Yield the query_json text as UTF-8 byte chunks of roughly chunk_size bytes.
+
+        Chunks are flushed once the buffer reaches chunk_size (0 flushes every
+        item). Like query_iter, closing the generator early rolls back.
+        """
+        fragments, query_trace = self._json_fragments(descriptor_path, payload, args,
+                                                      output_mapper, fields)
+        written = 0
+        try:
+            buffer = []
+            size = 0
+            for fragment in fragments:
+                data = fragment.encode("utf-8")
+                buffer.append(data)
+                size += len(data)
+                if size >= chunk_size:
+                    written += size
+                    yield b"".join(buffer)
+                    buffer = []
+                    size = 0
+            if buffer:
+                written += size
+                yield b"".join(buffer)
+        finally:
+            fragments.close()
+            if query_trace is not None:
+                query_trace.info["output_bytes"] = written
+                query_trace.finish()
+
+    async def aquery(self, descriptor_path, *, payload=None, args=None, output_mapper=None,
+                     fields=None, trace=False):
+        """Async query: database calls are awaited instead of blocking the event loop.
+
+        memory_budget, max_branch_workers (as concurrent tasks) and
+        executemany_batch_size apply as they do to query.
+        """
+        return await self._aquery(descriptor_path, payload, args, output_mapper, False, fields,
+                                  trace)
+
+    async def aquery_json(self, descriptor_path, *, payload=None, args=None, output_mapper=None,
+                          fields=None, trace=False):
+        """Same as aquery, but return a JSON string."""
+        return await self._aquery(descriptor_path, payload, args, output_mapper, True, fields,
+                                  trace)
+
+    async def _aquery(self, descriptor_path, payload, args, output_mapper, as_json, fields=None,
+                      trace=False):
+        query_trace = self._start_trace(descriptor_path, trace)
+        try:
+            value = await self._arun_query(descriptor_path, payload, args, output_mapper,
+                                           as_json, fields, query_trace)
+        except BaseException:
+            _fail_trace(query_trace)
+            raise
+        return self._end_trace(query_trace, value, trace, as_json)
+
+    async def _arun_query(self, descriptor_path, payload, args, output_mapper, as_json, fields,
+                          trace):
+        descriptor = _timed(trace, "load", self._load_descriptor,
+                            descriptor_path, output_mapper, fields)
         context = create_context(descriptor, payload=payload, args=args)
-        return self.get_result_json(descriptor, context)
+        cache_key = self._result_cache_key(descriptor, descriptor_path, output_mapper, context)
+        versions = tag_versions = None
+        if cache_key is not None:
+            # Taken before running, so a write racing this query invalidates its entry.
+            versions = self._data_versions(descriptor)
+            tag_versions = self._tag_versions(descriptor)
+            entry = self._result_cache.get(cache_key)
+            if entry is not None and entry[2] == versions:
+                _trace_info(trace, status="ok", cache="hit")
+                return self._cached_value(entry, as_json, trace)
+            _trace_info(trace, cache="miss")
+        result = await aget_result(descriptor, self.get_async_data_provider, context,
+                                   max_branch_workers=self._max_branch_workers,
+                                   executemany_batch_size=self._executemany_batch_size,
+                                   memory_budget=self._memory_budget, trace=trace)
+        _trace_status(trace, result)
+        return self._finish_query(descriptor, result, cache_key, versions, as_json, False, trace,
+                                  tag_versions)
 
     def explain_sql(self, descriptor_path, *, payload=None, args=None,
-                    output_mapper=None, placeholder=None):
+                    output_mapper=None, placeholder=None, fields=None):
         """Return compiled SQL twigs after null-filter elision (for authoring/debug)."""
-        descriptor = self._load_descriptor(descriptor_path, output_mapper)
+        descriptor = self._load_descriptor(descriptor_path, output_mapper, fields)
         context = create_context(descriptor, payload=payload, args=args)
         if placeholder is None:
             placeholder = self._default_placeholder()
@@ -380,11 +997,17 @@ class Yaal:
         walk(descriptor, context)
         return explained
 
-    def get_result(self, descriptor, context):
-        return get_result(descriptor, self.get_data_provider, context)
-
-    def get_result_json(self, descriptor, context):
-        return get_result_json(descriptor, self.get_data_provider, context)
+    def get_result(self, descriptor, context, trace=None):
+        return get_result(descriptor, self.get_data_provider, context,
+                          max_branch_workers=self._max_branch_workers,
+                          executemany_batch_size=self._executemany_batch_size,
+                          memory_budget=self._memory_budget, trace=trace)
+
+    def get_result_json(self, descriptor, context, trace=None):
+        return get_result_json(descriptor, self.get_data_provider, context,
+                               max_branch_workers=self._max_branch_workers,
+                               executemany_batch_size=self._executemany_batch_size,
+                               memory_budget=self._memory_budget, trace=trace)
 
     def get_root_path(self):
         return self._root_path
@@ -0,0 +1,343 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Benchmark the fixture descriptors on seeded SQLite: yaal bench, benchmarks/.
+
+seed() fills the docker/sqlite/schema.sql schema with --users users,
+--roles roles and --roles-per-user assignments each. run_bench() then runs
+every fixture descriptor (user/get, user/list, user/nested, user/page,
+report/summary, user/create) in three passes:
+
+    latency   untraced calls after a warmup: throughput, mean / p50 / p90 /
+              p99 / max latency, and peak RSS once the descriptor has run
+    stages    a few traced calls (yaal_trace): mean milliseconds per stage
+              and rows fetched per call
+    memory    a few calls under tracemalloc: peak traced bytes per call
+
+Arguments vary per call (ids, pages) from a fixed random seed, so runs are
+comparable. The result is one JSON-serialisable dict; compare_results()
+diffs two of them, e.g. from different commits.
+"""
+
+import datetime
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from yaal import Yaal
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_API = ROOT / "tests" / "fixtures" / "api"
+DEFAULT_SCHEMA = ROOT / "docker" / "sqlite" / "schema.sql"
+FORMAT = 1
+# User and role ids the schema already inserts.
+_SCHEMA_USERS = 2
+_SCHEMA_ROLES = 2
+_SEED_BATCH = 50000
+
+
+def _user_get(state, rng):
+    return {"args": {"id": rng.randint(1, state["users"])}}
+
+
+def _user_list(state, rng):
+    return {}
+
+
+def _user_nested(state, rng):
+    return {"args": {"id": rng.randint(1, state["users"])}}
+
+
+def _user_page(state, rng):
+    page_size = 50
+    pages = max(1, state["users"] // page_size)
+    return {"args": {"page": rng.randint(1, pages), "page_size": page_size}}
+
+
+def _report_summary(state, rng):
+    return {}
+
+
+def _user_create(state, rng):
+    state["next_id"] += 1
+    return {"payload": {"id": state["next_id"], "name": "bench%d" % state["next_id"]}}
+
+
+# (descriptor path, request factory); user/combine needs a second database.
+WORKLOAD = (
+    ("user/get", _user_get),
+    ("user/list", _user_list),
+    ("user/nested", _user_nested),
+    ("user/page", _user_page),
+    ("report/summary", _report_summary),
+    ("user/create", _user_create),
+)
+
+
+def seed(db_path, users=1000, roles=None, roles_per_user=2, schema=DEFAULT_SCHEMA):
+    """Create the schema in db_path and fill it; returns the scale actually seeded.
+
+    roles defaults to users // 100 (at least roles_per_user). Each user gets
+    roles_per_user distinct roles, spread round-robin.
+    """
+    users = max(users, _SCHEMA_USERS)
+    if roles is None:
+        roles = users // 100
+    roles = max(roles, roles_per_user, _SCHEMA_ROLES)
+    roles_per_user = min(roles_per_user, roles)
+    con = sqlite3.connect(db_path)
+    try:
+        con.executescript(Path(schema).read_text())
+        con.executemany(
+            "INSERT INTO roles (role_id, role_name, active) VALUES (?, ?, 1)",
+            ((r, "role%d" % r) for r in range(_SCHEMA_ROLES + 1, roles + 1)),
+        )
+        for start in range(_SCHEMA_USERS + 1, users + 1, _SEED_BATCH):
+            ids = range(start, min(start + _SEED_BATCH, users + 1))
+            con.executemany(
+                "INSERT INTO users (user_id, user_name, active) VALUES (?, ?, ?)",
+                ((i, "user%d" % i, 0 if i % 10 == 0 else 1) for i in ids),
+            )
+            con.executemany(
+                "INSERT INTO user_roles (user_id, role_id) VALUES (?, ?)",
+                ((i, (i + k) % roles + 1) for i in ids for k in range(roles_per_user)),
+            )
+        con.commit()
+    finally:
+        con.close()
+    return {"users": users, "roles": roles, "roles_per_user": roles_per_user}
+
+
+def _percentile(ordered, q):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(q * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _ms(seconds):
+    return round(seconds * 1000.0, 4)
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _git_commit(root=ROOT):
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=str(root), capture_output=True,
+                             text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _run(y, path, request):
+    return y.query(path, args=request.get("args"), payload=request.get("payload"))
+
+
+def _bench_descriptor(y, path, factory, state, iterations, warmup, max_seconds,
+                      stage_iterations, memory_iterations):
+    rng = random.Random(path)
+    for _ in range(warmup):
+        _run(y, path, factory(state, rng))
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        request = factory(state, rng)
+        t0 = time.perf_counter()
+        result = _run(y, path, request)
+        latencies.append(time.perf_counter() - t0)
+        if isinstance(result, dict) and "errors" in result:
+            errors += 1
+        if max_seconds and time.perf_counter() - started >= max_seconds:
+            break
+    wall = time.perf_counter() - started
+    latencies.sort()
+
+    traces = []
+    y.add_trace_callback(traces.append)
+    try:
+        for _ in range(stage_iterations):
+            _run(y, path, factory(state, rng))
+    finally:
+        y.remove_trace_callback(traces.append)
+    stages = {}
+    for trace in traces:
+        for stage, ms in trace["stages"].items():
+            stages[stage] = stages.get(stage, 0.0) + ms
+    count = len(traces) or 1
+
+    peak_traced = None
+    if memory_iterations:
+        tracemalloc.start()
+        try:
+            for _ in range(memory_iterations):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                _run(y, path, factory(state, rng))
+                peak = tracemalloc.get_traced_memory()[1] - base
+                peak_traced = peak if peak_traced is None else max(peak_traced, peak)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "iterations": len(latencies),
+        "errors": errors,
+        "seconds": round(wall, 4),
+        "throughput_per_s": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "latency_ms": {
+            "mean": _ms(sum(latencies) / len(latencies)) if latencies else None,
+            "p50": _ms(_percentile(latencies, 0.50)) if latencies else None,
+            "p90": _ms(_percentile(latencies, 0.90)) if latencies else None,
+            "p99": _ms(_percentile(latencies, 0.99)) if latencies else None,
+            "max": _ms(latencies[-1]) if latencies else None,
+        },
+        "stages_ms": {stage: round(ms / count, 4) for stage, ms in stages.items()},
+        "rows": round(sum(trace["rows"] for trace in traces) / count, 1),
+        "tracemalloc_peak_bytes": peak_traced,
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def run_bench(*, users=1000, roles=None, roles_per_user=2, iterations=100, warmup=5,
+              max_seconds=None, stage_iterations=10, memory_iterations=3, descriptors=None,
+              db_file=None, api=DEFAULT_API, schema=DEFAULT_SCHEMA, progress=None):
+    """Seed SQLite and benchmark the WORKLOAD descriptors; returns the result dict.
+
+    descriptors restricts the run to those paths. db_file keeps the seeded
+    database (and reuses it when it already exists); otherwise a temporary
+    file is used. progress(path) is called before each descriptor.
+    """
+    selected = [(p, f) for p, f in WORKLOAD if descriptors is None or p in descriptors]
+    unknown = set(descriptors or ()) - {p for p, _f in WORKLOAD}
+    if unknown:
+        raise ValueError("unknown benchmark descriptor(s): %s" % ", ".join(sorted(unknown)))
+    # The defaults live in a source checkout; an installed package has neither.
+    if not Path(api).is_dir():
+        raise ValueError("descriptor root not found: %s (pass --api with the fixture "
+                         "descriptors, tests/fixtures/api in a source checkout)" % api)
+    if not (db_file is not None and os.path.exists(db_file)) and not Path(schema).is_file():
+        raise ValueError("schema file not found: %s (pass --schema, "
+                         "docker/sqlite/schema.sql in a source checkout)" % schema)
+
+    temporary = db_file is None
+    if temporary:
+        fd, db_file = tempfile.mkstemp(prefix="yaal-bench-", suffix=".db")
+        os.close(fd)
+        os.unlink(db_file)
+    try:
+        t0 = time.perf_counter()
+        if os.path.exists(db_file):
+            scale = _existing_scale(db_file, roles_per_user)
+            seeded = 0.0
+        else:
+            scale = seed(db_file, users, roles, roles_per_user, schema)
+            seeded = time.perf_counter() - t0
+        y = Yaal(str(api))
+        y.setup_data_provider("db", "sqlite3:///" + db_file)
+        state = {"users": scale["users"], "next_id": _max_user_id(db_file)}
+
+        results = {}
+        for path, factory in selected:
+            if progress is not None:
+                progress(path)
+            results[path] = _bench_descriptor(
+                y, path, factory, state, iterations, warmup, max_seconds,
+                stage_iterations, memory_iterations,
+            )
+    finally:
+        if temporary and os.path.exists(db_file):
+            os.unlink(db_file)
+
+    return {
+        "format": FORMAT,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "seed_seconds": round(seeded, 3),
+        "config": {
+            "iterations": iterations,
+            "warmup": warmup,
+            "max_seconds": max_seconds,
+            "stage_iterations": stage_iterations,
+            "memory_iterations": memory_iterations,
+        },
+        "descriptors": results,
+    }
+
+
+def _max_user_id(db_file):
+    con = sqlite3.connect(db_file)
+    try:
+        return con.execute("SELECT COALESCE(MAX(user_id), 0) FROM users").fetchone()[0]
+    finally:
+        con.close()
+
+
+def _existing_scale(db_file, roles_per_user):
+    con = sqlite3.connect(db_file)
+    try:
+        users = con.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        roles = con.execute("SELECT COUNT(*) FROM roles").fetchone()[0]
+    finally:
+        con.close()
+    return {"users": users, "roles": roles, "roles_per_user": roles_per_user}
+
+
+def compare_results(base, new, threshold=10.0):
+    """Per descriptor changes from base to new (result dicts of run_bench).
+
+    Returns [{"descriptor", "throughput_pct", "p50_pct", "p99_pct",
+    "regressed"}, ...] for descriptors in both; a descriptor regressed when
+    throughput fell, or p50 / p99 rose, by more than threshold percent.
+    """
+
+    def change(old, value):
+        if not old or value is None:
+            return None
+        return round((value - old) * 100.0 / old, 1)
+
+    rows = []
+    for path, after in new["descriptors"].items():
+        before = base["descriptors"].get(path)
+        if before is None:
+            continue
+        throughput = change(before["throughput_per_s"], after["throughput_per_s"])
+        p50 = change(before["latency_ms"]["p50"], after["latency_ms"]["p50"])
+        p99 = change(before["latency_ms"]["p99"], after["latency_ms"]["p99"])
+        rows.append({
+            "descriptor": path,
+            "throughput_pct": throughput,
+            "p50_pct": p50,
+            "p99_pct": p99,
+            "regressed": bool(
+                (throughput is not None and throughput < -threshold)
+                or (p50 is not None and p50 > threshold)
+                or (p99 is not None and p99 > threshold)
+            ),
+        })
+    return rows
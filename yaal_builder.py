@@ -7,6 +7,7 @@ import re
 
 from jsonschema import FormatChecker, Draft4Validator
 
+from yaal_const import PARENT_KEYS
 from yaal_parser import lexer, parser
 from yaal_shape import _to_lower_keys_deep, _to_lower_keys
 
@@ -20,6 +21,16 @@ _SQL_TO_JSON_TYPE = {
     "blob": "string",
 }
 
+# hash: index parent/child rows by key (any order); merge: ordered streaming merge.
+_PARTITION_STRATEGIES = ("hash", "merge")
+
+# Leading keywords of statements that never change data.
+_READ_KEYWORDS = ("SELECT", "WITH", "VALUES", "SHOW", "EXPLAIN", "DESCRIBE", "PRAGMA")
+_WRITE_KEYWORDS = ("INSERT", "UPDATE", "DELETE", "MERGE", "REPLACE", "UPSERT")
+# $params keys set once per request by create_context.
+_CONSTANT_PARAMS = ("$params.path", "$params.$run_id")
+_LAST_INSERTED_ID = "$params.$last_inserted_id"
+
 
 def _order_list_by_dots(names):
     if not names:
@@ -70,6 +81,7 @@ def _build_branch(branch, map_by_files, content_reader, payload_model, output_mo
     from yaal_output_schema import normalize_output_model
 
     _properties_str, _type_str, _partition_by_str = "properties", "type", "partition_by"
+    _partition_strategy_str = "partition_strategy"
     _output_type_str, _use_parent_rows_str = "output_type", "use_parent_rows"
     _parameters_str, _twig_str, _parent_rows_str = "parameters", "twig", "parent_rows"
 
@@ -100,6 +112,15 @@ def _build_branch(branch, map_by_files, content_reader, payload_model, output_mo
         if _partition_by_str in output_model:
             branch[_partition_by_str] = output_model[_partition_by_str]
 
+        if _partition_strategy_str in output_model:
+            strategy = output_model[_partition_strategy_str]
+            if strategy not in _PARTITION_STRATEGIES:
+                raise TypeError(
+                    "unknown partition_strategy '%s' in %s (expected one of: %s)"
+                    % (strategy, method, ", ".join(_PARTITION_STRATEGIES))
+                )
+            branch[_partition_strategy_str] = strategy
+
         if output_properties:
             for k in output_properties:
                 v = output_properties[k]
@@ -120,6 +141,9 @@ def _build_branch(branch, map_by_files, content_reader, payload_model, output_mo
         branch["parameters"] = ast.get("parameters") or {}
 
         for k, v in branch["parameters"].items():
+            if k == PARENT_KEYS:
+                # Bound from the parent's rows at run time, not from args/payload.
+                continue
             if k[0] == "$" and k.find("$parent") == -1:
                 _expand_parameter(model, k, v)
             else:
@@ -172,6 +196,14 @@ def _build_branch(branch, map_by_files, content_reader, payload_model, output_mo
             if _partition_by_str not in branch or not branch[_partition_by_str]:
                 raise Exception("parent's _partition_by is can't be empty when child wanted to use parent rows")
 
+        if PARENT_KEYS in (sub_branch.get("parameters") or {}):
+            if not branch.get(_partition_by_str):
+                raise TypeError(
+                    "%s binds {{%s}} but parent %s has no partition_by"
+                    % (sub_branch_method, PARENT_KEYS, method)
+                )
+            sub_branch["parent_key"] = branch[_partition_by_str]
+
         branches.append(sub_branch)
 
     if branches:
@@ -322,6 +354,13 @@ def create_trunk(path, output_mapper, content_reader):
     bag = {"connections": ["db"]}
     _build_branch(trunk, trunk_map["$"], content_reader, payload_schema, output_schema, trunk["model"], bag)
     trunk["connections"] = bag["connections"]
+    annotate_dependencies(trunk)
+    annotate_batching(trunk)
+    annotate_read_only(trunk, output_schema.get("read_only"))
+    annotate_cache(trunk, output_schema.get("cache"), args_schema)
+    annotate_server_cursor(trunk, output_schema.get("server_cursor"))
+    annotate_spill(trunk)
+    annotate_output_plan(trunk)
 
     payload_validator = Draft4Validator(schema=payload_schema, format_checker=FormatChecker())
     args_validator = Draft4Validator(schema=args_schema, format_checker=FormatChecker())
@@ -332,3 +371,279 @@ def create_trunk(path, output_mapper, content_reader):
     }
 
     return trunk
+
+
+def _twig_effects(twig):
+    """Return (writes_data, sets_params) for one twig, judged from its tokens."""
+    words = [t["value"].upper() for t in twig["content"] if t["type"] == "word"]
+    sets_params = any("$mode" in t["value"] for t in twig["content"] if t["type"] in ("string", "word"))
+    if not words:
+        return False, sets_params
+    if words[0] not in _READ_KEYWORDS:
+        return True, sets_params
+    if words[0] == "WITH" and any(w in _WRITE_KEYWORDS for w in words):
+        return True, sets_params
+    return False, sets_params
+
+
+def _branch_node(branch):
+    node = {
+        "method": branch["method"],
+        "connections": set(),
+        "writes": False,
+        "sets_params": False,
+        "reads_params": False,
+        "reads_last_id": False,
+    }
+    for twig in branch["twigs"]:
+        node["connections"].add(twig["connection"])
+        writes, sets_params = _twig_effects(twig)
+        node["writes"] = node["writes"] or writes
+        node["sets_params"] = node["sets_params"] or sets_params
+        for parameter in twig.get("parameters") or []:
+            name = parameter["name"]
+            if name == _LAST_INSERTED_ID:
+                node["reads_last_id"] = True
+            elif name.startswith("$params.") and name not in _CONSTANT_PARAMS:
+                node["reads_params"] = True
+    return node
+
+
+def _must_precede(a, b):
+    """True when node a (earlier in sequential order) has to finish before b starts."""
+    # Every twig overwrites $last_inserted_id, so its readers run alone.
+    if a["reads_last_id"] or b["reads_last_id"]:
+        return True
+    if a["sets_params"] and (b["reads_params"] or b["sets_params"]):
+        return True
+    if a["reads_params"] and b["sets_params"]:
+        return True
+    if a["connections"] & b["connections"] and (a["writes"] or b["writes"]):
+        return True
+    return False
+
+
+def annotate_dependencies(trunk):
+    """Record on each SQL-running branch the methods it must wait for ("depends_on").
+
+    Branches run in pre-order when executed sequentially; the edges keep that
+    order wherever it is observable: $params written by $mode=params rows and
+    read by later SQL, $last_inserted_id, and writes on a shared connection.
+    Branches fed by parent_rows run no SQL and are not scheduled; a branch
+    binding {{$parent_keys}} also waits for the branch that produced its
+    parent's rows.
+    """
+    branches, nodes, row_sources = [], [], []
+
+    def walk(branch, row_source):
+        if branch.get("twigs") and not branch.get("use_parent_rows"):
+            branches.append(branch)
+            nodes.append(_branch_node(branch))
+            row_sources.append(row_source)
+            row_source = branch["method"]
+        for child in branch.get("branches") or []:
+            walk(child, row_source)
+
+    walk(trunk, None)
+    for j, branch in enumerate(branches):
+        depends_on = [
+            nodes[i]["method"] for i in range(j) if _must_precede(nodes[i], nodes[j])
+        ]
+        if branch.get("parent_key") and row_sources[j] and row_sources[j] not in depends_on:
+            depends_on.append(row_sources[j])
+        branch["depends_on"] = depends_on
+    return trunk
+
+
+def _twig_batchable(twig):
+    writes, sets_params = _twig_effects(twig)
+    if not writes or sets_params:
+        return False
+    if any(t["type"] == "word" and t["value"].upper() == "RETURNING" for t in twig["content"]):
+        return False
+    if any(p["name"] == PARENT_KEYS for p in twig.get("parameters") or []):
+        return False
+    # $params (incl. $last_inserted_id) can change between items; batching would freeze it.
+    return not any(p["name"].startswith("$params.") for p in twig.get("parameters") or [])
+
+
+def annotate_batching(trunk):
+    """Mark twigs that may run through executemany ("batchable").
+
+    A batchable twig writes data, returns no rows (no $mode, no RETURNING)
+    and reads nothing from $params, so running it for every array item before
+    the next twig gives the same result as item-by-item execution.
+    """
+    twigs = []
+
+    def walk(branch):
+        twigs.extend(branch.get("twigs") or [])
+        for child in branch.get("branches") or []:
+            walk(child)
+
+    walk(trunk)
+    # Drivers disagree on the id after executemany; keep item order if anyone reads it.
+    reads_last_id = any(
+        p["name"] == _LAST_INSERTED_ID for twig in twigs for p in twig.get("parameters") or []
+    )
+    for twig in twigs:
+        twig["batchable"] = not reads_last_id and _twig_batchable(twig)
+    return trunk
+
+
+def annotate_read_only(trunk, declared=None):
+    """Mark the trunk "read_only" when no twig writes data.
+
+    declared is the output model's optional ``read_only`` key: false opts a
+    SELECT-only descriptor out (e.g. volatile functions), true is checked
+    against the SQL and rejected if any twig writes.
+    """
+    writes = []
+
+    def walk(branch):
+        for twig in branch.get("twigs") or []:
+            if _twig_effects(twig)[0]:
+                writes.append(branch["method"])
+        for child in branch.get("branches") or []:
+            walk(child)
+
+    walk(trunk)
+    if declared is None:
+        trunk["read_only"] = not writes
+    elif declared and writes:
+        raise TypeError(
+            "%s declares read_only but %s writes data" % (trunk["path"], writes[0])
+        )
+    else:
+        trunk["read_only"] = bool(declared)
+    return trunk
+
+
+# Statements a Postgres named cursor (DECLARE ... CURSOR FOR) accepts.
+_CURSOR_KEYWORDS = ("SELECT", "WITH", "VALUES")
+
+
+def annotate_server_cursor(trunk, declared=None):
+    """Set twig["server_cursor"] for Postgres named / MySQL unbuffered cursors.
+
+    declared is the output model's optional ``server_cursor`` key. Reads
+    get it as is (None: the connection URL decides); writes and statements
+    a cursor cannot declare get False.
+    """
+    if declared is not None and not isinstance(declared, bool):
+        raise TypeError("%s: server_cursor must be true or false" % trunk["path"])
+
+    def walk(branch):
+        for twig in branch.get("twigs") or []:
+            words = [t["value"].upper() for t in twig["content"] if t["type"] == "word"]
+            readable = bool(words) and words[0] in _CURSOR_KEYWORDS and not _twig_effects(twig)[0]
+            twig["server_cursor"] = declared if readable else False
+        for child in branch.get("branches") or []:
+            walk(child)
+
+    walk(trunk)
+    return trunk
+
+
+def annotate_spill(trunk):
+    """Set branch["spill_key"] on child branches a memory budget may spill to disk.
+
+    That is a child grouped by its parent's partition_by that runs its own
+    SQL once (object input, no {{$parent_keys}}) and has no children of its
+    own: its rows are only ever looked up by partition key. See yaal_spill.
+    """
+
+    def walk(branch):
+        partition_by = branch.get("partition_by")
+        for child in branch.get("branches") or []:
+            if (partition_by and child.get("twigs") and not child.get("use_parent_rows")
+                    and not child.get("parent_key") and not child.get("branches")
+                    and child["input_type"] == "object"):
+                child["spill_key"] = partition_by
+            walk(child)
+
+    walk(trunk)
+    return trunk
+
+
+_CACHE_KEYS = ("ttl", "tags", "key", "revalidate", "invalidates")
+_CACHE_REVALIDATE = ("data_version",)
+
+
+def annotate_output_plan(trunk):
+    """Build the output mapper's plan once and store it as trunk["output_plan"].
+
+    See yaal_output_schema.build_output_plan; the plan is plain JSON, so
+    precompiled artifacts carry it too.
+    """
+    from yaal_output_schema import build_output_plan
+
+    trunk["output_plan"] = build_output_plan(
+        trunk["output_type"], trunk["model"]["output"], trunk.get("branches")
+    )
+    return trunk
+
+
+def _string_list(trunk, name, value):
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(v, str) and v for v in value):
+        raise TypeError("%s: cache.%s must be a list of names" % (trunk["path"], name))
+    return list(value)
+
+
+def annotate_cache(trunk, declared, args_schema):
+    """Copy the output model's ``cache:`` block onto the trunk.
+
+    ``ttl`` (seconds), ``tags``, ``key`` (arg names; default: all args and
+    the payload) and ``revalidate`` become trunk["cache"] and are only
+    allowed on read_only descriptors; with ``revalidate: data_version`` the
+    ttl is optional. ``invalidates`` lists tags dropped after a successful
+    run and becomes trunk["invalidates"].
+    """
+    if declared is None:
+        return trunk
+    path = trunk["path"]
+    if not isinstance(declared, dict):
+        raise TypeError("%s: cache must be a mapping" % path)
+    unknown = [k for k in declared if k not in _CACHE_KEYS]
+    if unknown:
+        raise TypeError(
+            "%s: unknown cache key(s) %s (expected: %s)"
+            % (path, ", ".join(sorted(unknown)), ", ".join(_CACHE_KEYS))
+        )
+
+    if "invalidates" in declared:
+        trunk["invalidates"] = _string_list(trunk, "invalidates", declared["invalidates"])
+
+    revalidate = declared.get("revalidate")
+    if revalidate is not None and revalidate not in _CACHE_REVALIDATE:
+        raise TypeError(
+            "%s: cache.revalidate must be one of: %s" % (path, ", ".join(_CACHE_REVALIDATE))
+        )
+    if "ttl" not in declared and revalidate is None:
+        if "tags" in declared or "key" in declared:
+            raise TypeError("%s: cache.tags / cache.key need cache.ttl or cache.revalidate" % path)
+        return trunk
+    ttl = declared.get("ttl")
+    if ttl is not None and (isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0):
+        raise TypeError("%s: cache.ttl must be a positive number of seconds" % path)
+    if not trunk.get("read_only"):
+        raise TypeError("%s: only read_only descriptors can be cached" % path)
+
+    key = None
+    if "key" in declared:
+        key = [name.lower() for name in _string_list(trunk, "key", declared["key"])]
+        known = args_schema.get("properties") or {}
+        missing = [name for name in key if name not in known]
+        if missing:
+            raise TypeError(
+                "%s: cache.key names unknown arg(s) %s" % (path, ", ".join(missing))
+            )
+    trunk["cache"] = {
+        "ttl": ttl,
+        "tags": _string_list(trunk, "tags", declared.get("tags") or []),
+        "key": key,
+        "revalidate": revalidate,
+    }
+    return trunk
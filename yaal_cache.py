@@ -0,0 +1,223 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Bounded, thread-safe in-process caches shared across requests."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Bounded LRU mapping guarded by a lock, with hit/miss/eviction counters."""
+
+    def __init__(self, maxsize=1024):
+        if maxsize is None or maxsize < 1:
+            raise ValueError("maxsize must be a positive integer")
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            data = self._data
+            if key in data:
+                data.move_to_end(key)
+            data[key] = value
+            while len(data) > self._maxsize:
+                data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def discard_if(self, predicate):
+        """Drop the entries for which predicate(key, value) is true; returns how many."""
+        with self._lock:
+            keys = [key for key, value in self._data.items() if predicate(key, value)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        """Drop all entries (counters are kept; see reset_stats)."""
+        with self._lock:
+            self._data.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def resize(self, maxsize):
+        if maxsize is None or maxsize < 1:
+            raise ValueError("maxsize must be a positive integer")
+        with self._lock:
+            self._maxsize = maxsize
+            while len(self._data) > maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self._maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+
+class _Flight:
+
+    __slots__ = ("done", "value", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution.
+
+    The first caller for a key runs fn; callers arriving while it runs wait
+    and receive the same value (or exception). Nothing is remembered once
+    the call finishes, so this is not a cache.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return (value, shared); shared is True when more than one caller got value."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.executions += 1
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, True
+
+        try:
+            flight.value = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            # Unpublish before waking waiters so later callers start a fresh run.
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.value, flight.waiters > 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+            }
+
+
+class MemoryResultCache:
+    """Default result-cache backend: an LRU of values with a TTL and tags.
+
+    Backends implement get(key) (None on a miss), set(key, value, ttl, tags)
+    with ttl None for no expiry, and invalidate(tags); Yaal stores opaque,
+    non-None values. Tags are
+    versioned here, so invalidate() is O(tags) and stale entries are
+    dropped when next read or evicted. A backend may also offer
+    versions_for(tags): Yaal takes that snapshot before running a query and
+    passes it to set(..., versions=), so an invalidate() that lands while
+    the query runs leaves its entry stale.
+    """
+
+    def __init__(self, maxsize=1024, clock=time.monotonic):
+        self._entries = LRUCache(maxsize)
+        self._clock = clock
+        self._tag_versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def versions_for(self, tags):
+        """Current versions of tags, for set(..., versions=)."""
+        with self._lock:
+            return tuple(self._tag_versions.get(tag, 0) for tag in tags)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, tags, versions, value = entry
+            if expires > self._clock() and self.versions_for(tags) == versions:
+                with self._lock:
+                    self.hits += 1
+                return value
+            self._entries.pop(key)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, ttl, tags=(), versions=None):
+        """Store value for ttl seconds (None: until evicted or invalidated).
+
+        versions is a versions_for(tags) snapshot taken before value was
+        computed; without one the tags' current versions are used.
+        """
+        tags = tuple(tags)
+        if versions is None:
+            versions = self.versions_for(tags)
+        expires = float("inf") if ttl is None else self._clock() + ttl
+        self._entries.put(key, (expires, tags, versions, value))
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+            self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        stats = self._entries.stats()
+        stats.update(hits=self.hits, misses=self.misses, invalidations=self.invalidations)
+        return stats
@@ -95,6 +95,8 @@ def _demo_db_url(schema_path: Path):
 
 
 def _build_parser():
+    from yaal_metrics import STATEMENT_SORT_KEYS
+
     parser = argparse.ArgumentParser(
         prog="yaal",
         description="Query, explain, and list Yaal SQL→JSON descriptors.",
@@ -143,6 +145,12 @@ def _build_parser():
         required=True,
         help="Output directory for *.json descriptor artifacts",
     )
+    compile_p.add_argument(
+        "--codegen",
+        action="store_true",
+        help="Also write a generated Python row mapper (*.py) per artifact, "
+        "used by Yaal(precompiled=..., codegen=True)",
+    )
 
     for name, help_text in (
         ("query", "Run Yaal.query and print nested JSON"),
@@ -168,14 +176,154 @@ def _build_parser():
             default=None,
             help="Payload as a JSON object",
         )
+        p.add_argument(
+            "--fields",
+            default=None,
+            help="Output keys to return, e.g. 'id,name,roles.id' (unselected branches do not run)",
+        )
+        if name == "query":
+            p.add_argument(
+                "--chrome-trace",
+                default=None,
+                metavar="FILE",
+                help="Write the query's spans as Chrome trace_event JSON "
+                "(open in chrome://tracing or ui.perfetto.dev)",
+            )
+
+    stats_p = sub.add_parser(
+        "stats",
+        help="Run descriptors and print statistics per compiled-SQL fingerprint",
+    )
+    stats_p.add_argument(
+        "paths",
+        nargs="*",
+        help="Descriptor paths to run with --arg / --args / --payload",
+    )
+    stats_p.add_argument(
+        "--arg",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Operation arg for the positional paths (repeatable)",
+    )
+    stats_p.add_argument(
+        "--args",
+        dest="args_json",
+        default=None,
+        help="Args for the positional paths as a JSON object",
+    )
+    stats_p.add_argument(
+        "--payload",
+        default=None,
+        help="Payload for the positional paths as a JSON object",
+    )
+    stats_p.add_argument(
+        "--requests",
+        default=None,
+        metavar="FILE",
+        help='JSON lines of {"path": ..., "args": {...}, "payload": {...}} to replay',
+    )
+    stats_p.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Run the whole workload this many times (default: 1)",
+    )
+    stats_p.add_argument(
+        "--top",
+        type=int,
+        default=20,
+        help="Statements to print (default: 20)",
+    )
+    stats_p.add_argument(
+        "--sort",
+        default="total_ms",
+        choices=STATEMENT_SORT_KEYS,
+        help="Order statements by this column, largest first (default: total_ms)",
+    )
+    stats_p.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the report as JSON instead of a table",
+    )
+
+    bench_p = sub.add_parser(
+        "bench",
+        help="Seed SQLite at a given scale, benchmark the fixture descriptors, print JSON",
+    )
+    bench_p.add_argument(
+        "--users",
+        type=int,
+        default=1000,
+        help="Users to seed (default: 1000)",
+    )
+    bench_p.add_argument(
+        "--roles",
+        type=int,
+        default=None,
+        help="Roles to seed (default: users / 100)",
+    )
+    bench_p.add_argument(
+        "--roles-per-user",
+        type=int,
+        default=2,
+        help="Role assignments per user (default: 2)",
+    )
+    bench_p.add_argument(
+        "--iterations",
+        type=int,
+        default=100,
+        help="Timed calls per descriptor (default: 100)",
+    )
+    bench_p.add_argument(
+        "--warmup",
+        type=int,
+        default=5,
+        help="Untimed calls per descriptor first (default: 5)",
+    )
+    bench_p.add_argument(
+        "--max-seconds",
+        type=float,
+        default=None,
+        help="Stop a descriptor's timed calls after this long",
+    )
+    bench_p.add_argument(
+        "--stage-iterations",
+        type=int,
+        default=10,
+        help="Traced calls per descriptor for the stage breakdown (default: 10)",
+    )
+    bench_p.add_argument(
+        "--memory-iterations",
+        type=int,
+        default=3,
+        help="Calls per descriptor under tracemalloc (default: 3; 0 skips)",
+    )
+    bench_p.add_argument(
+        "--only",
+        action="append",
+        default=None,
+        metavar="PATH",
+        help="Benchmark only this descriptor (repeatable)",
+    )
+    bench_p.add_argument(
+        "--db-file",
+        default=None,
+        help="Keep the seeded SQLite file here and reuse it when it exists",
+    )
+    bench_p.add_argument(
+        "--out",
+        default=None,
+        help="Write the JSON result to this file instead of stdout",
+    )
 
     return parser
 
 
-def _with_yaal(ns, fn):
+def _with_yaal(ns, fn, **options):
     from yaal import Yaal
 
-    y = Yaal(ns.api, debug=ns.debug, precompiled=ns.precompiled)
+    y = Yaal(ns.api, debug=ns.debug, precompiled=ns.precompiled, **options)
     if ns.db:
         y.setup_data_provider(ns.provider, ns.db)
         return fn(y)
@@ -196,10 +344,11 @@ def cmd_list(ns):
 def cmd_compile(ns):
     from yaal_precompile import compile_api
 
-    written = compile_api(ns.api, ns.out)
+    written = compile_api(ns.api, ns.out, codegen=ns.codegen)
     for rel in written:
         print(rel)
-    print("wrote %d descriptor(s) to %s" % (len(written), ns.out), file=sys.stderr)
+    count = sum(1 for rel in written if rel.endswith(".json"))
+    print("wrote %d descriptor(s) to %s" % (count, ns.out), file=sys.stderr)
     return 0
 
 
@@ -208,8 +357,16 @@ def cmd_query(ns):
     payload = _parse_payload(ns.payload)
 
     def run(y):
-        result = y.query(ns.path, args=args, payload=payload)
+        exporter = None
+        if ns.chrome_trace:
+            from yaal_trace import ChromeTraceExporter
+
+            exporter = ChromeTraceExporter(ns.chrome_trace)
+            y.add_span_exporter(exporter)
+        result = y.query(ns.path, args=args, payload=payload, fields=ns.fields)
         print(json.dumps(result, indent=2))
+        if exporter is not None:
+            exporter.shutdown()
 
     _with_yaal(ns, run)
     return 0
@@ -220,7 +377,7 @@ def cmd_explain(ns):
     payload = _parse_payload(ns.payload)
 
     def run(y):
-        for twig in y.explain_sql(ns.path, args=args, payload=payload):
+        for twig in y.explain_sql(ns.path, args=args, payload=payload, fields=ns.fields):
             print(twig["sql"].strip())
             print("binds:", twig["parameters"])
             print()
@@ -229,6 +386,91 @@ def cmd_explain(ns):
     return 0
 
 
+def _stats_workload(ns):
+    """[(path, args, payload), ...] from the positional paths and --requests."""
+    args = _merge_args(ns)
+    payload = _parse_payload(ns.payload)
+    workload = [(path, args, payload) for path in ns.paths]
+    if ns.requests:
+        with open(ns.requests, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                if not isinstance(request, dict) or "path" not in request:
+                    raise SystemExit(
+                        "%s:%d: expected a JSON object with a path" % (ns.requests, number)
+                    )
+                workload.append((request["path"], request.get("args"), request.get("payload")))
+    if not workload:
+        raise SystemExit("yaal stats: give descriptor paths or --requests FILE")
+    return workload
+
+
+def _print_statement_table(report):
+    columns = ("calls", "total_ms", "mean_ms", "max_ms", "rows", "hit%", "fingerprint",
+               "descriptors", "sql")
+    table = []
+    for row in report:
+        compiled = row["cache_hits"] + row["cache_misses"]
+        sql = " ".join(row["sql"].split())
+        table.append((
+            str(row["calls"]), "%.3f" % row["total_ms"], "%.3f" % row["mean_ms"],
+            "%.3f" % row["max_ms"], str(row["rows"]),
+            "%.0f" % (100.0 * row["cache_hits"] / compiled) if compiled else "-",
+            row["fingerprint"], ",".join(row["descriptors"]),
+            sql if len(sql) <= 80 else sql[:77] + "...",
+        ))
+    widths = [max([len(c)] + [len(r[i]) for r in table]) for i, c in enumerate(columns)]
+    for line in [columns] + table:
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip())
+
+
+def cmd_stats(ns):
+    workload = _stats_workload(ns)
+
+    def run(y):
+        failures = 0
+        for _ in range(max(ns.repeat, 1)):
+            for path, args, payload in workload:
+                try:
+                    y.query(path, args=args, payload=payload)
+                except Exception as e:
+                    failures += 1
+                    print("%s: %s" % (path, e), file=sys.stderr)
+        report = y.statement_stats(top=ns.top, sort=ns.sort)
+        if ns.json:
+            print(json.dumps(report, indent=2, default=str))
+        else:
+            _print_statement_table(report)
+        return failures
+
+    failures = _with_yaal(ns, run, statement_stats=True)
+    return 1 if failures else 0
+
+
+def cmd_bench(ns):
+    from yaal_bench import run_bench
+
+    try:
+        result = run_bench(
+            users=ns.users, roles=ns.roles, roles_per_user=ns.roles_per_user,
+            iterations=ns.iterations, warmup=ns.warmup, max_seconds=ns.max_seconds,
+            stage_iterations=ns.stage_iterations, memory_iterations=ns.memory_iterations,
+            descriptors=ns.only, db_file=ns.db_file, api=ns.api,
+            schema=ns.schema, progress=lambda path: print("bench %s" % path, file=sys.stderr),
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+    text = json.dumps(result, indent=2)
+    if ns.out:
+        with open(ns.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
 def main(argv=None):
     parser = _build_parser()
     ns = parser.parse_args(argv)
@@ -237,6 +479,8 @@ def main(argv=None):
         "compile": cmd_compile,
         "query": cmd_query,
         "explain": cmd_explain,
+        "stats": cmd_stats,
+        "bench": cmd_bench,
     }
     return handlers[ns.command](ns)
 
@@ -4,7 +4,7 @@
 
 from clickhouse_driver import Client
 
-from yaal_provider import fetch_mapped_rows
+from yaal_rows import RowSet
 
 
 _CONNECT_QUERY_KEYS = (
@@ -112,5 +112,4 @@ class ClickHouseDataProvider:
         column_names = [
             name.rsplit(".", 1)[-1] for name, _type in columns_with_types
         ]
-        rows = fetch_mapped_rows(rows_raw, column_names)
-        return rows, None
+        return RowSet(tuple(column_names), list(rows_raw)), None
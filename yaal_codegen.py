@@ -0,0 +1,165 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Generate a specialised Python row mapper per descriptor (Yaal(codegen=True)).
+
+generate_source turns a descriptor's output plan into module source with
+one function per branch: column positions are looked up once per RowSet
+and every row becomes a dict literal with its keys and slots spelled out,
+so no plan or model is interpreted per row. Inputs the fast path does not
+cover (row dict lists, sparse rows, $mode json documents, pass-through
+models) are handed to yaal_executor.map_output, which gives the same result.
+"""
+
+from yaal_executor import output_plan
+
+CODEGEN_VERSION = 1
+
+_HEADER = '''\
+# Generated by yaal codegen (version %d) for %s. Do not edit.
+
+from yaal_executor import _CONTAINER_TYPES, _copy_json, map_output
+from yaal_rows import RowSet
+
+PLAN = %r
+'''
+
+
+def _plan_nodes(plan, expr, nodes):
+    """Number plan nodes depth first: [(plan, expression that reaches it), ...]."""
+    nodes.append((plan, expr))
+    for idx, (_name, child) in enumerate(plan["branches"]):
+        _plan_nodes(child, "%s['branches'][%d][1]" % (expr, idx), nodes)
+    return nodes
+
+
+def _node_source(n, plan, child_ids):
+    """Source of _map_<n>(rs) for one plan node."""
+    fields = plan["fields"]
+    out = ["", "", "def _map_%d(rs):" % n]
+    if not any(column is not None for _key, column in fields):
+        # Pass-through rows: map_output's column copy is already the whole job.
+        out.append("    return map_output(_PLAN_%d, rs)" % n)
+        return out
+
+    is_object = plan["type"] == "object"
+    branch_ids = {}
+    for idx, (name, _child) in enumerate(plan["branches"]):
+        branch_ids.setdefault(name, idx)
+
+    out += [
+        "    if type(rs) is not RowSet or rs.columns is None or rs.sparse:",
+        "        return map_output(_PLAN_%d, rs)" % n,
+        "    rows = rs.rows",
+        "    if not rows:",
+        "        return %s" % ("{}" if is_object else "[]"),
+    ]
+    if plan["branches"]:
+        out.append("    children = rs.children")
+        for idx, (name, _child) in enumerate(plan["branches"]):
+            out.append("    c%d = children.get(%r)" % (idx, name))
+    out.append("    index = rs.index")
+
+    # Checks in property order, as map_output reports them.
+    values, slots, entries = [], [], []
+    for key, column in fields:
+        if column is None:
+            idx = branch_ids.get(key)
+            if idx is None:
+                out.append("    raise KeyError(%r)" % key)
+                return out
+            out += ["    if c%d is None:" % idx, "        raise KeyError(%r)" % key]
+            slots.append((idx, key))
+            entries.append("%r: _map_%d(t%d)" % (key, child_ids[idx], idx))
+        else:
+            v = len(values)
+            out += [
+                "    p%d = index.get(%r)" % (v, column),
+                "    if p%d is None:" % v,
+                "        raise Exception(%r)" % (column + " _mapped column missing from row"),
+            ]
+            values.append(v)
+            entries.append("%r: v%d" % (key, v))
+
+    slot_keys = {key for _idx, key in slots}
+    extra = [
+        (idx, name) for idx, (name, _child) in enumerate(plan["branches"])
+        if name not in slot_keys and branch_ids[name] == idx
+    ]
+
+    if is_object:
+        # Only the first row survives an object result.
+        out.append("    rows = rows[:1]")
+    out += ["    result = []", "    append = result.append"]
+    if slots or extra:
+        out.append("    for i, row in enumerate(rows):")
+    else:
+        out.append("    for row in rows:")
+    for v in values:
+        out += [
+            "        v%d = row[p%d]" % (v, v),
+            "        if type(v%d) in _CONTAINER_TYPES:" % v,
+            "            v%d = _copy_json(v%d)" % (v, v),
+        ]
+    for idx, key in slots:
+        out += [
+            "        t%d = c%d[i]" % (idx, idx),
+            "        if t%d is None:" % idx,
+            "            raise KeyError(%r)" % key,
+        ]
+    out.append("        obj = {%s}" % ", ".join(entries))
+    for idx, name in extra:
+        out += [
+            "        if c%d is not None:" % idx,
+            "            t%d = c%d[i]" % (idx, idx),
+            "            if t%d is not None:" % idx,
+            "                obj[%r] = _map_%d(t%d)" % (name, child_ids[idx], idx),
+        ]
+    out += ["        append(obj)"]
+    if is_object:
+        out.append("    return result[0]")
+    else:
+        out.append("    return result")
+    return out
+
+
+def generate_source(descriptor):
+    """Python source of a module whose map_result(rows) shapes this descriptor's rows."""
+    plan = output_plan(descriptor)
+    nodes = _plan_nodes(plan, "PLAN", [])
+    ids = {id(node): n for n, (node, _expr) in enumerate(nodes)}
+
+    lines = [_HEADER % (CODEGEN_VERSION, descriptor.get("path"), plan)]
+    lines += ["_PLAN_%d = %s" % (n, expr) for n, (_node, expr) in enumerate(nodes)]
+    for n, (node, _expr) in enumerate(nodes):
+        child_ids = [ids[id(child)] for _name, child in node["branches"]]
+        lines += _node_source(n, node, child_ids)
+    lines += ["", "", "def map_result(rs):", "    return _map_0(rs)", ""]
+    return "\n".join(lines)
+
+
+def load_source(source, filename="<yaal codegen>"):
+    """Compile generated source; returns (map_result, PLAN)."""
+    namespace = {}
+    exec(compile(source, filename, "exec"), namespace)
+    return namespace["map_result"], namespace["PLAN"]
+
+
+def attach_mapper(descriptor, source=None, filename="<yaal codegen>"):
+    """Set descriptor["_mapper"] to the generated mapper and return it.
+
+    source is previously generated text (yaal compile --codegen); it is
+    used only when it was generated from this descriptor's output plan,
+    otherwise fresh source is generated.
+    """
+    plan = output_plan(descriptor)
+    mapper = None
+    if source is not None:
+        mapper, source_plan = load_source(source, filename)
+        if source_plan != plan:
+            mapper = None
+    if mapper is None:
+        mapper, _plan = load_source(generate_source(descriptor), filename)
+    descriptor["_mapper"] = mapper
+    return mapper
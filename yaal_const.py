@@ -14,4 +14,5 @@ LENGTH = "$length"
 PARENT = "$parent"
 JSON = "$json"
 INDEX = "$index"
-MODE = "$mode"
\ No newline at end of file
+MODE = "$mode"
+PARENT_KEYS = "$parent_keys"
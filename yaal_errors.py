@@ -18,9 +18,25 @@ class PathEscapeError(YaalError):
     """Raised when a descriptor path resolves outside the API root."""
 
 
+class PartitionOrderError(YaalError):
+    """Raised when partition_strategy: merge sees rows out of partition_by order."""
+
+
+class FieldSelectionError(YaalError):
+    """Raised when a fields= selection names keys the output model does not have."""
+
+
 class SortDirError(YaalError):
     """Soft error: unknown or invalid sort()/dir() runtime value (no SQL execute)."""
 
     def __init__(self, message):
         super().__init__(message)
         self.message = message
+
+
+class MemoryBudgetError(YaalError):
+    """Soft error: a request buffered more rows than its memory_budget ceiling allows."""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
@@ -2,27 +2,98 @@
 # Use of this source code is governed by a MIT style
 # license that can be found in the LICENSE file.
 
-import copy
+import asyncio
+import contextlib
 import datetime
 import json
+import threading
+import time
 
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-from yaal_const import MODE
-from yaal_errors import SortDirError
+from yaal_cache import LRUCache
+from yaal_const import MODE, PARENT_KEYS
+from yaal_errors import MemoryBudgetError, PartitionOrderError, SortDirError
+from yaal_output_schema import build_output_plan
 from yaal_parser import compile_sql, resolve_sort_dir_values
+from yaal_provider import DEFAULT_FETCH_BATCH_SIZE
+from yaal_rows import MISSING, DeferredRows, RowSet, RowStream, _raw, as_row_set
+from yaal_spill import SpilledRows, estimate_bytes
+from yaal_trace import provider_name
+
+DEFAULT_VARIANT_CACHE_SIZE = 4096
+# Items per executemany call for batchable array branches (0 disables batching).
+DEFAULT_EXECUTEMANY_BATCH_SIZE = 500
+# Most {{$parent_keys}} values bound into one statement; longer lists run in chunks.
+MAX_PARENT_KEYS = 512
+# Most values bound into one statement (SQLite builds before 3.32 allow 999).
+MAX_BOUND_PARAMS = 999
+
+# Compiled SQL variants keyed by (twig, nulls, placeholder, sort_key), shared by
+# every helper in the process so steady-state traffic skips compile_sql.
+_variant_cache = LRUCache(DEFAULT_VARIANT_CACHE_SIZE)
+
+
+def get_variant_cache():
+    """Return the process-wide compiled-SQL variant cache."""
+    return _variant_cache
+
+
+def variant_cache_stats():
+    """Size, capacity and hit/miss/eviction counters of the variant cache."""
+    return _variant_cache.stats()
+
+
+def forget_variants(descriptors):
+    """Drop variant-cache entries compiled from the twigs of these descriptors.
+
+    Entries are keyed by twig identity and pin their twig, so a descriptor
+    that is reloaded or dropped would otherwise keep its variants alive
+    until the LRU evicts them. Returns how many entries were dropped.
+    """
+    twigs = {}
+
+    def walk(branch):
+        for twig in branch.get("twigs") or ():
+            twigs[id(twig)] = twig
+        for child in branch.get("branches") or ():
+            walk(child)
+
+    for descriptor in descriptors:
+        walk(descriptor)
+    if not twigs:
+        return 0
+    return _variant_cache.discard_if(lambda key, value: twigs.get(key[0]) is value[0])
 
 
 class DataProviderHelper:
 
-    def __init__(self):
+    def __init__(self, compile_cache=None):
         self._param_cache = {}
-        self._compile_cache = {}
+        self._compile_cache = _variant_cache if compile_cache is None else compile_cache
+        self._parent_keys = None
+        # yaal_trace.QueryTrace of a traced request, and the TwigTrace of the
+        # provider call in progress (built-in providers time fetching into it).
+        self.query_trace = None
+        self.trace = None
 
     def clear_cache(self):
-        """Clear bind-parameter cache (compile cache kept for the helper lifetime)."""
+        """Clear bind-parameter cache (the compile cache outlives the helper)."""
         self._param_cache = {}
 
+    def set_parent_keys(self, keys):
+        """Bind {{$parent_keys}} to keys (1..MAX_PARENT_KEYS values).
+
+        The list is padded with its last key to the next power of two, so a
+        handful of IN-list variants cover every page size.
+        """
+        keys = list(keys)
+        size = 1
+        while size < len(keys):
+            size *= 2
+        self._parent_keys = keys + [keys[-1]] * (size - len(keys))
+
     def get_executable_content(self, char, twig, input_shape):
         nulls = []
         if "nullable" in twig:
@@ -31,21 +102,35 @@ class DataProviderHelper:
                     nulls.append(n)
         sort_map = resolve_sort_dir_values(twig, input_shape)
         sort_key = tuple(sorted((p, v if v is not None else "") for p, v in sort_map.items()))
-        key = (id(twig), frozenset(nulls), char, sort_key)
+        list_sizes = None
+        if any(p["name"] == PARENT_KEYS for p in twig.get("parameters") or ()):
+            list_sizes = {PARENT_KEYS: len(self._parent_keys) if self._parent_keys else 1}
+        key = (id(twig), frozenset(nulls), char, sort_key, list_sizes and list_sizes[PARENT_KEYS])
+        if self.trace is not None:
+            self.trace.variant = (nulls, char, sort_map, list_sizes)
         cached = self._compile_cache.get(key)
-        if cached is not None:
+        # Entries pin their twig, so a matching id() always means the same twig.
+        if cached is not None and cached[0] is twig:
+            if self.trace is not None:
+                self.trace.sql = cached[1]
+                self.trace.cache_hit = True
             return {
-                "content": cached["content"],
-                "parameters": list(cached["parameters"]),
+                "content": cached[1],
+                "parameters": list(cached[2]),
             }
-        compiled = compile_sql(twig, nulls, char, sort_map=sort_map)
-        self._compile_cache[key] = {
-            "content": compiled["content"],
-            "parameters": list(compiled.get("parameters") or []),
-        }
+        if self.trace is not None:
+            started = time.perf_counter()
+            compiled = compile_sql(twig, nulls, char, sort_map=sort_map, list_sizes=list_sizes)
+            self.trace.add("compile", time.perf_counter() - started, started)
+            self.trace.sql = compiled["content"]
+            self.trace.cache_hit = False
+        else:
+            compiled = compile_sql(twig, nulls, char, sort_map=sort_map, list_sizes=list_sizes)
+        parameters = tuple(compiled.get("parameters") or [])
+        self._compile_cache.put(key, (twig, compiled["content"], parameters))
         return {
             "content": compiled["content"],
-            "parameters": list(compiled.get("parameters") or []),
+            "parameters": list(parameters),
         }
 
     def build_parameters(self, query, input_shape, get_value_converter):
@@ -57,7 +142,9 @@ class DataProviderHelper:
                 param_name = p["name"]
                 param_type = p["type"]
 
-                if param_name in _cache:
+                if param_name == PARENT_KEYS:
+                    param_value = self._parent_keys[p["index"]] if self._parent_keys else None
+                elif param_name in _cache:
                     param_value = _cache[param_name]
                 else:
                     param_value = input_shape.get_prop(param_name)
@@ -77,61 +164,304 @@ class DataProviderHelper:
                 except ValueError:
                     values.append(param_value)
 
+            if self.trace is not None:
+                self.trace.binds = ([p["name"] for p in parameters], values)
         return values
 
 
-def _execute_twigs(branch, data_providers, context, data_provider_helper):
-    errors = []
+def _apply_twig_output(output, context, rs):
+    """Apply one twig's rows (a RowSet) to the running branch result.
 
-    twigs = branch.get("twigs")
-    mode_str = MODE
+    Returns (rs, errors, final); final stops the twig list ($mode error, json
+    or break). Empty results and $mode=params rows leave rs unchanged.
+    """
     params_str, error_str, break_str = "params", "error", "break"
     json_str = "json"
 
-    rs = []
+    if len(output) >= 1:
+        mode_pos = output.index.get(MODE) if output.index is not None else None
+        mode_value = output.rows[0][mode_pos] if mode_pos is not None else MISSING
+        if mode_value is not MISSING:
+            if mode_value == error_str:
+                return None, output.dicts(), True
+            elif mode_value == json_str:
+                json_pos = output.index[json_str]
+                if type(output.rows[0][json_pos]) == str:
+                    json_list = [json.loads(row[json_pos]) for row in output.rows]
+                else:
+                    json_list = [row[json_pos] for row in output.rows]
+                return RowSet.from_dicts(json_list), None, True
+
+            elif mode_value == break_str:
+                return output.drop_column(MODE), None, True
+            elif mode_value == params_str:
+                params = context.get_prop("$params")
+                for k, v in output.first_row_items():
+                    params.set_prop(k, v)
+        else:
+            rs = output
+
+    return rs, None, False
+
+
+def _call_provider(execute, branch, idx, twig, context, data_provider_helper):
+    """execute(twig, context, helper), timed into the helper's query trace if any."""
+    query_trace = data_provider_helper.query_trace
+    if query_trace is None:
+        return execute(twig, context, data_provider_helper)
+    twig_trace = data_provider_helper.trace = query_trace.twig(
+        branch["method"], idx, twig, provider_name(execute)
+    )
+    try:
+        output, last_inserted_id = execute(twig, context, data_provider_helper)
+    finally:
+        data_provider_helper.trace = None
+    return twig_trace.finish(output), last_inserted_id
+
+
+def _execute_twigs(branch, data_providers, context, data_provider_helper):
+    twigs = branch.get("twigs")
+
+    rs = RowSet.empty()
     if twigs:
-        for twig in twigs:
+        for idx, twig in enumerate(twigs):
 
             connection = twig["connection"]
             try:
-                output, output_last_inserted_id = data_providers[connection].execute(
-                    twig, context, data_provider_helper
+                output, output_last_inserted_id = _call_provider(
+                    data_providers[connection].execute, branch, idx, twig, context,
+                    data_provider_helper,
                 )
             except SortDirError as e:
                 return None, [{"message": e.message}]
 
             context.get_prop("$params").set_prop("$last_inserted_id", output_last_inserted_id)
 
-            if len(output) >= 1:
-                output0 = output[0]
-                if mode_str in output0:
-                    mode_value = output0[mode_str]
-                    if mode_value == error_str:
-                        errors.extend(output)
-                        return None, errors
-                    elif mode_value == json_str:
-                        json_list = []
-                        if type(output0[json_str]) == str:
-                            for o in output:
-                                json_list.append(json.loads(o[json_str]))
-                        else:
-                            json_list.extend([o[json_str] for o in output])
-                        return json_list, None
-
-                    elif mode_value == break_str:
-                        for o in output:
-                            del o[mode_str]
-                        return output, None
-                    elif mode_value == params_str:
-                        params = context.get_prop("$params")
-                        for k, v in output0.items():
-                            params.set_prop(k, v)
-                else:
-                    rs = output
+            rs, errors, final = _apply_twig_output(as_row_set(output), context, rs)
+            if final:
+                return rs, errors
+
+    return rs, None
+
+
+def _prepend(first, rows):
+    try:
+        yield first
+        yield from rows
+    finally:
+        close = getattr(rows, "close", None)
+        if close is not None:
+            close()
+
+
+def _peek_stream(output):
+    """Split an execute_iter result into (first, stream) without reading further.
+
+    Returns (None, None) when there are no rows; stream is a RowStream that
+    still yields first, or a drained RowSet when the rows start with $mode.
+    """
+    if isinstance(output, RowSet):
+        if not len(output):
+            return None, None
+        return output, output
+    if isinstance(output, RowStream):
+        rows = iter(output.rows)
+        first = next(rows, _NO_KEY)
+        if first is _NO_KEY:
+            output.close()
+            return None, None
+        if MODE in output.index:
+            return first, RowSet(output.columns, [first] + list(rows), index=output.index)
+        return first, RowStream(output.columns, _prepend(first, rows))
+    rows = iter(output)
+    first = next(rows, _NO_KEY)
+    if first is _NO_KEY:
+        return None, None
+    if MODE in first:
+        return first, as_row_set([first] + list(rows))
+    return first, RowStream.from_dicts(first, rows)
+
+
+def _execute_twigs_iter(branch, data_providers, context, data_provider_helper):
+    """Like _execute_twigs, but the last twig's rows can come back as a RowStream.
+
+    Earlier twigs run as usual. The last twig is executed eagerly through the
+    provider's execute_iter (when it has one) and its first row is peeked: a
+    $mode row is drained and handled like _execute_twigs, anything else is
+    returned unread so the caller can stream it.
+    """
+    twigs = branch.get("twigs") or []
+    last_idx = len(twigs) - 1
+
+    rs = RowSet.empty()
+    for idx, twig in enumerate(twigs):
+        data_provider = data_providers[twig["connection"]]
+        stream = idx == last_idx and hasattr(data_provider, "execute_iter")
+        try:
+            execute = data_provider.execute_iter if stream else data_provider.execute
+            output, output_last_inserted_id = _call_provider(
+                execute, branch, idx, twig, context, data_provider_helper
+            )
+        except SortDirError as e:
+            return None, [{"message": e.message}]
+
+        context.get_prop("$params").set_prop("$last_inserted_id", output_last_inserted_id)
+
+        if stream:
+            first, output = _peek_stream(output)
+            if first is None:
+                return rs, None
+            if isinstance(output, RowStream):
+                return output, None
+
+        rs, errors, final = _apply_twig_output(as_row_set(output), context, rs)
+        if final:
+            return rs, errors
 
     return rs, None
 
 
+_NO_KEY = object()
+
+
+def _check_ascending(prev_key, key, partition_by, side, nulls=None):
+    """Check that key may follow prev_key on one side of a merge.
+
+    NULL keys form one group that sorts either first (SQLite, MySQL) or last
+    (Postgres). nulls records which, once seen: None, "first" or "last";
+    pass prev_key=_NO_KEY for the first group. Returns the updated nulls.
+    """
+    if prev_key is _NO_KEY:
+        return "first" if key is None else nulls
+    if prev_key is None or key is None:
+        if key is None and nulls is None:
+            return "last"
+        if prev_key is None and nulls == "first":
+            return nulls
+        raise PartitionOrderError(
+            "partition_strategy merge: %s rows with a NULL '%s' must sort all first or all "
+            "last (%r after %r)" % (side, partition_by, key, prev_key)
+        )
+    try:
+        descending = key < prev_key
+    except TypeError:
+        raise PartitionOrderError(
+            "partition_strategy merge: cannot order %s partition_by '%s' values %r and %r"
+            % (side, partition_by, prev_key, key)
+        )
+    if descending:
+        raise PartitionOrderError(
+            "partition_strategy merge: %s rows are not ordered by '%s' (%r after %r); "
+            "add ORDER BY %s to the %s SQL"
+            % (side, partition_by, key, prev_key, partition_by, side)
+        )
+    return nulls
+
+
+def _key_before(key, other):
+    try:
+        return key < other
+    except TypeError:
+        raise PartitionOrderError(
+            "partition_strategy merge: cannot compare partition keys %r and %r"
+            % (key, other)
+        )
+
+
+def _consecutive_groups(keyed, partition_by):
+    """Yield (key, items) runs of parent (key, item) pairs ordered by partition_by."""
+    group = None
+    prev_key = _NO_KEY
+    nulls = None
+    for key, item in keyed:
+        if prev_key is not _NO_KEY and key == prev_key:
+            group.append(item)
+            continue
+        nulls = _check_ascending(prev_key, key, partition_by, "parent", nulls)
+        if prev_key is not _NO_KEY:
+            yield prev_key, group
+        prev_key = key
+        group = [item]
+    if group is not None:
+        yield prev_key, group
+
+
+class _GroupCursor:
+    """Walk child (key, item) pairs ordered by partition_by, one key's group at a time."""
+
+    def __init__(self, keyed, partition_by):
+        self._keyed = iter(keyed)
+        self._partition_by = partition_by
+        self._prev_key = _NO_KEY
+        self._item = _NO_KEY
+        self._nulls = None
+        self._taken = False
+        self._advance()
+
+    def _advance(self):
+        pair = next(self._keyed, _NO_KEY)
+        if pair is _NO_KEY:
+            self._item = _NO_KEY
+            return
+        key, self._item = pair
+        if self._prev_key is _NO_KEY or key != self._prev_key:
+            self._nulls = _check_ascending(
+                self._prev_key, key, self._partition_by, "child", self._nulls
+            )
+        self._prev_key = key
+
+    def _before(self, child_key, key):
+        if child_key is None:
+            return self._nulls == "first"
+        if key is None:
+            # A NULL parent group after earlier parents sorts last: the rest are orphans.
+            return self._taken
+        return _key_before(child_key, key)
+
+    def take(self, key):
+        """Return the child items for key, dropping orphans that sort before it."""
+        group = []
+        while self._item is not _NO_KEY:
+            child_key = self._prev_key
+            if child_key == key:
+                group.append(self._item)
+            elif not self._before(child_key, key):
+                break
+            self._advance()
+        self._taken = True
+        return group
+
+    def drain(self):
+        """Consume trailing rows so order violations still fail loudly."""
+        while self._item is not _NO_KEY:
+            self._advance()
+
+
+def _keyed_positions(rows, partition_by, side):
+    return zip(rows.column(partition_by, side), range(len(rows)))
+
+
+def _merge_partitions(parent_rows, child_rows, partition_by, branch_name):
+    """Stitch parent and child RowSets that both arrive ordered by partition_by.
+
+    Returns each distinct parent (first row per key, like the hash strategy)
+    with its child group attached. Child rows without a parent are dropped.
+    Raises PartitionOrderError when either side is not in ascending
+    partition_by order.
+    """
+    children = _GroupCursor(_keyed_positions(child_rows, partition_by, "child"), partition_by)
+    firsts, groups = [], []
+    for key, positions in _consecutive_groups(
+        _keyed_positions(parent_rows, partition_by, "parent"), partition_by
+    ):
+        firsts.append(positions[0])
+        groups.append(child_rows.take(children.take(key)))
+    children.drain()
+    output = parent_rows.take(firsts)
+    output.attach(branch_name, groups)
+    return output
+
+
 def _trunk_cleanup(data_providers, db_data_provider, failed):
     if failed:
         try:
@@ -152,88 +482,382 @@ def _trunk_cleanup(data_providers, db_data_provider, failed):
             data_provider.end()
 
 
-def _execute_branch(branch, is_trunk, data_providers, context, parent_rows):
-    input_type, output_partition_by = branch["input_type"], branch.get("partition_by")
-    use_parent_rows = branch.get("use_parent_rows")
-    output = []
+def _branch_shape(context, branch_name):
+    """Input shape for a child branch: its nested payload object, else the parent's."""
+    if context:
+        nested = context.get_prop(branch_name.lower())
+        if nested is not None:
+            return nested
+    return context
+
+
+def _can_batch(branch, data_providers, length):
+    if length < 2:
+        return False
+    for twig in branch.get("twigs") or []:
+        if not twig.get("batchable"):
+            return False
+        if not hasattr(data_providers[twig["connection"]], "execute_many"):
+            return False
+    return True
+
+
+def _execute_twigs_many(branch, data_providers, context, length, batch_size, trace=None):
+    """Array input whose twigs are all batchable: one executemany per twig and chunk.
+
+    Twigs run in order over all items (twig-major); they return no rows, so
+    the branch result is empty exactly as with per-item execution.
+    """
     data_provider_helper = DataProviderHelper()
+    data_provider_helper.query_trace = trace
+    item_shapes = [context.get_prop("@" + str(i)) for i in range(0, length)]
+    params = context.get_prop("$params")
+    for idx, twig in enumerate(branch["twigs"]):
+        data_provider = data_providers[twig["connection"]]
+        for start in range(0, length, batch_size):
+            try:
+                _rows, last_inserted_id = _call_provider(
+                    data_provider.execute_many, branch, idx, twig,
+                    item_shapes[start:start + batch_size], data_provider_helper,
+                )
+            except SortDirError as e:
+                return None, [{"message": e.message}]
+            params.set_prop("$last_inserted_id", last_inserted_id)
+    return RowSet.empty(), None
+
+
+def _hold_budgeted(branch, rows, budget):
+    """Charge a read RowSet to the budget; returns it, or a SpilledRows when it spills."""
+    spill_key = branch.get("spill_key")
+    nbytes = budget.charge(rows.rows)
+    if not (spill_key and len(rows) and rows.columns is not None and not rows.sparse
+            and not rows.children and budget.should_spill()):
+        return rows
+    store = budget.spill_store(rows.columns, spill_key)
+    store.add(rows.rows)
+    budget.release(len(rows), nbytes)
+    store.finish()
+    return store
+
+
+def _read_budgeted(branch, data_providers, context, data_provider_helper, budget):
+    """_execute_twigs for a request with a memory budget (a yaal_spill.RequestBudget).
+
+    Rows are charged a batch at a time as they are read, so the ceiling
+    stops a large read part way. A branch with a spill_key moves its rows
+    to a SpilledRows store once the budget's spill threshold is passed.
+    """
+    rows, errors = _execute_twigs_iter(branch, data_providers, context, data_provider_helper)
+    if errors:
+        return None, errors
+    if isinstance(rows, RowSet):
+        return _hold_budgeted(branch, rows, budget), None
+
+    spill_key = branch.get("spill_key")
+    kept, held, store = [], 0, None
+    try:
+        for chunk in _chunks(rows.rows, budget.limits.batch_size):
+            if store is not None:
+                budget.charge(chunk, held=False)
+                store.add(chunk)
+                continue
+            held += budget.charge(chunk)
+            kept.extend(chunk)
+            if spill_key and budget.should_spill():
+                store = budget.spill_store(rows.columns, spill_key)
+                store.add(kept)
+                budget.release(len(kept), held)
+                kept = None
+    finally:
+        rows.close()
+    if store is not None:
+        store.finish()
+        return store, None
+    return RowSet(rows.columns, kept, index=rows.index), None
+
+
+def _execute_branch_rows(branch, data_providers, context,
+                         batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, parent_keys=None,
+                         budget=None, trace=None):
+    """Run a branch's own twigs (once per item for array input) -> (rows, errors).
+
+    With a memory budget, rows may come back as a yaal_spill.SpilledRows.
+    """
+    if trace is None:
+        return _run_branch_rows(branch, data_providers, context, batch_size, parent_keys, budget)
+    started = time.perf_counter()
+    output, errors = _run_branch_rows(
+        branch, data_providers, context, batch_size, parent_keys, budget, trace
+    )
+    trace.branch(branch["method"], time.perf_counter() - started, output, started)
+    return output, errors
+
+
+def _run_branch_rows(branch, data_providers, context, batch_size, parent_keys, budget,
+                     trace=None):
+    data_provider_helper = DataProviderHelper()
+    data_provider_helper.query_trace = trace
+    if parent_keys is not None:
+        data_provider_helper.set_parent_keys(parent_keys)
+    input_type = branch["input_type"]
+    output = RowSet.empty()
+
+    if input_type == "array":
+        length = int(context.get_prop("$length"))
+        if batch_size and _can_batch(branch, data_providers, length):
+            return _execute_twigs_many(branch, data_providers, context, length, batch_size, trace)
+        parts = []
+        for i in range(0, length):
+            data_provider_helper.clear_cache()
+            item_ctx = context.get_prop("@" + str(i))
+            rs, errors = _execute_twigs(branch, data_providers, item_ctx, data_provider_helper)
+            if errors:
+                return None, errors
+            if budget is not None:
+                budget.charge(rs.rows)
+            parts.append(rs)
+        output = RowSet.concat(parts)
+
+    elif input_type == "object":
+        if budget is not None:
+            output, errors = _read_budgeted(
+                branch, data_providers, context, data_provider_helper, budget
+            )
+        else:
+            output, errors = _execute_twigs(branch, data_providers, context, data_provider_helper)
+        if errors:
+            return None, errors
+
+    return output, None
+
+
+def _parent_key_values(parent_rows, key):
+    """Distinct non-null values of the parent's partition_by column, in row order."""
+    seen = set()
+    keys = []
+    for value in parent_rows.column(key, "parent"):
+        if value is None or value in seen:
+            continue
+        seen.add(value)
+        keys.append(value)
+    return keys
+
+
+def _parent_key_chunk(branch):
+    """Keys per statement: a power of two that keeps every twig within MAX_BOUND_PARAMS."""
+    size = MAX_PARENT_KEYS
+    for twig in branch.get("twigs") or ():
+        names = [t["name"] for t in twig["content"] if t["type"] == "parameter"]
+        lists = names.count(PARENT_KEYS)
+        if lists:
+            room = (MAX_BOUND_PARAMS - (len(names) - lists)) // lists
+            while size > 1 and size > room:
+                size //= 2
+    return size
+
+
+def _execute_branch_rows_by_keys(branch, data_providers, context, parent_rows,
+                                 batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, budget=None,
+                                 trace=None):
+    """Run a {{$parent_keys}} branch for its parent's keys; no keys means no query."""
+    keys = _parent_key_values(parent_rows, branch["parent_key"])
+    chunk = _parent_key_chunk(branch)
+    parts = []
+    for start in range(0, len(keys), chunk):
+        rows, errors = _execute_branch_rows(
+            branch, data_providers, context, batch_size, keys[start:start + chunk],
+            budget, trace,
+        )
+        if errors:
+            return None, errors
+        parts.append(rows)
+    return RowSet.concat(parts), None
+
+
+def _scheduled_nodes(trunk, context):
+    """Return (nodes, deferred).
+
+    nodes are (branch, input shape) for every SQL-running branch that can
+    start without its parent's rows, in sequential order; deferred holds the
+    methods of {{$parent_keys}} branches, which run while stitching.
+    """
+    nodes, deferred = [], set()
+
+    def walk(branch, shape):
+        if branch.get("twigs") and not branch.get("use_parent_rows"):
+            if branch.get("parent_key"):
+                deferred.add(branch["method"])
+            else:
+                nodes.append((branch, shape))
+        for child in branch.get("branches") or []:
+            walk(child, _branch_shape(shape, child["name"]))
+
+    walk(trunk, context)
+    return nodes, deferred
+
+
+def _prefetch_branches(trunk, data_providers, context, max_workers,
+                       batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, budget=None, trace=None):
+    """Run independent branches' SQL concurrently, honouring the builder's depends_on.
+
+    Returns {method: (rows, errors, exception)} for _execute_branch to stitch
+    in the usual order, or None when there is nothing to overlap (or the
+    descriptor predates dependency annotations). Each connection is used by
+    one branch at a time. After a failure no branch later in sequential order
+    is started, so the stitch pass reports the same first failure a
+    sequential run would.
+    """
+    nodes, deferred = _scheduled_nodes(trunk, context)
+    if len(nodes) < 2 or any("depends_on" not in branch for branch, _shape in nodes):
+        return None
+    # Deferred branches run after every prefetched one; give up if that breaks an edge.
+    if any(deferred.intersection(branch["depends_on"]) for branch, _shape in nodes):
+        return None
+
+    locks = {name: threading.Lock() for name in data_providers}
+
+    def run(branch, shape):
+        names = sorted({twig["connection"] for twig in branch["twigs"]})
+        for name in names:
+            locks[name].acquire()
+        try:
+            return _execute_branch_rows(branch, data_providers, shape, batch_size,
+                                        budget=budget, trace=trace)
+        finally:
+            for name in reversed(names):
+                locks[name].release()
+
+    order = {branch["method"]: idx for idx, (branch, _shape) in enumerate(nodes)}
+    results = {}
+    pending = list(nodes)
+    running = {}
+    stop_at = len(nodes)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for node in list(pending):
+                branch, shape = node
+                if order[branch["method"]] >= stop_at:
+                    pending.remove(node)
+                elif all(dep in results for dep in branch["depends_on"]):
+                    pending.remove(node)
+                    running[pool.submit(run, branch, shape)] = branch["method"]
+            if not running:
+                break
+            done, _not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                method = running.pop(future)
+                try:
+                    rows, errors = future.result()
+                    results[method] = (rows, errors, None)
+                except Exception as e:
+                    errors = None
+                    results[method] = (None, None, e)
+                if errors or results[method][2] is not None:
+                    stop_at = min(stop_at, order[method])
+
+    return results
+
+
+def _attach_child(branch, output, branch_name, sub_node_output):
+    """Stitch one child branch's RowSet onto the branch's RowSet; returns the new RowSet."""
+    output_partition_by = branch.get("partition_by")
+
+    if not branch.get("twigs") and not branch.get("use_parent_rows") and not len(output):
+        output = RowSet((), [()])
+
+    # Child rows are shared, not copied, per parent: _output_mapper
+    # builds fresh containers, so callers never observe aliasing.
+    if not output_partition_by:
+        output.attach(branch_name, [sub_node_output] * len(output))
+        return output
+
+    # Spilled under a memory budget: groups are looked up by key, whatever the strategy.
+    spilled = isinstance(sub_node_output, SpilledRows)
+
+    if branch.get("partition_strategy") == "merge" and not spilled:
+        return _merge_partitions(output, sub_node_output, output_partition_by, branch_name)
+
+    # First row per partition key, in first-seen order.
+    firsts = {}
+    for pos, key in enumerate(output.column(output_partition_by, "parent")):
+        if key not in firsts:
+            firsts[key] = pos
+
+    _output = output.take(list(firsts.values()))
+    if spilled:
+        # Each group is read back from disk when the output mapper reaches it.
+        _output.attach(branch_name, [sub_node_output.group(key) for key in firsts])
+        return _output
+
+    sub_node_groups = defaultdict(list)
+    for pos, key in enumerate(sub_node_output.column(output_partition_by, "child")):
+        sub_node_groups[key].append(pos)
+
+    empty = RowSet.empty()
+    _output.attach(branch_name, [
+        sub_node_output.take(sub_node_groups[key]) if key in sub_node_groups else empty
+        for key in firsts
+    ])
+    return _output
+
+
+def _execute_branch(branch, is_trunk, data_providers, context, parent_rows,
+                    prefetched=None, max_workers=None, batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE,
+                    budget=None, trace=None):
+    use_parent_rows = branch.get("use_parent_rows")
+    output = RowSet.empty()
     db_data_provider = data_providers["db"]
     began = False
     failed = False
 
     try:
         if use_parent_rows:
-            output = copy.deepcopy(parent_rows)
+            # Row tuples are shared; this branch attaches children to its own copy.
+            output = as_row_set(parent_rows).copy()
         else:
             if is_trunk:
                 for name, data_provider in data_providers.items():
                     data_provider.begin()
                 began = True
+                if max_workers and max_workers > 1:
+                    prefetched = _prefetch_branches(
+                        branch, data_providers, context, max_workers, batch_size, budget, trace
+                    )
 
-            if input_type == "array":
-                length = int(context.get_prop("$length"))
-                for i in range(0, length):
-                    data_provider_helper.clear_cache()
-                    item_ctx = context.get_prop("@" + str(i))
-                    rs, errors = _execute_twigs(branch, data_providers, item_ctx, data_provider_helper)
-                    if errors:
-                        failed = True
-                        return None, errors
-                    output.extend(rs)
-
-            elif input_type == "object":
-                output, errors = _execute_twigs(branch, data_providers, context, data_provider_helper)
-                if errors:
-                    failed = True
-                    return None, errors
+            if prefetched is not None and branch["method"] in prefetched:
+                output, errors, exception = prefetched[branch["method"]]
+                if exception is not None:
+                    raise exception
+            elif branch.get("parent_key"):
+                output, errors = _execute_branch_rows_by_keys(
+                    branch, data_providers, context, parent_rows, batch_size, budget, trace
+                )
+            else:
+                output, errors = _execute_branch_rows(
+                    branch, data_providers, context, batch_size, budget=budget, trace=trace
+                )
+            if errors:
+                failed = True
+                return None, errors
 
         branches = branch.get("branches")
         if branches:
             for branch_descriptor in branches:
                 branch_name = branch_descriptor["name"]
-                sub_node_shape = context
-                if context:
-                    nested = context.get_prop(branch_name.lower())
-                    if nested is not None:
-                        sub_node_shape = nested
+                sub_node_shape = _branch_shape(context, branch_name)
 
                 sub_node_output, errors = _execute_branch(
-                    branch_descriptor, False, data_providers, sub_node_shape, output
+                    branch_descriptor, False, data_providers, sub_node_shape, output, prefetched,
+                    batch_size=batch_size, budget=budget, trace=trace,
                 )
                 if errors:
                     failed = True
                     return None, errors
 
-                if not branch.get("twigs") and not use_parent_rows and not output:
-                    output.append({})
-
-                if not output_partition_by:
-                    for row in output:
-                        row[branch_name] = copy.deepcopy(sub_node_output)
-                else:
-                    sub_node_groups = defaultdict(list)
-                    for row in sub_node_output:
-                        if output_partition_by not in row:
-                            raise KeyError(
-                                "partition_by column '%s' missing from child row" % output_partition_by
-                            )
-                        sub_node_groups[row[output_partition_by]].append(row)
-
-                    groups = defaultdict(list)
-                    for row in output:
-                        if output_partition_by not in row:
-                            raise KeyError(
-                                "partition_by column '%s' missing from parent row" % output_partition_by
-                            )
-                        groups[row[output_partition_by]].append(row)
-
-                    _output = []
-                    for idx, rows in groups.items():
-                        row = rows[0]
-                        partition_key = row[output_partition_by]
-                        row[branch_name] = copy.deepcopy(sub_node_groups.get(partition_key, []))
-                        _output.append(row)
-                    output = _output
+                output = _timed(
+                    trace, "stitch", _attach_child, branch, output, branch_name, sub_node_output
+                )
 
         return output, None
 
@@ -245,78 +869,137 @@ def _execute_branch(branch, is_trunk, data_providers, context, parent_rows):
             _trunk_cleanup(data_providers, db_data_provider, failed)
 
 
-def _output_mapper(output_type, output_modal, branches, result):
-    from yaal_output_schema import normalize_output_model
+_CONTAINER_TYPES = (dict, list)
 
-    mapped_result = []
 
-    _type_str, _mapped_str = "type", "mapped"
+def _copy_json(value):
+    """Copy dict/list containers so mapped output never shares them; scalars pass through."""
+    value_type = type(value)
+    if value_type is dict:
+        return {k: _copy_json(v) for k, v in value.items()}
+    if value_type is list:
+        return [_copy_json(v) for v in value]
+    return value
 
-    output_model = normalize_output_model(output_modal) if output_modal else output_modal
-    if output_model and "properties" in output_model:
-        output_properties = output_model["properties"]
-    else:
-        output_properties = None
 
-    if output_model and "type" in output_model:
-        output_type = output_model["type"]
+def output_plan(descriptor):
+    """The descriptor's output plan, built (once) when the builder did not store one."""
+    plan = descriptor.get("output_plan")
+    if plan is None:
+        plan = build_output_plan(
+            descriptor["output_type"], descriptor["model"]["output"], descriptor.get("branches")
+        )
+        descriptor["output_plan"] = plan
+    return plan
 
-    for row in result:
-        mapped_obj = {}
-        mapped_tree = {}
-        if branches:
-            for branch_descriptor in branches:
-
-                branch_name = branch_descriptor["name"]
-                branch_output_type = branch_descriptor["output_type"]
-
-                if output_properties and branch_name in output_properties:
-                    branch_output_model = output_properties[branch_name]
-                else:
-                    branch_output_model = None
-
-                branch_descriptor_branches = branch_descriptor.get("branches")
-
-                if branch_name in row:
-                    mapped_tree[branch_name] = _output_mapper(
-                        branch_output_type,
-                        branch_output_model,
-                        branch_descriptor_branches,
-                        row[branch_name],
-                    )
-
-        if output_properties:
-            prop_count = 0
-            for k, v in output_properties.items():
-                _mapped, _type = None, None
-
-                if type(v) == str:
-                    _mapped = v
-                if type(v) == dict:
-                    _mapped = v.get(_mapped_str)
-                    _type = v.get(_type_str)
-
-                if _mapped:
-                    if _mapped in row:
-                        mapped_obj[k] = row[_mapped]
-                        prop_count = prop_count + 1
-                    else:
-                        raise Exception(_mapped + " _mapped column missing from row")
-
-                if _type and (_type == "array" or _type == "object"):
-                    mapped_obj[k] = mapped_tree[k]
-
-            if prop_count == 0:
-                mapped_obj = row
-        else:
-            mapped_obj = row
 
-        for k, v in mapped_tree.items():
-            mapped_obj[k] = v
+def _map_result(descriptor, result):
+    """Shape trunk rows with the descriptor's generated mapper (codegen) or its plan."""
+    mapper = descriptor.get("_mapper")
+    if mapper is not None:
+        return mapper(result)
+    return map_output(output_plan(descriptor), result)
 
-        mapped_result.append(mapped_obj)
 
-    if output_type == "object":
+def _output_mapper(output_type, output_modal, branches, result):
+    """Shape executor rows with a plan built from an output model (see map_output)."""
+    return map_output(build_output_plan(output_type, output_modal, branches), result)
+
+
+def map_output(plan, result):
+    """Shape executor rows (a RowSet, or a list of row dicts) into fresh output objects.
+
+    plan comes from yaal_output_schema.build_output_plan. Column positions
+    are resolved once per RowSet and each row tuple becomes exactly one dict
+    here. Rows (and child groups attached to them) may be shared between
+    parents; the mapper never mutates them and every container it returns
+    is new.
+    """
+    if isinstance(result, DeferredRows):
+        result = result.load()
+    elif not isinstance(result, RowSet):
+        result = RowSet.from_dicts(result, [name for name, _plan in plan["branches"]])
+
+    rows = result.rows
+    if result.columns is None:
+        # $mode json values that are not all objects pass through as documents.
+        mapped_result = [_copy_json(value) for value in rows]
+    elif not rows:
+        mapped_result = []
+    else:
+        children = result.children
+        trees = {}
+        for branch_name, branch_plan in plan["branches"]:
+            values = children.get(branch_name)
+            if values is not None:
+                trees[branch_name] = [
+                    _NO_KEY if value is None else map_output(branch_plan, value)
+                    for value in values
+                ]
+
+        # (key, column position) per mapped property and (key, None) per nested one.
+        index = result.index
+        fields = []
+        prop_count = 0
+        for k, column in plan["fields"]:
+            if column is None:
+                if k not in trees:
+                    raise KeyError(k)
+                fields.append((k, None))
+            else:
+                if column not in index:
+                    raise Exception(column + " _mapped column missing from row")
+                fields.append((k, index[column]))
+                prop_count = prop_count + 1
+
+        columns = result.columns
+        sparse = result.sparse
+        raw_children = [name for name in children if name not in trees]
+        keep = plan.get("keep")
+        if keep is not None:
+            # fields= on a pass-through model: only the selected columns and children.
+            keep = set(keep)
+            raw_children = [name for name in raw_children if name in keep]
+        mapped_result = []
+        for i, row in enumerate(rows):
+            mapped_tree = {}
+            for name, mapped in trees.items():
+                value = mapped[i]
+                if value is not _NO_KEY:
+                    mapped_tree[name] = value
+
+            if prop_count:
+                mapped_obj = {}
+                for k, pos in fields:
+                    if pos is None:
+                        mapped_obj[k] = mapped_tree[k]
+                        continue
+                    value = row[pos]
+                    if type(value) in _CONTAINER_TYPES:
+                        value = _copy_json(value)
+                    elif value is MISSING:
+                        raise Exception(columns[pos] + " _mapped column missing from row")
+                    mapped_obj[k] = value
+            else:
+                # Pass-through row: copy it, with child groups mapped (raw when unlisted).
+                mapped_obj = {}
+                for k, value in zip(columns, row):
+                    if keep is not None and k not in keep:
+                        continue
+                    if type(value) in _CONTAINER_TYPES:
+                        value = _copy_json(value)
+                    elif sparse and value is MISSING:
+                        continue
+                    mapped_obj[k] = value
+                for name in raw_children:
+                    mapped_obj[name] = _copy_json(_raw(children[name][i]))
+
+            for k, v in mapped_tree.items():
+                mapped_obj[k] = v
+
+            mapped_result.append(mapped_obj)
+
+    if plan["type"] == "object":
         if len(mapped_result) > 0:
             mapped_result = mapped_result[0]
         else:
@@ -324,28 +1007,335 @@ def _output_mapper(output_type, output_modal, branches, result):
     return mapped_result
 
 
-def _get_result(descriptor, get_data_provider, ctx):
+def _validate_context(ctx):
     errors = []
     args_shape = ctx.get_prop("$args")
     if args_shape is not None:
         errors.extend(args_shape.validate(True))
     errors.extend(ctx.validate(False))
+    return errors
 
-    if errors:
-        return {"errors": errors}
 
+def _get_data_providers(descriptor, get_data_provider):
     data_providers = {}
     for con in descriptor["connections"]:
         data_providers[con] = get_data_provider(con)
+    return data_providers
+
+
+def _timed(trace, stage, fn, *args):
+    if trace is None:
+        return fn(*args)
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        trace.add(stage, time.perf_counter() - started, started)
 
-    rs, errors = _execute_branch(descriptor, True, data_providers, ctx, [])
 
+def _get_result(descriptor, get_data_provider, ctx, max_branch_workers=None,
+                executemany_batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, memory_budget=None,
+                trace=None):
+    errors = _timed(trace, "validate", _validate_context, ctx)
     if errors:
         return {"errors": errors}
 
-    rs = _output_mapper(descriptor["output_type"], descriptor["model"]["output"], descriptor.get("branches"), rs)
+    data_providers = _get_data_providers(descriptor, get_data_provider)
+
+    budget = memory_budget.start() if memory_budget is not None else None
+    try:
+        rs, errors = _execute_branch(
+            descriptor, True, data_providers, ctx, RowSet.empty(), max_workers=max_branch_workers,
+            batch_size=executemany_batch_size, budget=budget, trace=trace,
+        )
+
+        if errors:
+            return {"errors": errors}
+
+        return _timed(trace, "map", _map_result, descriptor, rs)
+    except MemoryBudgetError as e:
+        return {"errors": [{"message": e.message}]}
+    finally:
+        if budget is not None:
+            budget.close()
+
+
+def _has_twigs(branch):
+    if branch.get("twigs"):
+        return True
+    return any(_has_twigs(b) for b in branch.get("branches") or [])
+
+
+def _can_stream(descriptor):
+    """Trunk rows can be streamed when each top-level item needs one run of rows.
+
+    That is an array-output, object-input trunk with its own SQL that is either
+    unpartitioned or partitioned with the merge strategy, whose parent_rows
+    children carry no SQL of their own (they are rebuilt per parent group) and
+    whose children do not bind {{$parent_keys}} (that needs every trunk row).
+    """
+    if descriptor["output_type"] != "array" or descriptor["input_type"] != "object":
+        return False
+    if not descriptor.get("twigs"):
+        return False
+    if descriptor.get("partition_by") and descriptor.get("partition_strategy") != "merge":
+        return False
+    for branch in descriptor.get("branches") or []:
+        if branch.get("use_parent_rows") and _has_twigs(branch):
+            return False
+        if branch.get("parent_key"):
+            return False
+    return True
+
+
+def _stream_trunk_rows(descriptor, data_providers, context, batch_size, budget=None,
+                       trace=None):
+    """Return (chunks, errors): RowSets of up to batch_size trunk rows with children attached.
+
+    Chunks are produced lazily when the descriptor can stream. Child branches
+    without parent_rows run once, before the first trunk row is read;
+    parent_rows children are rebuilt for each parent group as it streams.
+    Streamed trunk rows are never buffered, so a memory budget only counts
+    the children's rows.
+    """
+    if not _can_stream(descriptor):
+        rs, errors = _execute_branch(
+            descriptor, False, data_providers, context, RowSet.empty(), budget=budget, trace=trace
+        )
+        if errors:
+            return None, errors
+        return _slices(rs, batch_size), None
+
+    helper = DataProviderHelper()
+    helper.query_trace = trace
+    started = time.perf_counter()
+    rows, errors = _execute_twigs_iter(descriptor, data_providers, context, helper)
+    if errors:
+        return None, errors
+    if trace is not None:
+        rows = _traced_trunk_rows(trace, descriptor["method"], rows, started)
+
+    children = []
+    for branch in descriptor.get("branches") or []:
+        branch_shape = _branch_shape(context, branch["name"])
+        if branch.get("use_parent_rows"):
+            children.append((branch, branch_shape, None))
+            continue
+        output, errors = _execute_branch(
+            branch, False, data_providers, branch_shape, RowSet.empty(), budget=budget, trace=trace
+        )
+        if errors:
+            return None, errors
+        children.append((branch, branch_shape, output))
+
+    return _stitch_stream(
+        descriptor, rows, children, data_providers, batch_size, budget, trace
+    ), None
+
+
+def _slices(rs, size):
+    if len(rs) <= size:
+        yield rs
+        return
+    for start in range(0, len(rs), size):
+        yield rs.take(range(start, min(start + size, len(rs))))
+
+
+def _traced_trunk_rows(trace, method, rows, started):
+    """Record the streamed trunk's branch run; its rows are counted as they are read."""
+    seconds = time.perf_counter() - started
+    if not isinstance(rows, RowStream):
+        trace.branch(method, seconds, rows, started)
+        return rows
+
+    def counted():
+        count, first = 0, None
+        try:
+            for row in rows.rows:
+                if not count:
+                    first = row
+                count += 1
+                yield row
+        finally:
+            rows.close()
+            trace.branch(method, seconds, None, started, rows=count,
+                         nbytes=estimate_bytes([first]) * count if count else 0)
+
+    return RowStream(rows.columns, counted())
+
+
+def _stitch_stream(descriptor, rows, children, data_providers, batch_size, budget=None,
+                   trace=None):
+    """Yield RowSet chunks of streamed trunk rows (a RowStream or RowSet)."""
+    if isinstance(rows, RowSet) and (rows.columns is None or not len(rows)):
+        rows = RowSet(rows.columns, rows.rows, index=rows.index)
+        for branch, _shape, output in children:
+            rows.attach(branch["name"], [output] * len(rows))
+        yield from _slices(rows, batch_size)
+        return
+
+    columns, index = rows.columns, rows.index
+    try:
+        partition_by = descriptor.get("partition_by")
+        # Like _execute_branch, partition_by only groups rows when there are children.
+        if not partition_by or not children:
+            for chunk_rows in _chunks(rows.rows, batch_size):
+                chunk = RowSet(columns, chunk_rows, index=index)
+                for branch, _shape, output in children:
+                    chunk.attach(branch["name"], [output] * len(chunk_rows))
+                yield chunk
+            return
+
+        pos = index.get(partition_by)
+        if pos is None:
+            raise KeyError("partition_by column '%s' missing from parent row" % partition_by)
+
+        cursors = {}
+        for branch, _shape, output in children:
+            if isinstance(output, SpilledRows):
+                cursors[branch["name"]] = (output, None)
+            elif output is not None:
+                cursors[branch["name"]] = (
+                    output, _GroupCursor(_keyed_positions(output, partition_by, "child"), partition_by)
+                )
+
+        chunk_rows, attached = [], {branch["name"]: [] for branch, _shape, _output in children}
+        for key, group in _consecutive_groups(((row[pos], row) for row in rows.rows), partition_by):
+            row = group[0]
+            current = RowSet(columns, group, index=index)
+            for branch, branch_shape, _output in children:
+                branch_name = branch["name"]
+                if branch_name in cursors:
+                    output, cursor = cursors[branch_name]
+                    if cursor is None:
+                        value = output.group(key)
+                    else:
+                        value = output.take(cursor.take(key))
+                else:
+                    value, _errors = _execute_branch(
+                        branch, False, data_providers, branch_shape, current, budget=budget,
+                        trace=trace,
+                    )
+                attached[branch_name].append(value)
+                # Later siblings see the deduplicated parent, as in _execute_branch.
+                current = RowSet(columns, [row], {
+                    name: values[-1:] for name, values in attached.items() if values
+                }, index)
+            chunk_rows.append(row)
+            if len(chunk_rows) >= batch_size:
+                yield RowSet(columns, chunk_rows, attached, index)
+                chunk_rows, attached = [], {name: [] for name in attached}
+        if chunk_rows:
+            yield RowSet(columns, chunk_rows, attached, index)
+
+        for _output, cursor in cursors.values():
+            if cursor is not None:
+                cursor.drain()
+    finally:
+        if isinstance(rows, RowStream):
+            rows.close()
+
 
-    return rs
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_result(descriptor, get_data_provider, ctx, batch_size, memory_budget=None,
+                 trace=None):
+    """Generator behind iter_result: first yields soft errors (or None), then items."""
+    errors = _timed(trace, "validate", _validate_context, ctx)
+    if errors:
+        if trace is not None:
+            trace.info["status"] = "error"
+        yield errors
+        return
+
+    data_providers = _get_data_providers(descriptor, get_data_provider)
+
+    began = []
+    failed = True
+    # Reported as trace.info["status"]: ok, error (soft errors), closed early or exception.
+    status = "exception"
+    budget = memory_budget.start() if memory_budget is not None else None
+    try:
+        for data_provider in data_providers.values():
+            data_provider.begin()
+            began.append(data_provider)
+
+        try:
+            chunks, errors = _stream_trunk_rows(
+                descriptor, data_providers, ctx, batch_size, budget, trace
+            )
+        except MemoryBudgetError as e:
+            chunks, errors = None, [{"message": e.message}]
+        if errors:
+            status = "error"
+        yield errors
+        if errors:
+            return
+
+        if descriptor["output_type"] == "array":
+            if trace is None:
+                for chunk in chunks:
+                    yield from _map_result(descriptor, chunk)
+            else:
+                # Reading the next chunk (streamed rows, parent_rows SQL) counts as map.
+                while True:
+                    started = time.perf_counter()
+                    chunk = next(chunks, None)
+                    items = _map_result(descriptor, chunk) if chunk is not None else None
+                    trace.add("map", time.perf_counter() - started, started)
+                    if chunk is None:
+                        break
+                    yield from items
+        else:
+            # Object output keeps the first row, which is in the first chunk.
+            yield _timed(trace, "map", _map_result, descriptor, next(chunks, RowSet.empty()))
+        failed = False
+        status = "ok"
+    except GeneratorExit:
+        if status != "error":
+            status = "closed"
+        raise
+    finally:
+        if trace is not None:
+            trace.info["status"] = status
+        try:
+            if began:
+                _trunk_cleanup(data_providers, data_providers["db"], failed)
+        finally:
+            if budget is not None:
+                budget.close()
+
+
+def iter_result(descriptor, get_data_provider, ctx, *, batch_size=DEFAULT_FETCH_BATCH_SIZE,
+                memory_budget=None, trace=None):
+    """Yield shaped top-level items while trunk rows are drained from the cursor.
+
+    The transaction stays open for the life of the generator: exhaustion
+    commits; close() before exhaustion or an exception rolls back. Soft errors
+    are yielded once as {"errors": [...]} (and roll back), mirroring
+    get_result. Object descriptors yield their single object. A budget
+    ceiling hit after the first item raises MemoryBudgetError instead.
+    trace (a yaal_trace.QueryTrace) collects stage timings; the caller
+    finishes it.
+    """
+    items = _iter_result(descriptor, get_data_provider, ctx, batch_size, memory_budget, trace)
+    try:
+        errors = next(items)
+        if errors:
+            yield {"errors": errors}
+            return
+        yield from items
+    finally:
+        items.close()
 
 
 def _default_date_time_converter(o):
@@ -353,10 +1343,374 @@ def _default_date_time_converter(o):
         return o.__str__()
 
 
-def get_result(descriptor, get_data_provider, context):
-    return _get_result(descriptor, get_data_provider, context)
+def get_result(descriptor, get_data_provider, context, *, max_branch_workers=None,
+               executemany_batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, memory_budget=None,
+               trace=None):
+    """Execute a descriptor and return the shaped result.
+
+    max_branch_workers > 1 runs independent branches (see the builder's
+    depends_on) on a thread pool of that size; the result is unchanged.
+    executemany_batch_size caps items per executemany for array payloads
+    whose twigs are all batchable (0 runs every item separately).
+    memory_budget (a yaal_spill.MemoryBudget) bounds the rows buffered.
+    trace (a yaal_trace.QueryTrace) collects stage timings; the caller
+    finishes it.
+    """
+    return _get_result(descriptor, get_data_provider, context, max_branch_workers,
+                       executemany_batch_size, memory_budget, trace)
+
+
+def get_result_json(descriptor, get_data_providers, context, *, max_branch_workers=None,
+                    executemany_batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, memory_budget=None,
+                    trace=None):
+    result = get_result(descriptor, get_data_providers, context,
+                        max_branch_workers=max_branch_workers,
+                        executemany_batch_size=executemany_batch_size,
+                        memory_budget=memory_budget, trace=trace)
+    return _timed(trace, "serialize", dump_result_json, result)
+
+
+def dump_result_json(result):
+    """Serialize a get_result value exactly as get_result_json does."""
+    return json.dumps(result, default=_default_date_time_converter)
+
+
+def is_error_result(result):
+    """True for the {"errors": [...]} value returned instead of a shaped result."""
+    return type(result) is dict and len(result) == 1 and "errors" in result
+
+
+def iter_result_json(descriptor, get_data_provider, ctx, *, batch_size=DEFAULT_FETCH_BATCH_SIZE,
+                     memory_budget=None, trace=None):
+    """Yield the get_result_json text in fragments, one top-level item at a time.
+
+    Joining the fragments gives exactly get_result_json's output; array
+    results are written element by element so the first bytes are available
+    after the first batch of rows. The transaction follows iter_result.
+    """
+    items = _iter_result(descriptor, get_data_provider, ctx, batch_size, memory_budget, trace)
+    try:
+        errors = next(items)
+        if errors:
+            yield dump_result_json({"errors": errors})
+            return
+        if descriptor["output_type"] != "array":
+            for item in items:
+                yield _timed(trace, "serialize", dump_result_json, item)
+            return
+
+        yield "["
+        separator = ""
+        for item in items:
+            yield separator + _timed(trace, "serialize", dump_result_json, item)
+            separator = ", "
+        yield "]"
+    finally:
+        items.close()
+
+
+async def _acall_provider(execute, branch, idx, twig, context, data_provider_helper):
+    """Async _call_provider: await execute(...), timed into the query trace if any."""
+    query_trace = data_provider_helper.query_trace
+    if query_trace is None:
+        return await execute(twig, context, data_provider_helper)
+    twig_trace = data_provider_helper.trace = query_trace.twig(
+        branch["method"], idx, twig, provider_name(execute)
+    )
+    try:
+        output, last_inserted_id = await execute(twig, context, data_provider_helper)
+    finally:
+        data_provider_helper.trace = None
+    return twig_trace.finish(output), last_inserted_id
+
+
+async def _aexecute_twigs(branch, data_providers, context, data_provider_helper):
+    rs = RowSet.empty()
+    for idx, twig in enumerate(branch.get("twigs") or []):
+        try:
+            output, output_last_inserted_id = await _acall_provider(
+                data_providers[twig["connection"]].execute, branch, idx, twig, context,
+                data_provider_helper,
+            )
+        except SortDirError as e:
+            return None, [{"message": e.message}]
+
+        context.get_prop("$params").set_prop("$last_inserted_id", output_last_inserted_id)
 
+        rs, errors, final = _apply_twig_output(as_row_set(output), context, rs)
+        if final:
+            return rs, errors
 
-def get_result_json(descriptor, get_data_providers, context):
-    return json.dumps(get_result(descriptor, get_data_providers, context),
-                      default=_default_date_time_converter)
+    return rs, None
+
+
+async def _aexecute_twigs_many(branch, data_providers, context, length, batch_size,
+                               trace=None):
+    """Async _execute_twigs_many: awaits each provider's execute_many."""
+    data_provider_helper = DataProviderHelper()
+    data_provider_helper.query_trace = trace
+    item_shapes = [context.get_prop("@" + str(i)) for i in range(0, length)]
+    params = context.get_prop("$params")
+    for idx, twig in enumerate(branch["twigs"]):
+        data_provider = data_providers[twig["connection"]]
+        for start in range(0, length, batch_size):
+            try:
+                _rows, last_inserted_id = await _acall_provider(
+                    data_provider.execute_many, branch, idx, twig,
+                    item_shapes[start:start + batch_size], data_provider_helper,
+                )
+            except SortDirError as e:
+                return None, [{"message": e.message}]
+            params.set_prop("$last_inserted_id", last_inserted_id)
+    return RowSet.empty(), None
+
+
+async def _aexecute_branch_rows(branch, data_providers, context,
+                                batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, parent_keys=None,
+                                budget=None, trace=None):
+    if trace is None:
+        return await _arun_branch_rows(branch, data_providers, context, batch_size, parent_keys,
+                                       budget)
+    started = time.perf_counter()
+    output, errors = await _arun_branch_rows(
+        branch, data_providers, context, batch_size, parent_keys, budget, trace
+    )
+    trace.branch(branch["method"], time.perf_counter() - started, output, started)
+    return output, errors
+
+
+async def _arun_branch_rows(branch, data_providers, context, batch_size, parent_keys, budget,
+                            trace=None):
+    data_provider_helper = DataProviderHelper()
+    data_provider_helper.query_trace = trace
+    if parent_keys is not None:
+        data_provider_helper.set_parent_keys(parent_keys)
+    input_type = branch["input_type"]
+    output = RowSet.empty()
+
+    if input_type == "array":
+        length = int(context.get_prop("$length"))
+        if batch_size and _can_batch(branch, data_providers, length):
+            return await _aexecute_twigs_many(
+                branch, data_providers, context, length, batch_size, trace
+            )
+        parts = []
+        for i in range(0, length):
+            data_provider_helper.clear_cache()
+            item_ctx = context.get_prop("@" + str(i))
+            rs, errors = await _aexecute_twigs(branch, data_providers, item_ctx, data_provider_helper)
+            if errors:
+                return None, errors
+            if budget is not None:
+                budget.charge(rs.rows)
+            parts.append(rs)
+        output = RowSet.concat(parts)
+
+    elif input_type == "object":
+        output, errors = await _aexecute_twigs(branch, data_providers, context, data_provider_helper)
+        if errors:
+            return None, errors
+        if budget is not None:
+            # Async providers return buffered rows: charged (and spilled) once read.
+            output = _hold_budgeted(branch, output, budget)
+
+    return output, None
+
+
+async def _aexecute_branch_rows_by_keys(branch, data_providers, context, parent_rows,
+                                        batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, budget=None,
+                                        trace=None):
+    """Async _execute_branch_rows_by_keys."""
+    keys = _parent_key_values(parent_rows, branch["parent_key"])
+    chunk = _parent_key_chunk(branch)
+    parts = []
+    for start in range(0, len(keys), chunk):
+        rows, errors = await _aexecute_branch_rows(
+            branch, data_providers, context, batch_size, keys[start:start + chunk],
+            budget, trace,
+        )
+        if errors:
+            return None, errors
+        parts.append(rows)
+    return RowSet.concat(parts), None
+
+
+async def _aprefetch_branches(trunk, data_providers, context, max_workers,
+                              batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, budget=None, trace=None):
+    """Async _prefetch_branches: up to max_workers branches run as concurrent tasks.
+
+    Same scheduling as the sync version; each connection is used by one task
+    at a time. Tasks still running when the caller is cancelled are
+    cancelled too.
+    """
+    nodes, deferred = _scheduled_nodes(trunk, context)
+    if len(nodes) < 2 or any("depends_on" not in branch for branch, _shape in nodes):
+        return None
+    if any(deferred.intersection(branch["depends_on"]) for branch, _shape in nodes):
+        return None
+
+    locks = {name: asyncio.Lock() for name in data_providers}
+
+    async def run(branch, shape):
+        names = sorted({twig["connection"] for twig in branch["twigs"]})
+        async with contextlib.AsyncExitStack() as stack:
+            for name in names:
+                await stack.enter_async_context(locks[name])
+            return await _aexecute_branch_rows(branch, data_providers, shape, batch_size,
+                                               budget=budget, trace=trace)
+
+    order = {branch["method"]: idx for idx, (branch, _shape) in enumerate(nodes)}
+    results = {}
+    pending = list(nodes)
+    running = {}
+    stop_at = len(nodes)
+
+    try:
+        while pending or running:
+            for node in list(pending):
+                branch, shape = node
+                if order[branch["method"]] >= stop_at:
+                    pending.remove(node)
+                elif len(running) < max_workers and all(
+                    dep in results for dep in branch["depends_on"]
+                ):
+                    pending.remove(node)
+                    running[asyncio.ensure_future(run(branch, shape))] = branch["method"]
+            if not running:
+                break
+            done, _not_done = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                method = running.pop(task)
+                try:
+                    rows, errors = task.result()
+                    results[method] = (rows, errors, None)
+                except Exception as e:
+                    errors = None
+                    results[method] = (None, None, e)
+                if errors or results[method][2] is not None:
+                    stop_at = min(stop_at, order[method])
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    return results
+
+
+async def _atrunk_cleanup(data_providers, failed):
+    if failed:
+        for data_provider in data_providers.values():
+            try:
+                await data_provider.error()
+            except Exception:
+                pass
+        return
+
+    await data_providers["db"].end()
+    for name, data_provider in data_providers.items():
+        if name != "db":
+            await data_provider.end()
+
+
+async def _aexecute_branch(branch, is_trunk, data_providers, context, parent_rows,
+                           prefetched=None, max_workers=None,
+                           batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, budget=None, trace=None):
+    """Async twin of _execute_branch over providers with awaitable methods."""
+    began = False
+    failed = False
+
+    try:
+        if branch.get("use_parent_rows"):
+            output = as_row_set(parent_rows).copy()
+        else:
+            if is_trunk:
+                for data_provider in data_providers.values():
+                    await data_provider.begin()
+                began = True
+                if max_workers and max_workers > 1:
+                    prefetched = await _aprefetch_branches(
+                        branch, data_providers, context, max_workers, batch_size, budget, trace
+                    )
+
+            if prefetched is not None and branch["method"] in prefetched:
+                output, errors, exception = prefetched[branch["method"]]
+                if exception is not None:
+                    raise exception
+            elif branch.get("parent_key"):
+                output, errors = await _aexecute_branch_rows_by_keys(
+                    branch, data_providers, context, parent_rows, batch_size, budget, trace
+                )
+            else:
+                output, errors = await _aexecute_branch_rows(
+                    branch, data_providers, context, batch_size, budget=budget, trace=trace
+                )
+            if errors:
+                failed = True
+                return None, errors
+
+        for branch_descriptor in branch.get("branches") or []:
+            branch_name = branch_descriptor["name"]
+            sub_node_output, errors = await _aexecute_branch(
+                branch_descriptor, False, data_providers, _branch_shape(context, branch_name), output,
+                prefetched, batch_size=batch_size, budget=budget, trace=trace,
+            )
+            if errors:
+                failed = True
+                return None, errors
+
+            output = _timed(
+                trace, "stitch", _attach_child, branch, output, branch_name, sub_node_output
+            )
+
+        return output, None
+
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        if is_trunk and began:
+            await _atrunk_cleanup(data_providers, failed)
+
+
+async def aget_result(descriptor, get_data_provider, context, *, max_branch_workers=None,
+                      executemany_batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE, memory_budget=None,
+                      trace=None):
+    """Async get_result: get_data_provider returns providers with async begin/execute/end/error.
+
+    Wrap sync providers in yaal_provider.ThreadOffloadProvider. Cancelling
+    the awaiting task rolls the transaction back. The keyword settings are
+    get_result's; batching needs providers with an async execute_many.
+    """
+    errors = _timed(trace, "validate", _validate_context, context)
+    if errors:
+        return {"errors": errors}
+
+    data_providers = _get_data_providers(descriptor, get_data_provider)
+
+    budget = memory_budget.start() if memory_budget is not None else None
+    try:
+        rs, errors = await _aexecute_branch(
+            descriptor, True, data_providers, context, RowSet.empty(),
+            max_workers=max_branch_workers, batch_size=executemany_batch_size, budget=budget,
+            trace=trace,
+        )
+        if errors:
+            return {"errors": errors}
+
+        return _timed(trace, "map", _map_result, descriptor, rs)
+    except MemoryBudgetError as e:
+        return {"errors": [{"message": e.message}]}
+    finally:
+        if budget is not None:
+            budget.close()
+
+
+async def aget_result_json(descriptor, get_data_provider, context, *, max_branch_workers=None,
+                           executemany_batch_size=DEFAULT_EXECUTEMANY_BATCH_SIZE,
+                           memory_budget=None, trace=None):
+    result = await aget_result(descriptor, get_data_provider, context,
+                               max_branch_workers=max_branch_workers,
+                               executemany_batch_size=executemany_batch_size,
+                               memory_budget=memory_budget, trace=trace)
+    return _timed(trace, "serialize", dump_result_json, result)
@@ -0,0 +1,158 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Sparse fieldsets: query(..., fields="id,name,roles.id").
+
+A selection names output keys by path (``roles.id``; a leading ``$.`` and
+``[*]`` are accepted). prune_descriptor returns a copy of a trunk whose
+output plan keeps only the selected keys and whose unselected child
+branches are gone, so their SQL never runs and their connections are
+never checked out. Branches that write data or emit $mode rows still run
+(only their output is dropped), since skipping them would change what the
+query does. A partition_by parent left without children keeps one SQL-free
+stand-in child, so its rows are still grouped by partition_by.
+"""
+
+from yaal_builder import _twig_effects
+from yaal_errors import FieldSelectionError
+from yaal_executor import output_plan
+
+
+def parse_fields(fields):
+    """Selection tree for fields (comma separated string or list of paths).
+
+    Returns {key: True | subtree}; True selects the key with everything
+    below it. None (or an empty selection) means everything.
+    """
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    selection = {}
+    for field in fields:
+        parts = [p.strip() for p in str(field).replace("[*]", "").replace("[]", "").split(".")]
+        if parts and parts[0] == "$":
+            parts = parts[1:]
+        if not parts or parts == [""]:
+            continue
+        if any(not p for p in parts):
+            raise FieldSelectionError("invalid field path %r" % field)
+        node = selection
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if child is True:
+                break
+            node = child
+        else:
+            node[parts[-1]] = True
+    return selection or None
+
+
+def fields_key(selection):
+    """Canonical text of a selection (descriptor cache and result-cache keys)."""
+    paths = []
+
+    def walk(node, prefix):
+        for key in sorted(node):
+            sub = node[key]
+            if sub is True:
+                paths.append(prefix + key)
+            else:
+                walk(sub, prefix + key + ".")
+
+    walk(selection, "")
+    return ",".join(paths)
+
+
+def _select_plan(plan, selection, where):
+    """Plan with only the selected keys; selection is a subtree (not True)."""
+    field_keys = {key for key, _column in plan["fields"]}
+    branch_plans = dict(plan["branches"])
+    passthrough = not any(column is not None for _key, column in plan["fields"])
+    for key, sub in selection.items():
+        if key in branch_plans:
+            continue
+        if key not in field_keys and not passthrough:
+            raise FieldSelectionError("unknown field %r" % (where + key))
+        if sub is not True:
+            raise FieldSelectionError("%r has no fields to select" % (where + key))
+
+    selected = {
+        "type": plan["type"],
+        "fields": [[key, column] for key, column in plan["fields"] if key in selection],
+        "branches": [
+            [name, branch_plan if selection[name] is True
+             else _select_plan(branch_plan, selection[name], where + name + ".")]
+            for name, branch_plan in plan["branches"] if name in selection
+        ],
+    }
+    if passthrough:
+        # Row columns are only known at run time; map_output keeps these keys.
+        selected["keep"] = sorted(selection)
+    return selected
+
+
+def _has_effects(branch):
+    for twig in branch.get("twigs") or []:
+        writes, sets_params = _twig_effects(twig)
+        if writes or sets_params:
+            return True
+    return any(_has_effects(child) for child in branch.get("branches") or [])
+
+
+def _prune_branch(branch, selection, pruned):
+    """Shallow copy of branch without the unselected, effect-free child branches."""
+    branch = dict(branch)
+    if "branches" not in branch:
+        return branch
+    children = []
+    stand_in = None
+    for child in branch["branches"]:
+        sub = True if selection is True else selection.get(child["name"])
+        if sub is None and not _has_effects(child):
+            _collect_methods(child, pruned)
+            if stand_in is None:
+                stand_in = child
+            continue
+        children.append(_prune_branch(child, True if sub is None else sub, pruned))
+    if not children and stand_in is not None and branch.get("partition_by"):
+        # Attaching a child is what groups the parent's rows by partition_by; an
+        # SQL-free parent_rows stand-in keeps that grouping.
+        stand_in = dict(stand_in, twigs=[], branches=[], use_parent_rows=True)
+        stand_in.pop("parent_key", None)
+        children.append(stand_in)
+    branch["branches"] = children
+    return branch
+
+
+def _collect_methods(branch, methods):
+    methods.add(branch["method"])
+    for child in branch.get("branches") or []:
+        _collect_methods(child, methods)
+
+
+def _finish_branch(branch, pruned, connections):
+    if branch.get("depends_on"):
+        branch["depends_on"] = [m for m in branch["depends_on"] if m not in pruned]
+    for twig in branch.get("twigs") or []:
+        connections.add(twig["connection"])
+    for child in branch.get("branches") or []:
+        _finish_branch(child, pruned, connections)
+
+
+def prune_descriptor(descriptor, selection):
+    """Copy of a trunk restricted to selection (from parse_fields); see module doc."""
+    plan = _select_plan(output_plan(descriptor), selection, "")
+    pruned = set()
+    trunk = _prune_branch(descriptor, selection, pruned)
+    trunk.pop("_mapper", None)
+    used = set()
+    _finish_branch(trunk, pruned, used)
+    # "db" stays: the executor runs the trunk's transaction on it.
+    trunk["connections"] = [
+        name for name in descriptor["connections"] if name == "db" or name in used
+    ]
+    trunk["output_plan"] = plan
+    trunk["fields"] = fields_key(selection)
+    return trunk
@@ -0,0 +1,370 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Per-descriptor metrics: Yaal(metrics=True), Yaal.metrics_stats() and Yaal.metrics_text().
+
+A MetricsRegistry is fed the yaal_trace dict of every finished query (it is
+registered like a trace callback), so it covers the same calls: query /
+query_json, query_iter, the streaming JSON methods, aquery and sessions.
+Per descriptor path it counts calls, exceptions and soft errors
+({"errors": [...]}) and keeps a fixed-bucket latency histogram; per
+descriptor path and provider (the setup_data_provider name) it counts
+provider calls, rows fetched, their estimated bytes and provider time.
+Output bytes are the UTF-8 size of JSON results (query_json and the
+streaming JSON methods). Memory is bounded by the number of descriptors and
+providers, not by traffic.
+
+StatementStats (Yaal(statement_stats=True), Yaal.statement_stats()) keeps
+the same kind of counters per compiled-SQL fingerprint instead, across
+descriptors.
+"""
+
+import bisect
+import heapq
+import threading
+
+# Seconds; +Inf is implied.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for name, value in labels.items())
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(round(value, 9))
+    return str(value)
+
+
+class _Descriptor:
+
+    __slots__ = ("calls", "errors", "soft_errors", "output_bytes", "seconds", "buckets")
+
+    def __init__(self, size):
+        self.calls = 0
+        self.errors = 0
+        self.soft_errors = 0
+        self.output_bytes = 0
+        self.seconds = 0.0
+        # Non-cumulative counts; the last slot is +Inf.
+        self.buckets = [0] * (size + 1)
+
+
+class _Provider:
+
+    __slots__ = ("calls", "rows", "bytes", "seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+
+class MetricsRegistry:
+    """Counters and latency histograms keyed by descriptor path (and provider)."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix="yaal"):
+        buckets = tuple(float(b) for b in buckets)
+        if not buckets or list(buckets) != sorted(set(buckets)) or buckets[0] <= 0:
+            raise ValueError("metrics buckets must be increasing positive numbers")
+        self.buckets = buckets
+        self.prefix = prefix
+        self._descriptors = {}
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_value(cls, value):
+        """None / False, True (default buckets) or a MetricsRegistry."""
+        if value is None or value is False:
+            return None
+        if value is True:
+            return cls()
+        if isinstance(value, cls):
+            return value
+        raise TypeError("metrics must be a bool or MetricsRegistry")
+
+    def observe(self, trace):
+        """Record one finished query from its yaal_trace dict."""
+        path = trace["path"]
+        seconds = trace["total_ms"] / 1000.0
+        status = trace.get("status")
+        slot = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            entry = self._descriptors.get(path)
+            if entry is None:
+                entry = self._descriptors[path] = _Descriptor(len(self.buckets))
+            entry.calls += 1
+            entry.seconds += seconds
+            entry.buckets[slot] += 1
+            if status == "exception":
+                entry.errors += 1
+            elif status == "error":
+                entry.soft_errors += 1
+            entry.output_bytes += trace.get("output_bytes") or 0
+            for branch in trace["branches"]:
+                for twig in branch["twigs"]:
+                    key = (path, twig["connection"])
+                    provider = self._providers.get(key)
+                    if provider is None:
+                        provider = self._providers[key] = _Provider()
+                    provider.calls += twig["runs"]
+                    provider.rows += twig["rows"]
+                    provider.bytes += twig["bytes"]
+                    provider.seconds += (
+                        twig["execute_ms"] + twig["compile_ms"] + twig["fetch_ms"]
+                    ) / 1000.0
+
+    def clear(self):
+        with self._lock:
+            self._descriptors.clear()
+            self._providers.clear()
+
+    def _quantile(self, counts, total, q):
+        """Estimate a latency quantile by linear interpolation inside its bucket.
+
+        Like Prometheus' histogram_quantile: observations past the last
+        bound report the last bound.
+        """
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, counts):
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+    def stats(self):
+        """{path: {calls, errors, soft_errors, output_bytes, rows, bytes, total_ms,
+        p50_ms, p95_ms, p99_ms, providers: {name: {calls, rows, bytes, ms}}}}."""
+        with self._lock:
+            descriptors = {
+                path: (entry.calls, entry.errors, entry.soft_errors, entry.output_bytes,
+                       entry.seconds, list(entry.buckets))
+                for path, entry in self._descriptors.items()
+            }
+            providers = {
+                key: (p.calls, p.rows, p.bytes, p.seconds) for key, p in self._providers.items()
+            }
+        result = {}
+        for path, (calls, errors, soft_errors, output_bytes, seconds, counts) in sorted(
+                descriptors.items()):
+            item = {
+                "calls": calls,
+                "errors": errors,
+                "soft_errors": soft_errors,
+                "output_bytes": output_bytes,
+                "rows": 0,
+                "bytes": 0,
+                "total_ms": round(seconds * 1000.0, 3),
+            }
+            for q in QUANTILES:
+                item["p%d_ms" % round(q * 100)] = round(
+                    self._quantile(counts, calls, q) * 1000.0, 3
+                )
+            item["providers"] = {}
+            result[path] = item
+        for (path, name), (calls, rows, nbytes, seconds) in sorted(
+                providers.items(), key=lambda kv: (kv[0][0], str(kv[0][1]))):
+            item = result[path]
+            item["rows"] += rows
+            item["bytes"] += nbytes
+            item["providers"][name] = {
+                "calls": calls, "rows": rows, "bytes": nbytes, "ms": round(seconds * 1000.0, 3),
+            }
+        return result
+
+    def text(self):
+        """Prometheus text exposition (format 0.0.4) of every metric."""
+        prefix = self.prefix
+        with self._lock:
+            descriptors = sorted(
+                (path, entry.calls, entry.errors, entry.soft_errors, entry.output_bytes,
+                 entry.seconds, list(entry.buckets))
+                for path, entry in self._descriptors.items()
+            )
+            providers = sorted(
+                ((path, str(name)), p.calls, p.rows, p.bytes, p.seconds)
+                for (path, name), p in self._providers.items()
+            )
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help_text))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            for suffix, labels, value in samples:
+                lines.append("%s_%s%s%s %s" % (prefix, name, suffix, labels, _number(value)))
+
+        family("queries_total", "counter", "Queries run, per descriptor.",
+               [("", _labels(descriptor=d[0]), d[1]) for d in descriptors])
+        family("query_errors_total", "counter", "Queries that raised, per descriptor.",
+               [("", _labels(descriptor=d[0]), d[2]) for d in descriptors])
+        family("query_soft_errors_total", "counter",
+               'Queries that returned {"errors": [...]}, per descriptor.',
+               [("", _labels(descriptor=d[0]), d[3]) for d in descriptors])
+        family("output_bytes_total", "counter",
+               "UTF-8 bytes of JSON results (query_json and streaming JSON), per descriptor.",
+               [("", _labels(descriptor=d[0]), d[4]) for d in descriptors])
+
+        samples = []
+        for path, calls, _errors, _soft, _out, seconds, counts in descriptors:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", _labels(descriptor=path, le=_number(bound)),
+                                cumulative))
+            samples.append(("_sum", _labels(descriptor=path), seconds))
+            samples.append(("_count", _labels(descriptor=path), calls))
+        family("query_duration_seconds", "histogram", "Query latency, per descriptor.", samples)
+
+        samples = []
+        for path, calls, _errors, _soft, _out, seconds, counts in descriptors:
+            for q in QUANTILES:
+                samples.append(("", _labels(descriptor=path, quantile=_number(q)),
+                                self._quantile(counts, calls, q)))
+            samples.append(("_sum", _labels(descriptor=path), seconds))
+            samples.append(("_count", _labels(descriptor=path), calls))
+        family("query_latency_seconds", "summary",
+               "p50/p95/p99 query latency estimated from the histogram, per descriptor.",
+               samples)
+
+        for name, pos, help_text in (
+            ("provider_calls_total", 1, "Provider calls (twig runs), per descriptor and provider."),
+            ("rows_fetched_total", 2, "Rows fetched, per descriptor and provider."),
+            ("fetched_bytes_total", 3,
+             "Estimated bytes of rows fetched, per descriptor and provider."),
+            ("provider_seconds_total", 4, "Time in provider calls, per descriptor and provider."),
+        ):
+            family(name, "counter", help_text, [
+                ("", _labels(descriptor=p[0][0], provider=p[0][1]), p[pos]) for p in providers
+            ])
+        return "\n".join(lines) + "\n"
+
+
+STATEMENT_SORT_KEYS = ("total_ms", "calls", "mean_ms", "max_ms", "rows")
+
+
+class _Statement:
+
+    __slots__ = ("sql", "variant", "descriptors", "calls", "seconds", "max_seconds", "rows",
+                 "cache_hits", "cache_misses")
+
+    def __init__(self, sql, variant):
+        self.sql = sql
+        self.variant = variant
+        self.descriptors = set()
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class StatementStats:
+    """Execution counters per compiled-SQL fingerprint, across descriptors and variants.
+
+    The in-process counterpart of pg_stat_statements: each provider call is
+    folded into its statement's entry (yaal_trace.sql_fingerprint of the SQL
+    get_executable_content returned, so every optional() / sort() variant is
+    its own entry). At most max_entries are kept; when a new statement
+    arrives at the limit, the least-called 5% are dropped (counted in
+    evicted).
+    """
+
+    def __init__(self, max_entries=5000):
+        if type(max_entries) is not int or max_entries < 1:
+            raise ValueError("statement_stats max_entries must be a positive integer")
+        self.max_entries = max_entries
+        self.evicted = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_value(cls, value):
+        """None / False, True (defaults) or a StatementStats."""
+        if value is None or value is False:
+            return None
+        if value is True:
+            return cls()
+        if isinstance(value, cls):
+            return value
+        raise TypeError("statement_stats must be a bool or StatementStats")
+
+    def observe(self, path, statement):
+        """Fold one yaal_trace statement (a provider call of descriptor path) in."""
+        fingerprint = statement["fingerprint"]
+        if fingerprint is None:
+            return
+        seconds = statement["duration_ms"] / 1000.0
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    self._evict()
+                entry = self._entries[fingerprint] = _Statement(
+                    statement["sql"], statement["variant"]
+                )
+            entry.descriptors.add(path)
+            entry.calls += 1
+            entry.seconds += seconds
+            if seconds > entry.max_seconds:
+                entry.max_seconds = seconds
+            entry.rows += statement["rows"] or 0
+            if statement["cache_hit"]:
+                entry.cache_hits += 1
+            elif statement["cache_hit"] is False:
+                entry.cache_misses += 1
+
+    def _evict(self):
+        count = max(1, len(self._entries) // 20)
+        for fingerprint in heapq.nsmallest(count, self._entries,
+                                           key=lambda f: self._entries[f].calls):
+            del self._entries[fingerprint]
+        self.evicted += count
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self.evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def report(self, top=None, sort="total_ms"):
+        """Entries as dicts, largest sort key first; top limits how many (None: all)."""
+        if sort not in STATEMENT_SORT_KEYS:
+            raise ValueError(
+                "statement_stats sort must be one of %s" % ", ".join(STATEMENT_SORT_KEYS)
+            )
+        with self._lock:
+            rows = []
+            for fingerprint, entry in self._entries.items():
+                rows.append({
+                    "fingerprint": fingerprint,
+                    "calls": entry.calls,
+                    "total_ms": round(entry.seconds * 1000.0, 3),
+                    "mean_ms": round(entry.seconds * 1000.0 / entry.calls, 3),
+                    "max_ms": round(entry.max_seconds * 1000.0, 3),
+                    "rows": entry.rows,
+                    "cache_hits": entry.cache_hits,
+                    "cache_misses": entry.cache_misses,
+                    "descriptors": sorted(entry.descriptors),
+                    "variant": entry.variant,
+                    "sql": entry.sql,
+                })
+        rows.sort(key=lambda row: (-row[sort], row["fingerprint"]))
+        return rows if top is None else rows[:top]
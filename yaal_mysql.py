@@ -6,11 +6,20 @@ import mysql.connector
 import mysql.connector.pooling
 
 from yaal_provider import (
+    DEFAULT_FETCH_BATCH_SIZE,
+    CursorRows,
     commit_then_close,
-    fetch_dict_rows,
+    cursor_columns,
+    fetch_row_set,
+    iter_row_stream,
+    iter_variant_batches,
     parse_pool_int,
     rollback_then_close,
+    rollback_then_release,
+    server_cursor_options,
+    use_server_cursor,
 )
+from yaal_rows import RowSet, RowStream
 
 
 _CONNECT_QUERY_KEYS = (
@@ -75,45 +84,112 @@ class MySQLContextManager:
         self._pool = mysql.connector.pooling.MySQLConnectionPool(
             pool_name=pool_name, pool_size=pool_size, **db_config
         )
+        self._server_cursor, self._itersize = server_cursor_options(query)
 
     def get_context(self):
-        return MySQLDataProvider(self._pool)
+        return MySQLDataProvider(self._pool, self._server_cursor, self._itersize)
 
 
 class MySQLDataProvider:
 
-    def __init__(self, pool):
+    def __init__(self, pool, server_cursor=False, itersize=DEFAULT_FETCH_BATCH_SIZE):
         self._pool = pool
         self._conn = None
+        self._server_cursor = server_cursor
+        self._itersize = itersize
+        # Unread unbuffered result (execute_iter with a server cursor), if any.
+        self._stream = None
+
+    def _buffer_stream(self):
+        """Read an open unbuffered result into memory so the connection can run SQL."""
+        stream = self._stream
+        self._stream = None
+        if stream is not None:
+            stream.buffer()
+
+    def _close_stream(self):
+        stream = self._stream
+        self._stream = None
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
 
     def begin(self):
         self._conn = self._pool.get_connection()
 
     def end(self):
+        self._buffer_stream()
         conn = self._conn
         self._conn = None
         commit_then_close(conn, release=_mysql_pool_release)
 
     def error(self):
+        self._close_stream()
         conn = self._conn
         self._conn = None
         rollback_then_close(conn, release=_mysql_pool_release)
 
+    def release(self):
+        """Finish without committing (read-only sessions); the connection stays pooled."""
+        self._close_stream()
+        conn = self._conn
+        self._conn = None
+        rollback_then_release(conn, release=_mysql_pool_release)
+
     @staticmethod
     def get_value_converter(param_type, value):
         return value
 
     def execute(self, twig, input_shape, helper):
+        self._buffer_stream()
         con = self._conn
         sql = helper.get_executable_content("%s", twig, input_shape)
-        cur = con.cursor(dictionary=True)
+        cur = con.cursor()
         try:
             args = helper.build_parameters(sql, input_shape, self.get_value_converter)
             cur.execute(sql["content"], args)
             if cur.with_rows:
-                rows = fetch_dict_rows(cur)
+                rows = fetch_row_set(cur, trace=helper.trace)
             else:
-                rows = []
+                rows = RowSet.empty()
             return rows, cur.lastrowid
         finally:
             cur.close()
+
+    def execute_iter(self, twig, input_shape, helper):
+        self._buffer_stream()
+        con = self._conn
+        sql = helper.get_executable_content("%s", twig, input_shape)
+        server_side = use_server_cursor(twig, self._server_cursor)
+        # Buffered unless the twig reads through a server cursor: then rows
+        # stay on the server until read, and a statement sent on this
+        # connection meanwhile (a child branch) buffers the rest first.
+        cur = con.cursor() if server_side else con.cursor(buffered=True)
+        try:
+            args = helper.build_parameters(sql, input_shape, self.get_value_converter)
+            cur.execute(sql["content"], args)
+        except BaseException:
+            cur.close()
+            raise
+        if not cur.with_rows:
+            cur.close()
+            return RowSet.empty(), cur.lastrowid
+        if server_side:
+            self._stream = CursorRows(cur, self._itersize, drain_on_close=True)
+            return RowStream(cursor_columns(cur), self._stream), None
+        return iter_row_stream(cur), cur.lastrowid
+
+    def execute_many(self, twig, input_shapes, helper):
+        self._buffer_stream()
+        cur = self._conn.cursor()
+        try:
+            for content, batch in iter_variant_batches(
+                twig, input_shapes, helper, "%s", self.get_value_converter
+            ):
+                cur.executemany(content, batch)
+            # Multi-row INSERTs report the first generated id, not the last; don't guess.
+            return [], None
+        finally:
+            cur.close()
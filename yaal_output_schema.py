@@ -42,3 +42,39 @@ def normalize_output_model(model):
             new_props[k] = v
     model["properties"] = new_props
     return model
+
+
+def build_output_plan(output_type, output_model, branches):
+    """Precompute how the executor maps rows for one branch (and its children).
+
+    Returns a JSON-serialisable dict: ``type`` (object|array, the model's
+    ``type`` winning over output_type), ``fields`` as ``[key, column]`` pairs
+    in property order (column None marks a nested branch slot) and
+    ``branches`` as ``[name, plan]`` pairs in descriptor order.
+    """
+    model = normalize_output_model(output_model) if output_model else output_model
+    properties = model.get("properties") if isinstance(model, dict) else None
+    if model and "type" in model:
+        output_type = model["type"]
+
+    fields = []
+    if properties:
+        for k, v in properties.items():
+            mapped, nested = None, None
+            if type(v) == str:
+                mapped = v
+            if type(v) == dict:
+                mapped = v.get("mapped")
+                nested = v.get("type")
+            if mapped:
+                fields.append([k, mapped])
+            if nested == "array" or nested == "object":
+                fields.append([k, None])
+
+    children = []
+    for branch in branches or []:
+        name = branch["name"]
+        child_model = properties[name] if properties and name in properties else None
+        children.append([name, build_output_plan(branch["output_type"], child_model, branch.get("branches"))])
+
+    return {"type": output_type, "fields": fields, "branches": children}
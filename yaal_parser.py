@@ -1276,7 +1276,12 @@ def _compile_order_by(stmt, order_idx, sort_map):
     return True, prefix + [", ".join(rendered), trailing_ws], end_idx
 
 
-def compile_sql(sql_stmt, nulls, char, sort_map=None):
+def compile_sql(sql_stmt, nulls, char, sort_map=None, list_sizes=None):
+    """Render a twig to SQL with placeholders for the given null set and sort values.
+
+    list_sizes maps a list parameter (e.g. $parent_keys) to the number of
+    placeholders it expands to; each gets a parameter entry with its "index".
+    """
     if "parameters" in sql_stmt:
         parameters_meta = {x["name"]: x for x in sql_stmt["parameters"]}
     else:
@@ -1360,8 +1365,14 @@ def compile_sql(sql_stmt, nulls, char, sort_map=None):
                 skip_or_after_nullable = True
                 idx += 1
                 continue
-            tokens.append(char)
-            parameters.append(parameters_meta[token["name"]])
+            list_size = list_sizes.get(token["name"]) if list_sizes else None
+            if list_size:
+                tokens.append(", ".join([char] * list_size))
+                meta = parameters_meta[token["name"]]
+                parameters.extend(dict(meta, index=i) for i in range(list_size))
+            else:
+                tokens.append(char)
+                parameters.append(parameters_meta[token["name"]])
         else:
             tokens.append(token.get("value", ""))
 
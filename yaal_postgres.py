@@ -2,17 +2,28 @@
 # Use of this source code is governed by a MIT style
 # license that can be found in the LICENSE file.
 
+import itertools
+
 import psycopg2 as pg
 from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import execute_batch
 
 from yaal_provider import (
+    DEFAULT_FETCH_BATCH_SIZE,
     commit_then_close,
-    fetch_dict_rows,
+    fetch_row_set,
+    iter_row_stream,
+    iter_variant_batches,
     parse_pool_int,
     rollback_then_close,
+    rollback_then_release,
+    server_cursor_options,
+    use_server_cursor,
 )
 
+# Named cursors only need to be unique within a transaction.
+_CURSOR_IDS = itertools.count(1)
+
 
 _CONNECT_QUERY_KEYS = (
     "sslmode",
@@ -48,16 +59,19 @@ class PostgresContextManager:
         if minconn > maxconn:
             minconn = maxconn
         self._pool = pool.SimpleConnectionPool(minconn, maxconn, **kwargs)
+        self._server_cursor, self._itersize = server_cursor_options(query)
 
     def get_context(self):
-        return PostgresDataProvider(self._pool)
+        return PostgresDataProvider(self._pool, self._server_cursor, self._itersize)
 
 
 class PostgresDataProvider:
 
-    def __init__(self, pool):
+    def __init__(self, pool, server_cursor=False, itersize=DEFAULT_FETCH_BATCH_SIZE):
         self._pool = pool
         self._conn = None
+        self._server_cursor = server_cursor
+        self._itersize = itersize
 
     def begin(self):
         self._conn = self._pool.getconn()
@@ -72,6 +86,12 @@ class PostgresDataProvider:
         self._conn = None
         rollback_then_close(conn, release=self._pool.putconn)
 
+    def release(self):
+        """Finish without committing (read-only sessions); the connection stays pooled."""
+        conn = self._conn
+        self._conn = None
+        rollback_then_release(conn, release=self._pool.putconn)
+
     @staticmethod
     def get_value_converter(param_type, value):
         if param_type == "blob":
@@ -82,23 +102,70 @@ class PostgresDataProvider:
     def _last_inserted_id(cur, rows):
         if not (cur.statusmessage and cur.statusmessage.startswith("INSERT")):
             return None
-        if not rows or len(rows) != 1:
+        if len(rows) != 1:
             return None
-        row = rows[0]
-        if "id" in row:
-            return row["id"]
+        row = rows.rows[0]
+        if "id" in rows.index:
+            return row[rows.index["id"]]
         if len(row) == 1:
-            return next(iter(row.values()))
+            return row[0]
         return None
 
+    def _cursor(self, twig):
+        """(cursor, server_side): a named cursor when the twig reads through one.
+
+        Named cursors live on the server and send itersize rows per round
+        trip, so libpq never holds the whole result set.
+        """
+        if not use_server_cursor(twig, self._server_cursor):
+            return self._conn.cursor(), False
+        cur = self._conn.cursor(name="yaal_%d" % next(_CURSOR_IDS))
+        cur.itersize = self._itersize
+        return cur, True
+
     def execute(self, twig, input_shape, helper):
-        con = self._conn
         sql = helper.get_executable_content("%s", twig, input_shape)
-        cur = con.cursor(cursor_factory=RealDictCursor)
+        cur, server_side = self._cursor(twig)
         try:
             args = helper.build_parameters(sql, input_shape, self.get_value_converter)
             cur.execute(sql["content"], args)
-            rows = [dict(row) for row in fetch_dict_rows(cur)]
+            if server_side:
+                rows = fetch_row_set(cur, batch_size=self._itersize, server_side=True,
+                                     trace=helper.trace)
+                return rows, None
+            rows = fetch_row_set(cur, trace=helper.trace)
             return rows, self._last_inserted_id(cur, rows)
         finally:
             cur.close()
+
+    def execute_iter(self, twig, input_shape, helper):
+        sql = helper.get_executable_content("%s", twig, input_shape)
+        cur, server_side = self._cursor(twig)
+        try:
+            args = helper.build_parameters(sql, input_shape, self.get_value_converter)
+            cur.execute(sql["content"], args)
+            if server_side:
+                return iter_row_stream(cur, batch_size=self._itersize, server_side=True), None
+            if cur.statusmessage and cur.statusmessage.startswith("INSERT"):
+                # INSERT ... RETURNING feeds $last_inserted_id; read it up front.
+                rows = fetch_row_set(cur, trace=helper.trace)
+                last_inserted_id = self._last_inserted_id(cur, rows)
+                cur.close()
+                return rows, last_inserted_id
+        except BaseException:
+            cur.close()
+            raise
+        return iter_row_stream(cur), None
+
+    def execute_many(self, twig, input_shapes, helper):
+        cur = self._conn.cursor()
+        try:
+            for content, batch in iter_variant_batches(
+                twig, input_shapes, helper, "%s", self.get_value_converter
+            ):
+                # execute_batch sends many statements per round trip (executemany does one each).
+                execute_batch(cur, content, batch, page_size=len(batch))
+            # Without RETURNING there is no id to report (same as execute).
+            return [], None
+        finally:
+            cur.close()
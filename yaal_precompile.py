@@ -35,6 +35,7 @@ def _strip_validators(descriptor):
     if not isinstance(descriptor, dict):
         return
     descriptor.pop("_validators", None)
+    descriptor.pop("_mapper", None)
     for branch in descriptor.get("branches") or []:
         _strip_validators(branch)
 
@@ -81,9 +82,17 @@ def artifact_filename(path, output_mapper=None):
     return "%s.json" % path
 
 
-def compile_api(api_root, out_dir, *, list_paths=None):
+def codegen_filename(path, output_mapper=None):
+    """Generated mapper source written beside the artifact (compile --codegen)."""
+    return artifact_filename(path, output_mapper)[: -len(".json")] + ".py"
+
+
+def compile_api(api_root, out_dir, *, list_paths=None, codegen=False):
     """Compile all descriptors under api_root into JSON files under out_dir.
 
+    codegen=True also writes each descriptor's generated row mapper
+    (yaal_codegen) as a .py file next to its JSON artifact.
+
     Returns list of written relative artifact paths.
     """
     from yaal import Yaal
@@ -117,6 +126,13 @@ def compile_api(api_root, out_dir, *, list_paths=None):
                 json.dump(data, f, indent=2, sort_keys=True)
                 f.write("\n")
             written.append(rel.replace(os.sep, "/"))
+            if codegen:
+                from yaal_codegen import generate_source
+
+                rel = codegen_filename(path, mapper)
+                with open(out_dir / rel, "w", encoding="utf-8") as f:
+                    f.write(generate_source(descriptor))
+                written.append(rel.replace(os.sep, "/"))
     return written
 
 
@@ -129,3 +145,7 @@ def load_precompiled_file(file_path):
 def resolve_precompiled_path(precompiled_dir, descriptor_path, output_mapper=None):
     rel = artifact_filename(descriptor_path, output_mapper)
     return Path(precompiled_dir) / rel
+
+
+def resolve_codegen_path(precompiled_dir, descriptor_path, output_mapper=None):
+    return Path(precompiled_dir) / codegen_filename(descriptor_path, output_mapper)
@@ -4,18 +4,35 @@
 
 """Shared data-provider lifecycle helpers (commit / rollback / close) and row streaming."""
 
+import asyncio
+import collections
+import functools
+import threading
+import time
+
+from yaal_rows import RowSet, RowStream
 
 DEFAULT_FETCH_BATCH_SIZE = 1000
 
 
-def fetch_dict_rows(cursor, *, batch_size=DEFAULT_FETCH_BATCH_SIZE):
-    """Drain a DB-API cursor into a list of row dicts via fetchmany (no fetchall).
+def cursor_columns(cursor):
+    """Column names of a DB-API cursor's result set."""
+    return tuple(col[0] for col in cursor.description)
+
 
-    Assumes the cursor already yields mapping rows (e.g. sqlite row_factory,
-    RealDictCursor, MySQL dictionary=True). Returns [] when there is no result set.
+def fetch_row_set(cursor, *, batch_size=DEFAULT_FETCH_BATCH_SIZE, server_side=False, trace=None):
+    """Drain a DB-API cursor of tuple rows into a RowSet via fetchmany.
+
+    The cursor must yield plain sequence rows, which share one column
+    index. Returns an empty RowSet when there is no result set. server_side
+    cursors (Postgres named cursors) only describe their columns once the
+    first batch has been fetched.
+    trace (the helper's yaal_trace.TwigTrace, or None) gets the fetch time.
     """
-    if cursor.description is None:
-        return []
+    if cursor.description is None and not server_side:
+        return RowSet.empty()
+    if trace is not None:
+        started = time.perf_counter()
     rows = []
     size = batch_size if batch_size and batch_size > 0 else DEFAULT_FETCH_BATCH_SIZE
     while True:
@@ -23,22 +40,191 @@ def fetch_dict_rows(cursor, *, batch_size=DEFAULT_FETCH_BATCH_SIZE):
         if not batch:
             break
         rows.extend(batch)
-    return rows
+    if trace is not None:
+        trace.add("fetch", time.perf_counter() - started, started)
+    if cursor.description is None:
+        return RowSet.empty()
+    return RowSet(cursor_columns(cursor), rows)
 
 
-def fetch_mapped_rows(rows_raw, column_names, *, batch_size=DEFAULT_FETCH_BATCH_SIZE):
-    """Build row dicts from a sequence of tuples, in batches (for drivers without cursors)."""
-    rows = []
+def _iter_tuples(cursor, size, first=()):
+    try:
+        yield from first
+        while True:
+            batch = cursor.fetchmany(size)
+            if not batch:
+                break
+            yield from batch
+    finally:
+        cursor.close()
+
+
+def iter_row_stream(cursor, *, batch_size=DEFAULT_FETCH_BATCH_SIZE, server_side=False):
+    """Stream tuple rows from a DB-API cursor as a RowStream, closing it when done.
+
+    The streaming counterpart of fetch_row_set. A cursor without a result
+    set is closed at once and gives an empty RowSet. A server_side cursor
+    has its first batch fetched here, since that is when it learns its
+    columns.
+    """
     size = batch_size if batch_size and batch_size > 0 else DEFAULT_FETCH_BATCH_SIZE
-    buf = []
-    for raw in rows_raw:
-        buf.append(dict(zip(column_names, raw)))
-        if len(buf) >= size:
-            rows.extend(buf)
-            buf = []
-    if buf:
-        rows.extend(buf)
-    return rows
+    first = ()
+    if server_side and cursor.description is None:
+        try:
+            first = cursor.fetchmany(size)
+        except BaseException:
+            cursor.close()
+            raise
+    if cursor.description is None:
+        cursor.close()
+        return RowSet.empty()
+    return RowStream(cursor_columns(cursor), _iter_tuples(cursor, size, first))
+
+
+class CursorRows:
+    """Tuple rows read from a cursor by fetchmany, with buffer() to read the rest now.
+
+    For unbuffered (server-side) MySQL results, which must be read in full
+    before the connection runs another statement: the provider calls
+    buffer() first and iteration carries on from memory.
+    """
+
+    def __init__(self, cursor, size, *, drain_on_close=False):
+        self._cursor = cursor
+        self._size = size
+        self._pending = collections.deque()
+        # Unbuffered MySQL results must be read to the end before the cursor closes.
+        self._drain_on_close = drain_on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._pending:
+            if self._cursor is None:
+                raise StopIteration
+            batch = self._cursor.fetchmany(self._size)
+            if not batch:
+                self.close()
+                raise StopIteration
+            self._pending.extend(batch)
+        return self._pending.popleft()
+
+    @property
+    def open(self):
+        return self._cursor is not None
+
+    def buffer(self):
+        """Read the remaining rows into memory and close the cursor."""
+        if self._cursor is None:
+            return
+        while True:
+            batch = self._cursor.fetchmany(self._size)
+            if not batch:
+                break
+            self._pending.extend(batch)
+        self.close()
+
+    def close(self):
+        cursor = self._cursor
+        self._cursor = None
+        if cursor is None:
+            return
+        try:
+            if self._drain_on_close:
+                while cursor.fetchmany(self._size):
+                    pass
+        finally:
+            cursor.close()
+
+
+def server_cursor_options(query):
+    """(server_cursor, itersize) from the URL query keys server_cursor and itersize.
+
+    server_cursor=true makes server-side cursors the default for reads whose
+    descriptor does not set server_cursor; itersize is the rows fetched per
+    round trip from them (default DEFAULT_FETCH_BATCH_SIZE).
+    """
+    query = query or {}
+    enabled = str(query.get("server_cursor", "")).lower() in ("1", "true", "yes")
+    itersize = parse_pool_int(query, "itersize", DEFAULT_FETCH_BATCH_SIZE, maximum=1000000)
+    return enabled, itersize
+
+
+def use_server_cursor(twig, default):
+    """Whether a twig reads through a server-side cursor.
+
+    The builder sets twig["server_cursor"]: False for statements that cannot
+    (writes, non-SELECT), the descriptor's server_cursor: setting otherwise,
+    None when the descriptor leaves it to the connection URL (default).
+    """
+    server = twig.get("server_cursor", False)
+    if server is None:
+        return default
+    return server
+
+
+def iter_variant_batches(twig, input_shapes, helper, char, get_value_converter):
+    """Yield (sql, [args, ...]) for runs of consecutive items compiling to the same SQL.
+
+    Optional filters and sort() can give items different variants; each run
+    keeps item order so executemany sees the same sequence as per-item calls.
+    """
+    content, batch = None, []
+    for input_shape in input_shapes:
+        helper.clear_cache()
+        sql = helper.get_executable_content(char, twig, input_shape)
+        args = helper.build_parameters(sql, input_shape, get_value_converter)
+        if batch and sql["content"] != content:
+            yield content, batch
+            batch = []
+        content = sql["content"]
+        batch.append(args)
+    if batch:
+        yield content, batch
+
+
+class ThreadOffloadProvider:
+    """Async provider protocol over a sync provider: every call runs on an executor thread.
+
+    ``executor`` is a concurrent.futures executor (None = the loop's default);
+    a small shared pool lets many concurrent requests wait on the database
+    without blocking the event loop. Calls are serialized per provider, so a
+    rollback after cancellation waits for an in-flight execute to return.
+    """
+
+    def __init__(self, provider, executor=None):
+        self._provider = provider
+        self._executor = executor
+        self._lock = threading.Lock()
+        if hasattr(provider, "execute_many"):
+            # Only offered when the wrapped provider batches (see executemany_batch_size).
+            self.execute_many = self._execute_many
+
+    def _locked(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self._locked, fn, *args)
+        )
+
+    async def begin(self):
+        await self._call(self._provider.begin)
+
+    async def end(self):
+        await self._call(self._provider.end)
+
+    async def error(self):
+        await self._call(self._provider.error)
+
+    async def execute(self, twig, input_shape, helper):
+        return await self._call(self._provider.execute, twig, input_shape, helper)
+
+    async def _execute_many(self, twig, input_shapes, helper):
+        return await self._call(self._provider.execute_many, twig, input_shapes, helper)
 
 
 def commit_then_close(conn, *, release=None):
@@ -73,6 +259,22 @@ def rollback_then_close(conn, *, release=None):
     _release(conn, release=release, close=True)
 
 
+def rollback_then_release(conn, *, release=None):
+    """End a read-only transaction: rollback, then hand the connection back for reuse.
+
+    Unlike rollback_then_close, ``release`` gets close=False so pooled
+    connections stay in the pool; a failed rollback discards the connection.
+    """
+    if not conn:
+        return
+    try:
+        conn.rollback()
+    except Exception:
+        _release(conn, release=release, close=True)
+        return
+    _release(conn, release=release, close=False)
+
+
 def _release(conn, *, release=None, close=True):
     if release is not None:
         try:
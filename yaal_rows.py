@@ -0,0 +1,231 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Result rows as plain tuples sharing one column index.
+
+Providers hand the executor a RowSet (or a RowStream when streaming); rows
+stay tuples through $mode handling, partition stitching and output mapping,
+and dicts are built once, by the output mapper. Lists of row dicts (the
+original provider protocol) are converted on entry.
+"""
+
+from abc import ABC, abstractmethod
+from types import MappingProxyType
+
+MISSING = object()
+# Shared read-only children map of row sets with nothing attached (most of them).
+_NO_CHILDREN = MappingProxyType({})
+
+
+def _column_index(columns):
+    return {name: pos for pos, name in enumerate(columns)}
+
+
+class RowSet:
+    """Rows of one result: tuples plus a shared column index.
+
+    children maps a child branch name to a list aligned with rows holding
+    the child output attached to each row (a RowSet, shared between rows
+    when the child is not partitioned); attach() adds one. columns is None for opaque values
+    ($mode json documents that are not objects); rows then holds the values.
+    Sparse sets (from dicts with differing keys) mark absent cells MISSING.
+    """
+
+    __slots__ = ("columns", "index", "rows", "children", "sparse")
+
+    def __init__(self, columns, rows, children=None, index=None, sparse=False):
+        self.columns = columns
+        if index is None and columns is not None:
+            index = _column_index(columns)
+        self.index = index
+        self.rows = rows
+        self.children = children or _NO_CHILDREN
+        self.sparse = sparse
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __repr__(self):
+        return "RowSet(%r)" % (self.dicts(),)
+
+    @classmethod
+    def empty(cls):
+        return cls((), [])
+
+    @classmethod
+    def from_dicts(cls, rows, child_names=()):
+        """Convert row dicts; keys named in child_names become attached children."""
+        rows = list(rows)
+        if not rows:
+            return cls.empty()
+        if not all(type(row) is dict for row in rows):
+            return cls(None, rows)
+        columns = [k for k in rows[0] if k not in child_names]
+        known = set(columns)
+        sparse = False
+        for row in rows:
+            width = sum(1 for k in row if k not in child_names)
+            if width != len(columns) or any(k not in known for k in row if k not in child_names):
+                sparse = True
+                for k in row:
+                    if k not in known and k not in child_names:
+                        known.add(k)
+                        columns.append(k)
+        if sparse:
+            tuples = [tuple(row.get(c, MISSING) for c in columns) for row in rows]
+        else:
+            tuples = [tuple(row[c] for c in columns) for row in rows]
+        children = None
+        for name in child_names:
+            if any(name in row for row in rows):
+                children = children or {}
+                children[name] = [_as_child(row.get(name)) for row in rows]
+        return cls(tuple(columns), tuples, children, sparse=sparse)
+
+    @classmethod
+    def concat(cls, parts):
+        """Join the row sets of successive executions (array payload items)."""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        if len(parts) == 1:
+            return parts[0]
+        first = parts[0]
+        if all(p.columns == first.columns and not p.children and not p.sparse for p in parts):
+            rows = []
+            for part in parts:
+                rows.extend(part.rows)
+            return cls(first.columns, rows, index=first.index)
+        dicts = []
+        for part in parts:
+            dicts.extend(part.dicts())
+        return cls.from_dicts(dicts)
+
+    def column(self, name, side):
+        """Values of column name, one per row; KeyError when a row lacks it."""
+        if not self.rows:
+            return []
+        pos = None if self.index is None else self.index.get(name)
+        if pos is None:
+            raise KeyError("partition_by column '%s' missing from %s row" % (name, side))
+        values = [row[pos] for row in self.rows]
+        if self.sparse and any(value is MISSING for value in values):
+            raise KeyError("partition_by column '%s' missing from %s row" % (name, side))
+        return values
+
+    def first_row_items(self):
+        """(column, value) pairs of the first row."""
+        row = self.rows[0]
+        if self.columns is None:
+            return list(row.items()) if type(row) is dict else []
+        return [(c, v) for c, v in zip(self.columns, row) if v is not MISSING]
+
+    def take(self, positions):
+        """RowSet of the rows at positions; their children come along."""
+        rows = self.rows
+        children = None
+        if self.children:
+            children = {
+                name: [values[i] for i in positions] for name, values in self.children.items()
+            }
+        return RowSet(self.columns, [rows[i] for i in positions], children, self.index, self.sparse)
+
+    def copy(self):
+        """The same rows with an independent children map (parent_rows branches)."""
+        return RowSet(self.columns, self.rows, dict(self.children), self.index, self.sparse)
+
+    def attach(self, name, values):
+        """Attach child branch output, one entry per row."""
+        if self.children is _NO_CHILDREN:
+            self.children = {}
+        self.children[name] = values
+
+    def drop_column(self, name):
+        pos = self.index[name]
+        columns = self.columns[:pos] + self.columns[pos + 1:]
+        rows = [row[:pos] + row[pos + 1:] for row in self.rows]
+        return RowSet(columns, rows, dict(self.children), sparse=self.sparse)
+
+    def row_dict(self, i):
+        """Row i as a fresh dict, children included as raw row dicts."""
+        row = self.rows[i]
+        if self.columns is None:
+            return row
+        d = {c: v for c, v in zip(self.columns, row) if v is not MISSING}
+        for name, values in self.children.items():
+            d[name] = _raw(values[i])
+        return d
+
+    def dicts(self):
+        """Rows as fresh dicts (raw, unmapped); for errors, debugging and tests."""
+        return [self.row_dict(i) for i in range(len(self.rows))]
+
+
+class RowStream:
+    """Lazily read rows: tuples sharing columns, plus close() for the cursor."""
+
+    __slots__ = ("columns", "index", "rows")
+
+    def __init__(self, columns, rows):
+        self.columns = tuple(columns)
+        self.index = _column_index(self.columns)
+        self.rows = rows
+
+    @classmethod
+    def from_dicts(cls, first, rows):
+        """Stream row dicts as tuples in the first row's column order."""
+        columns = tuple(first)
+        width = len(columns)
+
+        def tuples():
+            try:
+                yield tuple(first.values())
+                for row in rows:
+                    if len(row) != width:
+                        raise ValueError("streamed rows must share the first row's columns")
+                    yield tuple(row[c] for c in columns)
+            finally:
+                close = getattr(rows, "close", None)
+                if close is not None:
+                    close()
+
+        return cls(columns, tuples())
+
+    def close(self):
+        close = getattr(self.rows, "close", None)
+        if close is not None:
+            close()
+
+
+class DeferredRows(ABC):
+    """A child group read on demand (yaal_spill's spilled groups); load() returns its RowSet."""
+
+    __slots__ = ()
+
+    @abstractmethod
+    def load(self):
+        """Return the group's rows as a RowSet."""
+
+
+def _as_child(value):
+    if isinstance(value, RowSet):
+        return value
+    if type(value) is list:
+        return RowSet.from_dicts(value)
+    return value
+
+
+def _raw(value):
+    if isinstance(value, DeferredRows):
+        value = value.load()
+    if isinstance(value, RowSet):
+        return value.dicts()
+    return value
+
+
+def as_row_set(rows):
+    """A provider's rows as a RowSet (row dict lists are converted)."""
+    if isinstance(rows, RowSet):
+        return rows
+    return RowSet.from_dicts(rows or [])
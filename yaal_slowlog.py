@@ -0,0 +1,137 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Slow-query log: Yaal(slow_query_log={"threshold_ms": 250, "path": "slow.jsonl"}).
+
+Every query is traced (yaal_trace) with its provider calls recorded: the
+compiled SQL from get_executable_content, the bind values, the variant it
+was compiled for (optional(...) parameters that were null, sort() / dir()
+choices, $parent_keys list size), duration and rows returned. When the
+request took threshold_ms or longer, one record goes to the sink:
+
+    {"ts": "...", "path": "user/list", "duration_ms": 812.4, "threshold_ms": 250,
+     "status": "ok", "rows": 10, "statements_total": 2,
+     "statements": [{"branch": "$", "twig": 0, "connection": "db", "sql": "...",
+                     "fingerprint": "...", "parameters": ["$args.active"],
+                     "binds": [1], "variant": {"nulls": [], "sort": {"$args.sort": "u.user_id ASC"},
+                     "placeholder": "?", "parent_keys": null},
+                     "duration_ms": 801.2, "rows": 10}, ...]}
+
+Only the max_statements slowest calls are kept (in execution order);
+statements_total counts them all. A sink is anything with write(record);
+JsonLinesSink, the default, appends one JSON line per record.
+"""
+
+import datetime
+import json
+import threading
+
+DEFAULT_SLOW_LOG_PATH = "yaal-slow-queries.jsonl"
+REDACTED = "***"
+
+
+class JsonLinesSink:
+    """Append records to a file, one JSON object per line (opened on first write)."""
+
+    def __init__(self, path=DEFAULT_SLOW_LOG_PATH):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, default=str, separators=(",", ":"))
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _redactor(redact):
+    """redact -> None or f(name, value): True hides every bind, names / a callable pick."""
+    if not redact:
+        return None
+    if redact is True:
+        return lambda _name, _value: REDACTED
+    if callable(redact):
+        return redact
+    names = frozenset(redact)
+
+    def by_name(name, value):
+        # "$args.password" matches "$args.password" or "password".
+        if name in names or name.rsplit(".", 1)[-1] in names:
+            return REDACTED
+        return value
+
+    return by_name
+
+
+class SlowQueryLog:
+    """Write a record to sink for each request slower than threshold_ms; see the module doc.
+
+    redact: False keeps bind values, True replaces them all, a collection
+    of parameter names replaces those (full "$args.x" or last segment), and
+    a callable(name, value) returns the value to log.
+    """
+
+    def __init__(self, *, threshold_ms=1000, sink=None, path=DEFAULT_SLOW_LOG_PATH,
+                 redact=False, max_statements=50):
+        if not isinstance(threshold_ms, (int, float)) or threshold_ms < 0:
+            raise ValueError("slow_query_log threshold_ms must be a non-negative number")
+        if type(max_statements) is not int or max_statements < 1:
+            raise ValueError("slow_query_log max_statements must be a positive integer")
+        self.threshold_ms = threshold_ms
+        self.sink = sink if sink is not None else JsonLinesSink(path)
+        self.max_statements = max_statements
+        self._redact = _redactor(redact)
+
+    @classmethod
+    def from_value(cls, value):
+        """None, a SlowQueryLog, or a dict of SlowQueryLog keyword arguments."""
+        if value is None or isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls(**value)
+        raise TypeError("slow_query_log must be a dict or SlowQueryLog")
+
+    def observe(self, trace):
+        """Write trace (a finished yaal_trace.QueryTrace) if it is slow enough."""
+        duration_ms = trace.total * 1000.0
+        if duration_ms < self.threshold_ms:
+            return
+        self.sink.write(self.record(trace, duration_ms))
+
+    def record(self, trace, duration_ms):
+        statements = trace.statements()
+        redact = self._redact
+        if redact is not None:
+            statements = [
+                dict(statement, binds=[
+                    redact(name, value)
+                    for name, value in zip(statement["parameters"], statement["binds"])
+                ])
+                for statement in statements
+            ]
+        block = trace.to_dict()
+        return {
+            "ts": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "path": trace.path,
+            "duration_ms": round(duration_ms, 3),
+            "threshold_ms": self.threshold_ms,
+            "status": block.get("status"),
+            "rows": block["rows"],
+            "statements_total": trace.statement_count,
+            "statements": statements,
+        }
+
+    def close(self):
+        close = getattr(self.sink, "close", None)
+        if close is not None:
+            close()
@@ -0,0 +1,235 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Per-request memory budget: Yaal(memory_budget={"spill_rows": ..., "max_rows": ...}).
+
+The executor charges the rows it buffers to the request's RequestBudget a
+batch at a time, as they are read. Once more than spill_rows / spill_bytes
+are held, the rows of a child branch that its parent groups by
+partition_by (the builder marks it "spill_key") go to a temporary SQLite
+file indexed on the partition key instead, and each parent's group is read
+back when it is mapped. Past max_rows / max_bytes buffered, spilled rows
+included, the request stops with a soft error. Bytes are an estimate: one
+sampled row per batch (sys.getsizeof of the tuple and its values) times
+the batch length.
+"""
+
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+import threading
+
+from yaal_errors import MemoryBudgetError
+from yaal_provider import DEFAULT_FETCH_BATCH_SIZE
+from yaal_rows import DeferredRows, RowSet
+
+_LIMITS = ("spill_rows", "spill_bytes", "max_rows", "max_bytes")
+# SQLite INTEGER range; other keys are stored pickled.
+_MIN_INT, _MAX_INT = -2 ** 63, 2 ** 63 - 1
+
+
+def estimate_bytes(rows):
+    """Rough in-memory size of a list of row tuples, from its first row."""
+    if not rows:
+        return 0
+    row = rows[0]
+    size = sys.getsizeof(row)
+    if type(row) is tuple:
+        size += sum(sys.getsizeof(value) for value in row)
+    return size * len(rows)
+
+
+class MemoryBudget:
+    """Limits for one request; see the module doc. None disables a limit."""
+
+    def __init__(self, *, spill_rows=None, spill_bytes=None, max_rows=None, max_bytes=None,
+                 spill_dir=None, batch_size=DEFAULT_FETCH_BATCH_SIZE):
+        limits = (spill_rows, spill_bytes, max_rows, max_bytes, batch_size)
+        for name, value in zip(_LIMITS + ("batch_size",), limits):
+            if value is not None and (type(value) is not int or value < 1):
+                raise ValueError("memory_budget %s must be a positive integer" % name)
+        self.spill_rows = spill_rows
+        self.spill_bytes = spill_bytes
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.batch_size = batch_size or DEFAULT_FETCH_BATCH_SIZE
+
+    @classmethod
+    def from_value(cls, value):
+        """None, a MemoryBudget, or a dict of MemoryBudget keyword arguments."""
+        if value is None or isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls(**value)
+        raise TypeError("memory_budget must be a dict or MemoryBudget")
+
+    def start(self):
+        return RequestBudget(self)
+
+
+class RequestBudget:
+    """Rows buffered by one request so far, and the spill files it created.
+
+    Thread safe: prefetched branches charge it from worker threads.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.rows = 0
+        self.bytes = 0
+        self.held_rows = 0
+        self.held_bytes = 0
+        self._stores = []
+        self._lock = threading.Lock()
+
+    def charge(self, rows, held=True):
+        """Count rows (a list of tuples); returns their estimated bytes.
+
+        held=False counts rows that went straight to a spill file. Raises
+        MemoryBudgetError past max_rows / max_bytes.
+        """
+        nbytes = estimate_bytes(rows)
+        limits = self.limits
+        with self._lock:
+            self.rows += len(rows)
+            self.bytes += nbytes
+            if held:
+                self.held_rows += len(rows)
+                self.held_bytes += nbytes
+            over = _over(self.rows, self.bytes, limits.max_rows, limits.max_bytes)
+        if over:
+            raise MemoryBudgetError(
+                "request exceeded its memory budget: %d rows (~%d bytes) read, "
+                "max_rows=%s max_bytes=%s"
+                % (self.rows, self.bytes, limits.max_rows, limits.max_bytes)
+            )
+        return nbytes
+
+    def release(self, count, nbytes):
+        """Rows moved to a spill file no longer count as held."""
+        with self._lock:
+            self.held_rows -= count
+            self.held_bytes -= nbytes
+
+    def should_spill(self):
+        limits = self.limits
+        return _over(self.held_rows, self.held_bytes, limits.spill_rows, limits.spill_bytes)
+
+    def spill_store(self, columns, partition_by):
+        store = SpilledRows(columns, partition_by, self.limits.spill_dir)
+        with self._lock:
+            self._stores.append(store)
+        return store
+
+    @property
+    def spilled(self):
+        return sum(len(store) for store in self._stores)
+
+    def close(self):
+        """Delete the request's spill files; groups cannot be loaded afterwards."""
+        with self._lock:
+            stores, self._stores = self._stores, []
+        for store in stores:
+            store.close()
+
+
+def _over(rows, nbytes, max_rows, max_bytes):
+    return (max_rows is not None and rows > max_rows) or \
+        (max_bytes is not None and nbytes > max_bytes)
+
+
+def _spill_key(value):
+    """partition_by value as stored: SQLite compares these like Python's ==."""
+    value_type = type(value)
+    if value is None or value_type is str or value_type is float:
+        return value
+    if value_type is bool:
+        return int(value)
+    if value_type is int and _MIN_INT <= value <= _MAX_INT:
+        return value
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _dump_row(row):
+    try:
+        return pickle.dumps(row, pickle.HIGHEST_PROTOCOL)
+    except TypeError:
+        # Driver buffers (psycopg2 bytea) do not pickle; keep their bytes.
+        return pickle.dumps(
+            tuple(bytes(v) if isinstance(v, memoryview) else v for v in row),
+            pickle.HIGHEST_PROTOCOL,
+        )
+
+
+class SpilledRows:
+    """Child rows in a temporary SQLite table, read back one partition_by group at a time."""
+
+    def __init__(self, columns, partition_by, directory=None):
+        self.columns = tuple(columns)
+        self.index = {name: pos for pos, name in enumerate(self.columns)}
+        self._pos = self.index.get(partition_by)
+        if self._pos is None:
+            raise KeyError("partition_by column '%s' missing from child row" % partition_by)
+        fd, self._path = tempfile.mkstemp(prefix="yaal-spill-", suffix=".db", dir=directory)
+        os.close(fd)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(self._path, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=OFF")
+        self._con.execute("PRAGMA synchronous=OFF")
+        self._con.execute("CREATE TABLE spill (pos INTEGER PRIMARY KEY, k, v BLOB NOT NULL)")
+
+    def __len__(self):
+        return self._count
+
+    def add(self, rows):
+        pos = self._pos
+        with self._lock:
+            self._con.executemany(
+                "INSERT INTO spill (k, v) VALUES (?, ?)",
+                [(_spill_key(row[pos]), _dump_row(row)) for row in rows],
+            )
+            self._count += len(rows)
+
+    def finish(self):
+        """Index the partition key once every row is in."""
+        with self._lock:
+            self._con.execute("CREATE INDEX spill_k ON spill (k)")
+            self._con.commit()
+
+    def group(self, key):
+        return SpilledGroup(self, key)
+
+    def load(self, key):
+        """RowSet of the rows whose partition_by value equals key, in read order."""
+        with self._lock:
+            cur = self._con.execute(
+                "SELECT v FROM spill WHERE k IS ? ORDER BY pos", (_spill_key(key),)
+            )
+            rows = [pickle.loads(v) for (v,) in cur]
+        return RowSet(self.columns, rows, index=self.index)
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+
+class SpilledGroup(DeferredRows):
+    """One parent's child group in a SpilledRows store."""
+
+    __slots__ = ("_store", "_key")
+
+    def __init__(self, store, key):
+        self._store = store
+        self._key = key
+
+    def load(self):
+        return self._store.load(self._key)
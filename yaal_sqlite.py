@@ -3,58 +3,98 @@
 # license that can be found in the LICENSE file.
 
 import sqlite3
+import threading
 from urllib.parse import urlencode
 
-from yaal_provider import commit_then_close, fetch_dict_rows, rollback_then_close
+from yaal_provider import (
+    commit_then_close,
+    fetch_row_set,
+    iter_row_stream,
+    iter_variant_batches,
+    rollback_then_close,
+    rollback_then_release,
+)
+
+
+def _connect(options):
+    # check_same_thread=False: with max_branch_workers a branch may run on a
+    # pool thread; the executor still never uses one connection concurrently.
+    database = options.get("database") or ":memory:"
+    query = options.get("query") or {}
+    if query:
+        if database == ":memory:":
+            uri = "file::memory:?%s" % urlencode(query)
+        else:
+            uri = "file:%s?%s" % (database, urlencode(query))
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+    return sqlite3.connect(database, check_same_thread=False)
 
 
 class SQLiteContextManager:
 
     def __init__(self, options):
         self._options = options
+        self._watch = None
+        self._watch_lock = threading.Lock()
+        self._commits = 0
 
     def get_context(self):
-        return SQLiteDataProvider(self._options)
+        return SQLiteDataProvider(self._options, on_commit=self._count_commit)
+
+    def _count_commit(self):
+        with self._watch_lock:
+            self._commits += 1
+
+    def data_version(self):
+        """Token that changes whenever the database file may have changed.
+
+        Pairs ``PRAGMA data_version`` of a private, never-writing connection
+        (bumped by commits from any other connection, including other
+        processes) with a count of this manager's own committed writes.
+        """
+        with self._watch_lock:
+            if self._watch is None:
+                self._watch = _connect(self._options)
+                self._watch.isolation_level = None
+            return self._watch.execute("PRAGMA data_version").fetchone()[0], self._commits
+
+    def close(self):
+        """Close the data_version watch connection, if one was opened."""
+        with self._watch_lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
 
 
 class SQLiteDataProvider:
 
-    def __init__(self, options):
+    def __init__(self, options, on_commit=None):
         self._options = options
-        self._database = options.get("database") or ""
-        if self._database == "":
-            self._database = ":memory:"
+        self._on_commit = on_commit
         self._con = None
 
-    @staticmethod
-    def _sqlite_dict_factory(cursor, row):
-        d = {}
-        for idx, col in enumerate(cursor.description):
-            d[col[0]] = row[idx]
-        return d
-
     def begin(self):
-        query = self._options.get("query") or {}
-        if query:
-            if self._database == ":memory:":
-                uri = "file::memory:?%s" % urlencode(query)
-            else:
-                uri = "file:%s?%s" % (self._database, urlencode(query))
-            self._con = sqlite3.connect(uri, uri=True)
-        else:
-            self._con = sqlite3.connect(self._database)
-        self._con.row_factory = self._sqlite_dict_factory
+        self._con = _connect(self._options)
 
     def end(self):
         con = self._con
         self._con = None
+        wrote = con is not None and con.total_changes > 0
         commit_then_close(con)
+        if wrote and self._on_commit is not None:
+            self._on_commit()
 
     def error(self):
         con = self._con
         self._con = None
         rollback_then_close(con)
 
+    def release(self):
+        """Finish without committing (read-only sessions)."""
+        con = self._con
+        self._con = None
+        rollback_then_release(con)
+
     @staticmethod
     def get_value(parameter_type, value):
         if parameter_type == "blob":
@@ -68,7 +108,30 @@ class SQLiteDataProvider:
         try:
             args = helper.build_parameters(sql, input_shape, self.get_value)
             cur.execute(sql["content"], args)
-            rows = fetch_dict_rows(cur)
+            rows = fetch_row_set(cur, trace=helper.trace)
             return rows, cur.lastrowid
         finally:
             cur.close()
+
+    def execute_iter(self, twig, input_shape, helper):
+        con = self._con
+        sql = helper.get_executable_content("?", twig, input_shape)
+        cur = con.cursor()
+        try:
+            args = helper.build_parameters(sql, input_shape, self.get_value)
+            cur.execute(sql["content"], args)
+        except BaseException:
+            cur.close()
+            raise
+        return iter_row_stream(cur), cur.lastrowid
+
+    def execute_many(self, twig, input_shapes, helper):
+        con = self._con
+        cur = con.cursor()
+        try:
+            for content, batch in iter_variant_batches(twig, input_shapes, helper, "?", self.get_value):
+                cur.executemany(content, batch)
+            # cursor.lastrowid is not set by executemany; ask the connection.
+            return [], con.execute("SELECT last_insert_rowid() AS id").fetchone()[0]
+        finally:
+            cur.close()
@@ -0,0 +1,553 @@
+# Copyright 2018 Kiruba Sankar Swaminathan. All rights reserved.
+# Use of this source code is governed by a MIT style
+# license that can be found in the LICENSE file.
+
+"""Per-query timings: Yaal.query(..., trace=True) and Yaal.add_trace_callback.
+
+A QueryTrace collects monotonic (time.perf_counter) timers per pipeline
+stage and row / byte counters per branch and twig. Stages do not overlap,
+so they add up to roughly the total:
+
+    load       descriptor load (cached after the first call)
+    validate   args / payload JSON Schema validation
+    compile    compile_sql, for SQL variants not yet in the variant cache
+    execute    the provider call, minus its compile and fetch time
+    fetch      draining the cursor (built-in providers' fetch_row_set)
+    stitch     partition_by grouping and attaching child rows
+    map        output mapping (query_iter: including reading streamed rows)
+    serialize  json.dumps for query_json
+
+The executor only touches a trace when one is passed in; otherwise the cost
+is a None check per twig and branch. Bytes are estimates (see
+yaal_spill.estimate_bytes).
+
+With span exporters (Yaal.add_span_exporter) the same timers are also kept
+as intervals and handed over as nested Spans once the query finishes: one
+"yaal.query" root span, then load / validate / map / ... spans, a span per
+branch run, a span per twig (provider, compiled-SQL fingerprint) and its
+compile / fetch spans. Nesting follows from the intervals on each thread,
+so the executor needs no span bookkeeping of its own. Span fields follow
+the OpenTelemetry data model (hex trace and span ids, unix-nanosecond
+times, db.* attributes); ChromeTraceExporter writes them as Chrome
+trace_event JSON for chrome://tracing, Perfetto or speedscope.
+"""
+
+import collections
+import hashlib
+import heapq
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from yaal_rows import RowSet, RowStream
+from yaal_spill import estimate_bytes
+
+STAGES = ("load", "validate", "compile", "execute", "fetch", "stitch", "map", "serialize")
+
+# OpenTelemetry db.system values of the built-in URL schemes.
+DB_SYSTEMS = {"sqlite3": "sqlite", "postgresql": "postgresql", "mysql": "mysql",
+              "clickhouse": "clickhouse"}
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def sql_fingerprint(sql):
+    """Short stable id of a compiled SQL statement (whitespace-insensitive)."""
+    text = _WHITESPACE.sub(" ", sql).strip()
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def provider_name(execute):
+    """Class name of the provider behind a bound execute method."""
+    return type(getattr(execute, "__self__", execute)).__name__
+
+
+def _ms(seconds):
+    return round(seconds * 1000.0, 3)
+
+
+def _variant(variant):
+    """Readable form of the variant-cache key parts behind a compiled statement."""
+    if variant is None:
+        return None
+    nulls, placeholder, sort_map, list_sizes = variant
+    return {
+        "nulls": sorted(nulls),
+        "sort": dict(sorted((name, value) for name, value in sort_map.items())),
+        "placeholder": placeholder,
+        "parent_keys": (list_sizes or {}).get("$parent_keys"),
+    }
+
+
+def _count(output):
+    """(rows, bytes) of a provider result; (None, None) for a stream not read yet.
+
+    TwigTrace.finish counts streams as they are read instead (_counted).
+    """
+    if isinstance(output, RowSet):
+        return len(output), estimate_bytes(output.rows)
+    if isinstance(output, list):
+        return len(output), estimate_bytes(output)
+    return None, None
+
+
+class TwigTrace:
+    """One provider call; compile_sql and fetch_row_set add their time here."""
+
+    __slots__ = ("_query", "method", "index", "twig", "provider", "sql", "binds", "variant",
+                 "cache_hit", "_started", "_compile", "_fetch")
+
+    def __init__(self, query, method, index, twig, provider=None):
+        self._query = query
+        self.method = method
+        self.index = index
+        self.twig = twig
+        self.provider = provider
+        # Set by DataProviderHelper: compiled SQL text, (names, values) of the
+        # last build_parameters call, the variant (nulls, placeholder, sort
+        # map, $parent_keys size) get_executable_content picked and whether
+        # that variant was already in the variant cache.
+        self.sql = None
+        self.binds = None
+        self.variant = None
+        self.cache_hit = None
+        self._compile = 0.0
+        self._fetch = 0.0
+        self._started = time.perf_counter()
+
+    def add(self, stage, seconds, started=None):
+        if stage == "compile":
+            self._compile += seconds
+        else:
+            self._fetch += seconds
+        self._query._interval(stage, started, seconds)
+
+    def finish(self, output):
+        """Record the call; returns output, wrapped to count rows when it is a stream."""
+        elapsed = time.perf_counter() - self._started
+        rows, nbytes = _count(output)
+        if rows is not None or output is None:
+            self._query._twig_done(self, elapsed, self._compile, self._fetch, rows, nbytes)
+            return output
+        done = self._query._twig_done(self, elapsed, self._compile, self._fetch, None, None,
+                                      streamed=True)
+        if isinstance(output, RowStream):
+            return RowStream(output.columns, self._counted(output.rows, elapsed, done))
+        return self._counted(output, elapsed, done)
+
+    def _counted(self, rows, elapsed, done):
+        """Yield rows; once the stream ends (or is closed) count what was read."""
+        count, first = 0, None
+        try:
+            for row in rows:
+                if not count:
+                    first = row
+                count += 1
+                yield row
+        finally:
+            close = getattr(rows, "close", None)
+            if close is not None:
+                close()
+            nbytes = estimate_bytes([first]) * count if count else 0
+            self._query._stream_done(self, elapsed, done, count, nbytes)
+
+
+class Span:
+    """A finished span, in OpenTelemetry terms.
+
+    trace_id / span_id / parent_span_id are lowercase hex (32 / 16 / 16
+    digits; parent_span_id is None for the root), times are nanoseconds
+    since the epoch, kind is "INTERNAL" or "CLIENT" (provider calls) and
+    status "UNSET", "OK" or "ERROR". thread_id is the recording thread.
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_span_id", "start_time_unix_nano",
+                 "end_time_unix_nano", "kind", "attributes", "status", "thread_id")
+
+    def __init__(self, name, trace_id, span_id, parent_span_id, start_time_unix_nano,
+                 end_time_unix_nano, kind="INTERNAL", attributes=None, status="UNSET",
+                 thread_id=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_span_id = parent_span_id
+        self.start_time_unix_nano = start_time_unix_nano
+        self.end_time_unix_nano = end_time_unix_nano
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.status = status
+        self.thread_id = thread_id
+
+    @property
+    def duration_ns(self):
+        return self.end_time_unix_nano - self.start_time_unix_nano
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "Span(%r, %s, parent=%s)" % (self.name, self.span_id, self.parent_span_id)
+
+
+def _span_id():
+    return "%016x" % random.getrandbits(64)
+
+
+class QueryTrace:
+    """Stage timers and counters for one query; finish() hands them to the callbacks.
+
+    exporters get the query's spans (see the module doc); systems maps a
+    connection name to its db.system attribute. observers are called with
+    the finished QueryTrace itself; with max_statements, statements() lists
+    up to that many of the slowest provider calls with their SQL and binds.
+    listeners are called with (path, statement) after every provider call.
+    """
+
+    def __init__(self, path, callbacks=(), exporters=(), systems=None, observers=(),
+                 max_statements=0, listeners=()):
+        self.path = path
+        self.info = {}
+        self._stages = {}
+        self._branches = {}
+        self._callbacks = tuple(callbacks)
+        self._exporters = tuple(exporters)
+        self._observers = tuple(observers)
+        self._max_statements = max_statements
+        self._listeners = tuple(listeners)
+        # Min-heap of (seconds, seq, statement): the slowest max_statements calls.
+        self._statements = []
+        self._seq = 0
+        self._systems = systems or {}
+        # (name, start, end, thread, kind, attributes) intervals; None without exporters.
+        self._intervals = [] if self._exporters else None
+        self._thread = threading.get_ident()
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._epoch_ns = time.time_ns() - int(self._started * 1e9)
+        self._total = None
+
+    def add(self, stage, seconds, started=None):
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+        self._interval(stage, started, seconds)
+
+    def _interval(self, name, started, seconds, kind="INTERNAL", attributes=None):
+        if self._intervals is None or started is None:
+            return
+        interval = (name, started, started + seconds, threading.get_ident(), kind, attributes)
+        with self._lock:
+            self._intervals.append(interval)
+
+    def twig(self, method, index, twig, provider=None):
+        return TwigTrace(self, method, index, twig, provider)
+
+    def _branch(self, method):
+        branch = self._branches.get(method)
+        if branch is None:
+            branch = self._branches[method] = {
+                "method": method, "runs": 0, "seconds": 0.0, "rows": 0, "bytes": 0, "twigs": {},
+            }
+        return branch
+
+    def branch(self, method, seconds, output, started=None, rows=None, nbytes=None):
+        """Count one run of a branch's own SQL (array input and parent_keys chunks run more).
+
+        rows / nbytes count a streamed output that has been read already.
+        """
+        if rows is None:
+            rows, nbytes = _count(output)
+        if rows is None and output is not None:
+            rows = len(output)
+        self._interval("branch " + method, started, seconds,
+                       attributes={"yaal.branch": method, "db.response.returned_rows": rows or 0})
+        with self._lock:
+            branch = self._branch(method)
+            branch["runs"] += 1
+            branch["seconds"] += seconds
+            branch["rows"] += rows or 0
+            branch["bytes"] += nbytes or 0
+
+    def _twig_done(self, twig_trace, elapsed, compile_time, fetch, rows, nbytes, streamed=False):
+        """Add one provider call to the counters.
+
+        A streamed call's rows are not known yet: its statement is recorded
+        by _stream_done, which gets the returned (twig counters, span
+        attributes) pair.
+        """
+        execute = max(elapsed - compile_time - fetch, 0.0)
+        attributes = None
+        if self._intervals is not None:
+            attributes = self._twig_attributes(twig_trace, rows)
+            self._interval(
+                "twig %s[%d]" % (twig_trace.method, twig_trace.index),
+                twig_trace._started, elapsed, "CLIENT", attributes,
+            )
+        if (self._max_statements or self._listeners) and not streamed:
+            self._statement(twig_trace, elapsed, rows)
+        with self._lock:
+            stages = self._stages
+            stages["execute"] = stages.get("execute", 0.0) + execute
+            if compile_time:
+                stages["compile"] = stages.get("compile", 0.0) + compile_time
+            if fetch:
+                stages["fetch"] = stages.get("fetch", 0.0) + fetch
+            twigs = self._branch(twig_trace.method)["twigs"]
+            twig = twigs.get(twig_trace.index)
+            if twig is None:
+                twig = twigs[twig_trace.index] = {
+                    "index": twig_trace.index,
+                    "connection": twig_trace.twig.get("connection"),
+                    "runs": 0, "execute": 0.0, "compile": 0.0, "fetch": 0.0, "rows": 0, "bytes": 0,
+                }
+            twig["runs"] += 1
+            twig["execute"] += execute
+            twig["compile"] += compile_time
+            twig["fetch"] += fetch
+            twig["rows"] += rows or 0
+            twig["bytes"] += nbytes or 0
+        return twig, attributes
+
+    def _stream_done(self, twig_trace, elapsed, done, rows, nbytes):
+        twig, attributes = done
+        with self._lock:
+            twig["rows"] += rows
+            twig["bytes"] += nbytes
+            if attributes is not None:
+                attributes["db.response.returned_rows"] = rows
+        if self._max_statements or self._listeners:
+            self._statement(twig_trace, elapsed, rows)
+
+    def _statement(self, twig_trace, elapsed, rows):
+        names, values = twig_trace.binds or ((), ())
+        statement = {
+            "branch": twig_trace.method,
+            "twig": twig_trace.index,
+            "connection": twig_trace.twig.get("connection"),
+            "sql": twig_trace.sql,
+            "fingerprint": sql_fingerprint(twig_trace.sql) if twig_trace.sql is not None else None,
+            "parameters": list(names),
+            "binds": list(values),
+            "variant": _variant(twig_trace.variant),
+            "cache_hit": twig_trace.cache_hit,
+            "duration_ms": _ms(elapsed),
+            "rows": rows,
+        }
+        for listener in self._listeners:
+            try:
+                listener(self.path, statement)
+            except Exception:
+                pass
+        with self._lock:
+            self._seq += 1
+            if not self._max_statements:
+                return
+            item = (elapsed, self._seq, statement)
+            if len(self._statements) < self._max_statements:
+                heapq.heappush(self._statements, item)
+            else:
+                heapq.heappushpop(self._statements, item)
+
+    def statements(self):
+        """The slowest recorded provider calls (see __init__), in execution order."""
+        with self._lock:
+            items = sorted(self._statements, key=lambda item: item[1])
+        return [statement for _elapsed, _seq, statement in items]
+
+    @property
+    def statement_count(self):
+        """Provider calls seen while recording statements, kept or not."""
+        return self._seq
+
+    def _twig_attributes(self, twig_trace, rows):
+        connection = twig_trace.twig.get("connection")
+        attributes = {
+            "yaal.branch": twig_trace.method,
+            "yaal.twig": twig_trace.index,
+            "yaal.connection": connection,
+            "yaal.provider": twig_trace.provider,
+            "db.system": self._systems.get(connection),
+        }
+        if twig_trace.sql is not None:
+            attributes["db.statement"] = twig_trace.sql
+            attributes["yaal.sql.fingerprint"] = sql_fingerprint(twig_trace.sql)
+        if rows is not None:
+            attributes["db.response.returned_rows"] = rows
+        return {key: value for key, value in attributes.items() if value is not None}
+
+    @property
+    def total(self):
+        """Seconds since the trace started (fixed once finished)."""
+        if self._total is not None:
+            return self._total
+        return time.perf_counter() - self._started
+
+    def to_dict(self):
+        """The _trace block: times in milliseconds, stages in pipeline order."""
+        with self._lock:
+            branches = []
+            for branch in self._branches.values():
+                branches.append({
+                    "method": branch["method"],
+                    "runs": branch["runs"],
+                    "ms": _ms(branch["seconds"]),
+                    "rows": branch["rows"],
+                    "bytes": branch["bytes"],
+                    "twigs": [
+                        {
+                            "index": twig["index"],
+                            "connection": twig["connection"],
+                            "runs": twig["runs"],
+                            "execute_ms": _ms(twig["execute"]),
+                            "compile_ms": _ms(twig["compile"]),
+                            "fetch_ms": _ms(twig["fetch"]),
+                            "rows": twig["rows"],
+                            "bytes": twig["bytes"],
+                        }
+                        for _index, twig in sorted(branch["twigs"].items())
+                    ],
+                })
+            stages = {name: _ms(self._stages[name]) for name in STAGES if name in self._stages}
+        trace = {"path": self.path, "total_ms": _ms(self.total), "stages": stages}
+        trace.update(self.info)
+        trace["rows"] = sum(branch["rows"] for branch in branches)
+        trace["bytes"] = sum(branch["bytes"] for branch in branches)
+        trace["branches"] = branches
+        return trace
+
+    def spans(self):
+        """The recorded intervals as Spans, root first; [] without exporters.
+
+        Each interval's parent is the innermost one on the same thread that
+        contains it, or the root span.
+        """
+        if self._intervals is None:
+            return []
+        with self._lock:
+            intervals = sorted(self._intervals, key=lambda item: (item[1], -item[2]))
+        trace_id = "%032x" % random.getrandbits(128)
+        status = self.info.get("status")
+        attributes = {"yaal.path": self.path}
+        if status is not None:
+            attributes["yaal.status"] = status
+        root = Span(
+            "yaal.query", trace_id, _span_id(), None, self._ns(self._started),
+            self._ns(self._started + self.total), attributes=attributes,
+            status="ERROR" if status in ("error", "exception") else "OK",
+            thread_id=self._thread,
+        )
+        spans = [root]
+        stacks = {}
+        for name, start, end, thread, kind, attributes in intervals:
+            stack = stacks.setdefault(thread, [])
+            while stack and stack[-1][1] < end:
+                stack.pop()
+            parent = stack[-1][0] if stack else root
+            span = Span(name, trace_id, _span_id(), parent.span_id, self._ns(start),
+                        self._ns(end), kind, dict(attributes or {}), thread_id=thread)
+            spans.append(span)
+            stack.append((span, end))
+        return spans
+
+    def _ns(self, seconds):
+        return self._epoch_ns + int(seconds * 1e9)
+
+    def finish(self):
+        """Stop the clock, call each callback with to_dict() and export spans.
+
+        Later calls do nothing. Callbacks and exporters run on the querying
+        thread; an exception from one is ignored, so tracing never changes
+        a query's outcome.
+        """
+        if self._total is not None:
+            return
+        self._total = time.perf_counter() - self._started
+        if self._callbacks:
+            trace = self.to_dict()
+            for callback in self._callbacks:
+                try:
+                    callback(trace)
+                except Exception:
+                    pass
+        if self._exporters:
+            spans = self.spans()
+            for exporter in self._exporters:
+                try:
+                    exporter.export(spans)
+                except Exception:
+                    pass
+        for observer in self._observers:
+            try:
+                observer(self)
+            except Exception:
+                pass
+
+
+def chrome_trace_events(spans, pid=None):
+    """Spans as Chrome trace_event "complete" (ph "X") events; times in microseconds."""
+    pid = os.getpid() if pid is None else pid
+    events = []
+    for span in spans:
+        args = dict(span.attributes)
+        args["span_id"] = span.span_id
+        if span.parent_span_id is not None:
+            args["parent_span_id"] = span.parent_span_id
+        else:
+            args["trace_id"] = span.trace_id
+        events.append({
+            "name": span.name,
+            "cat": "yaal",
+            "ph": "X",
+            "ts": span.start_time_unix_nano / 1000.0,
+            "dur": span.duration_ns / 1000.0,
+            "pid": pid,
+            "tid": span.thread_id or 0,
+            "args": args,
+        })
+    return events
+
+
+class ChromeTraceExporter:
+    """Span exporter that keeps Chrome trace_event JSON in memory.
+
+    Register it with Yaal.add_span_exporter, then write() the file and open
+    it in chrome://tracing, https://ui.perfetto.dev or speedscope. Only the
+    newest max_events events are kept. With path, force_flush() and
+    shutdown() write there.
+    """
+
+    def __init__(self, path=None, max_events=100000):
+        self.path = path
+        self._events = collections.deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        events = chrome_trace_events(spans)
+        with self._lock:
+            self._events.extend(events)
+
+    def to_dict(self):
+        with self._lock:
+            events = list(self._events)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path=None):
+        """Write the events collected so far as JSON to path (default: self.path)."""
+        path = path or self.path
+        if path is None:
+            raise ValueError("ChromeTraceExporter.write needs a path")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, default=str)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def force_flush(self):
+        if self.path is not None:
+            self.write()
+
+    def shutdown(self):
+        self.force_flush()